@@ -1,8 +1,93 @@
-from flask import Flask, send_file
+import os
+import secrets
+import tempfile
+import threading
+from collections import OrderedDict
+from urllib.parse import urlencode
+from flask import Flask, send_file, request, jsonify
+from werkzeug.routing import BaseConverter
 from emaMXL import slicer
-import xml.etree.ElementTree as ET
+from emaMXL.cache import score_cache, load_score_index
+from emaMXL.emaexp import parse_ema_exp
+from emaMXL.emaexpfull import EmaExpFull
+from emaMXL.exceptions import MXMLException, BadApiRequest, WorkerPoolBusy, WorkerTimeout
+from emaMXL.metrics import metrics
+from emaMXL.remote import RemoteScoreFetcher, remote_url
+from emaMXL.resultcache import ResultCache, score_fingerprint, result_key
+from emaMXL.streaming import iterslice_tree, prepare_slice, buffered, gzip_chunks
+from emaMXL.workers import SlicePool
+from emaMXL import xmlbackend
+
+
+class BeatsConverter(BaseConverter):
+    """ Matches the beats segment of an EMA address, which always starts with '@'. The score identifier before it
+        may contain slashes, so this is what tells the segments of the expression from those of the identifier. """
+    regex = '@[^/]*'
+
 
 app = Flask(__name__)
+app.url_map.converters['beats'] = BeatsConverter
+
+# Estimated memory budget for parsed scores kept between requests.
+score_cache.resize(int(os.environ.get("EMA_SCORE_CACHE_BYTES", score_cache.max_bytes)))
+# Remote scores are downloaded once into this directory and revalidated on later requests.
+fetcher = RemoteScoreFetcher(os.environ.get("EMA_REMOTE_CACHE_DIR", os.path.join(tempfile.gettempdir(), "ema-scores")),
+                             pool_size=int(os.environ.get("EMA_REMOTE_POOL_SIZE", 16)))
+# Stage timings and slicing counters are served from /metrics; set EMA_METRICS=0 to turn them off.
+metrics.enabled = os.environ.get("EMA_METRICS", "1") not in ("", "0")
+# Serialized selections, by score content and canonical selection; optionally also kept on disk.
+result_cache = ResultCache(int(os.environ.get("EMA_RESULT_CACHE_BYTES", 256 * 1024 * 1024)),
+                           disk_dir=os.environ.get("EMA_RESULT_CACHE_DIR"),
+                           max_disk_bytes=int(os.environ.get("EMA_RESULT_CACHE_DISK_BYTES", 0)) or None)
+# Responses are gzipped for clients that accept it unless EMA_GZIP=0.
+EMA_GZIP = os.environ.get("EMA_GZIP", "1") not in ("", "0")
+# With EMA_WORKERS > 0, slicing runs in that many worker processes instead of the request thread.
+EMA_WORKERS = int(os.environ.get("EMA_WORKERS", 0))
+# With EMA_SPLIT_PARTS=1, the workers slice the parts of each selection in parallel (for scores with many parts).
+EMA_SPLIT_PARTS = os.environ.get("EMA_SPLIT_PARTS", "0") not in ("", "0")
+pool = None
+pool_lock = threading.Lock()
+# Cursors of the pages route by token, least recently used first. Each keeps its score's parsed tree alive.
+EMA_CURSORS = int(os.environ.get("EMA_CURSORS", 256))
+cursors = OrderedDict()
+cursors_lock = threading.Lock()
+
+
+def get_pool():
+    """ Returns the worker pool, starting it on first use, or None if slicing runs in-process. """
+    global pool
+    if EMA_WORKERS > 0 and pool is None:
+        with pool_lock:
+            if pool is None:
+                pool = SlicePool(EMA_WORKERS,
+                                 max_queue=int(os.environ.get("EMA_WORKER_QUEUE", 64)),
+                                 timeout=float(os.environ.get("EMA_WORKER_TIMEOUT", 30)),
+                                 max_tasks_per_child=int(os.environ.get("EMA_WORKER_MAX_TASKS", 200)) or None)
+    return pool
+
+
+def resolve_score(path):
+    """ Maps the score identifier of a request to a local file, fetching it first if it is a URL. """
+    url = remote_url(path)
+    if not url:
+        return path
+    with metrics.stage('fetch'):
+        return fetcher.fetch(url)
+
+
+@app.errorhandler(MXMLException)
+def handle_mxml_exception(ex):
+    return app.response_class(ex.message, status=400, mimetype='text/plain')
+
+
+@app.errorhandler(WorkerPoolBusy)
+def handle_worker_pool_busy(ex):
+    return app.response_class(ex.message, status=503, mimetype='text/plain', headers={'Retry-After': '1'})
+
+
+@app.errorhandler(WorkerTimeout)
+def handle_worker_timeout(ex):
+    return app.response_class(ex.message, status=504, mimetype='text/plain')
 
 
 @app.route('/', methods=['GET'])
@@ -10,12 +95,202 @@ def index():
     return "Read the <a href=\"https://github.com/umd-mith/ema/blob/master/docs/api.md\">API specification</a>."
 
 
-@app.route('/<path:path>/<measures>/<staves>/<beats>', methods=["GET"])
-@app.route('/<path:path>/<measures>/<staves>/<beats>/<completeness>', methods=["GET"])
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """ Prometheus scrape target: per-stage latency histograms, slicing counters and score cache statistics. """
+    return app.response_class(metrics_text(), mimetype='text/plain; version=0.0.4')
+
+
+def streaming_response(chunks, mimetype, gzipped, etag=None):
+    """ Sends chunks as they are produced (chunked transfer encoding), gzipped if requested. """
+    headers = {'Vary': 'Accept-Encoding'}
+    if etag is not None:
+        headers['ETag'] = etag
+    if gzipped:
+        chunks = gzip_chunks(chunks)
+        headers['Content-Encoding'] = 'gzip'
+    return app.response_class(chunks, mimetype=mimetype, headers=headers)
+
+
+def etag_matches(if_none_match, key):
+    """ Checks an If-None-Match header against either encoding of the result with the given key. """
+    if if_none_match.strip() == '*':
+        return True
+    for tag in if_none_match.split(','):
+        tag = tag.strip()
+        if tag.startswith('W/'):
+            tag = tag[2:]
+        if tag in (f'"{key}"', f'"{key}-gzip"'):
+            return True
+    return False
+
+
+def metrics_text():
+    lines = [metrics.render().rstrip("\n"),
+             "# TYPE ema_score_cache_hits_total counter", f"ema_score_cache_hits_total {score_cache.hits}",
+             "# TYPE ema_score_cache_misses_total counter", f"ema_score_cache_misses_total {score_cache.misses}",
+             "# TYPE ema_score_cache_bytes gauge", f"ema_score_cache_bytes {score_cache.current_bytes}",
+             "# TYPE ema_result_cache_hits_total counter", f"ema_result_cache_hits_total {result_cache.hits}",
+             "# TYPE ema_result_cache_misses_total counter", f"ema_result_cache_misses_total {result_cache.misses}",
+             "# TYPE ema_result_cache_bytes gauge", f"ema_result_cache_bytes {result_cache.current_bytes}", ""]
+    return "\n".join(lines)
+
+
+@app.route('/<path:path>/<measures>/<staves>/<beats:beats>', methods=["GET"])
+@app.route('/<path:path>/<measures>/<staves>/<beats:beats>/<completeness>', methods=["GET"])
 def address(path, measures, staves, beats, completeness=None):
-    tree = slicer.slice_score_path(path, "/".join([measures, staves, beats, completeness if completeness else ""]))
-    return app.response_class(ET.tostring(tree.getroot()), mimetype='application/xml')
+    exp_str = "/".join([measures, staves, beats, completeness if completeness else ""])
+    score_path = resolve_score(path)
+    score_index, ema_exp_full, key = expand_address(score_path, exp_str)
+    gzipped = EMA_GZIP and 'gzip' in request.headers.get('Accept-Encoding', '')
+    etag = etag_for(key, gzipped)
+    if etag_matches(request.headers.get('If-None-Match', ''), key):
+        return app.response_class(status=304, headers={'ETag': etag, 'Vary': 'Accept-Encoding'})
+
+    data = result_cache.get(key)
+    if data is not None:
+        chunks = [data]
+    elif score_index is None:
+        with metrics.stage('slice'):
+            data = pool.slice_parts(score_path, exp_str) if EMA_SPLIT_PARTS else pool.slice(score_path, exp_str)
+        result_cache.put(key, data)
+        chunks = [data]
+    else:
+        # Anything that can fail on the score's content fails here, while the response can still report it.
+        prepared = prepare_address(score_index, ema_exp_full, exp_str)
+        # The selection is serialized while it is sent, one measure at a time, instead of being built up front.
+        chunks = result_cache.tee(key, buffered(iterslice_tree(score_index, ema_exp_full, prepared)))
+    return streaming_response(chunks, 'application/xml', gzipped, etag)
+
+
+def expand_address(score_path, exp_str):
+    """ Parses and expands the expression of an address against its score, and computes the key of its result.
+    Shared by every front end (see asgi.py).
+
+    :return: The index of the score (None if the workers slice, as they parse the score themselves; here only its
+             shape is needed, to expand the expression), the EmaExpFull and the result_key.
+    :rtype: (ScoreIndex, EmaExpFull, str)
+    """
+    score_index = load_score_index(score_path) if get_pool() is None else None
+    score_digest, score_info = score_fingerprint(score_path, score_index)
+    with metrics.stage('parse_expression'):
+        ema_exp = parse_ema_exp(exp_str)
+    with metrics.stage('expand'):
+        ema_exp_full = EmaExpFull(score_index or score_info, ema_exp)
+    return score_index, ema_exp_full, result_key(score_digest, ema_exp_full)
+
+
+def prepare_address(score_index, ema_exp_full, exp_str):
+    """ Runs prepare_slice, reporting its failures as the MXMLException slice_score_path would raise. """
+    try:
+        with metrics.stage('slice'):
+            return prepare_slice(score_index, ema_exp_full)
+    except Exception as ex:
+        raise slicer.as_api_error(exp_str, ex)
+
+
+def etag_for(key, gzipped):
+    # Strong ETags must differ between the identity and gzip encodings of a result.
+    return f'"{key}-gzip"' if gzipped else f'"{key}"'
+
+
+@app.route('/<path:path>/pages', methods=["GET"])
+def pages(path):
+    """ Serves a score one window of measures at a time, for viewers that scroll through it. Query arguments:
+    staves (default all), beats (default @all), completeness, size (measures per window, default 8), start (the first
+    measure of the window, default 1) and cursor. The measures served are given in the X-EMA-Measures header, and the
+    Link header gives the URL of the next window, with a cursor that keeps the parsed score and attribute state.
+    The route follows the score rather than preceding it, so it shadows no score path: addresses end with beats. """
+    data, window, next_args = slice_page(resolve_score(path), request.args)
+    gzipped = EMA_GZIP and 'gzip' in request.headers.get('Accept-Encoding', '')
+    response = streaming_response([data], 'application/xml', gzipped)
+    response.headers['X-EMA-Measures'] = window
+    if next_args is not None:
+        response.headers['Link'] = f'<{request.path}?{urlencode(next_args)}>; rel="next"'
+    return response
+
+
+def slice_page(score_path, args):
+    """ Slices the window of measures a pages request asks for. Shared by every front end (see asgi.py).
+
+    :param score_path: A filepath to a MusicXML score.
+    :type score_path: str
+    :param args: The query arguments of the request.
+    :type args: Mapping[str, str]
+    :return: The serialized window, the measures it holds ("start-end"), and the query arguments of the next window,
+             or None if this is the last one.
+    :rtype: (bytes, str, dict)
+    """
+    staves, beats = args.get('staves', 'all'), args.get('beats', '@all')
+    completeness = args.get('completeness') or None
+    try:
+        size = int(args.get('size', 8))
+        start = int(args['start']) if 'start' in args else None
+    except ValueError:
+        raise BadApiRequest("The window size and start must be integers.")
+    score_index = load_score_index(score_path)
+    cursor = take_cursor(args.get('cursor'), score_index, (staves, beats, completeness, size), start)
+    if cursor is None:
+        cursor = slicer.MeasureCursor(score_index, staves, beats, completeness, size, start or 1)
+    window = f"{cursor.start}-{cursor.window_end(cursor.start)}"
+    tree = next(cursor)
+    with metrics.stage('serialize'):
+        data = xmlbackend.tostring(tree.getroot())
+    if cursor.done:
+        return data, window, None
+    return data, window, dict(args.items(), start=cursor.start, cursor=put_cursor(cursor))
+
+
+def take_cursor(token, score_index, params, start):
+    """ Removes the cursor with the given token and returns it, if it is still open and continues from start with the
+    same parameters on the current version of the score. Otherwise the window is sliced by a new cursor. """
+    if not token:
+        return None
+    with cursors_lock:
+        cursor = cursors.pop(token, None)
+    if cursor is None or cursor.score_index is not score_index or (start is not None and cursor.start != start):
+        return None
+    if (cursor.staves, cursor.beats, cursor.completeness, cursor.size) != params:
+        return None
+    return cursor
+
+
+def put_cursor(cursor):
+    """ Keeps a cursor for the next window and returns its token, closing the least recently used cursors if there
+    are more than EMA_CURSORS. """
+    token = secrets.token_urlsafe(16)
+    with cursors_lock:
+        cursors[token] = cursor
+        while len(cursors) > EMA_CURSORS:
+            cursors.popitem(last=False)
+    return token
+
+
+@app.route('/<path:path>', methods=["POST"])
+def address_many(path):
+    """ Evaluates a batch of EMA expressions against one score.
+    The request body is a JSON object {"expressions": ["measures/staves/beats[/completeness]", ...]}. """
+    exp_strs = request.get_json(force=True).get("expressions", [])
+    results = []
+    score_path = resolve_score(path)
+    if get_pool() is not None:
+        with metrics.stage('slice'):
+            outputs = pool.slice_many(score_path, exp_strs)
+    else:
+        outputs = slicer.slice_many(score_path, exp_strs)
+    with metrics.stage('serialize'):
+        for exp_str, result in zip(exp_strs, outputs):
+            if isinstance(result, Exception):
+                results.append({"expression": exp_str, "error": result.message})
+            else:
+                xml = result if isinstance(result, bytes) else xmlbackend.tostring(result.getroot())
+                results.append({"expression": exp_str, "xml": xml.decode()})
+        return jsonify({"results": results})
 
 
 if __name__ == "__main__":
-    app.run(debug=True)
+    if EMA_WORKERS > 0:
+        # Request threads only wait on the workers; the debug reloader would start a second pool.
+        app.run(threaded=True)
+    else:
+        app.run(debug=True)
@@ -0,0 +1,291 @@
+""" Asynchronous (ASGI) front end to the EMA service of api.py. It serves:
+    GET /                                  the index page
+    GET /metrics                           the Prometheus metrics
+    GET /<score>/<measures>/<staves>/<beats>[/<completeness>]
+                                           a selection, with api.py's result cache, ETags (304 on If-None-Match),
+                                           gzip (EMA_GZIP) and part splitting (EMA_SPLIT_PARTS)
+    GET /<score>/pages?<arguments>         a window of measures, with the cursors of api.py's pages
+    POST /<score>                          a batch of expressions, as api.py's address_many
+
+Connections are held by the event loop rather than by threads, so one process can keep thousands of slow clients
+open. Fetching and parsing scores happen on a small thread pool and slicing on the worker processes of api.py's
+SlicePool (EMA_WORKERS > 0) or a thread pool, so the loop itself never blocks. Serve with any ASGI server, e.g.
+    uvicorn asgi:app
+"""
+import asyncio
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qsl, urlencode
+import api
+from emaMXL.exceptions import MXMLException, BadApiRequest, WorkerPoolBusy, WorkerTimeout
+from emaMXL.metrics import metrics
+from emaMXL.streaming import iterslice_tree, gzip_chunks
+from emaMXL.workers import slice_to_bytes, slice_many_to_bytes
+
+# Requests being served at once, across all scores and per score; further requests wait up to EMA_ASGI_WAIT seconds.
+MAX_CONCURRENCY = int(os.environ.get("EMA_ASGI_MAX_CONCURRENCY", 64))
+MAX_PER_SCORE = int(os.environ.get("EMA_ASGI_MAX_PER_SCORE", 8))
+WAIT_TIMEOUT = float(os.environ.get("EMA_ASGI_WAIT", 10))
+MAX_BODY_BYTES = 1024 * 1024
+
+io_executor = ThreadPoolExecutor(int(os.environ.get("EMA_ASGI_IO_THREADS", 32)), thread_name_prefix='ema-io')
+slice_executor = ThreadPoolExecutor(int(os.environ.get("EMA_ASGI_SLICE_THREADS", os.cpu_count() or 1)),
+                                    thread_name_prefix='ema-slice')
+
+
+class ConcurrencyLimiter(object):
+    """ Bounds the number of requests in progress, both in total and for each key (score), so that a burst of
+        requests for one score cannot take every slot. Waiting requests hold no thread, only a coroutine.
+    """
+    def __init__(self, total, per_key, wait_timeout):
+        self.total = total
+        self.per_key = per_key
+        self.wait_timeout = wait_timeout
+        self._total = None
+        self._keys = {}  # key -> [Semaphore, number of requests holding or waiting for it]
+
+    async def acquire(self, key):
+        """ Waits for a slot for key.
+
+        :raises WorkerPoolBusy: If no slot frees up within wait_timeout seconds.
+        """
+        if self._total is None:
+            # Created lazily so that it belongs to the server's event loop.
+            self._total = asyncio.Semaphore(self.total)
+        entry = self._keys.get(key)
+        if entry is None:
+            entry = self._keys[key] = [asyncio.Semaphore(self.per_key), 0]
+        entry[1] += 1
+        try:
+            await asyncio.wait_for(self._acquire(entry[0]), self.wait_timeout)
+        except asyncio.TimeoutError:
+            self._forget(key, entry)
+            raise WorkerPoolBusy("Too many requests are in progress; try again later.")
+        except BaseException:
+            self._forget(key, entry)
+            raise
+
+    async def _acquire(self, key_semaphore):
+        await key_semaphore.acquire()
+        try:
+            await self._total.acquire()
+        except BaseException:
+            key_semaphore.release()
+            raise
+
+    def release(self, key):
+        entry = self._keys[key]
+        self._total.release()
+        entry[0].release()
+        self._forget(key, entry)
+
+    def _forget(self, key, entry):
+        entry[1] -= 1
+        if entry[1] == 0:
+            del self._keys[key]
+
+
+limiter = ConcurrencyLimiter(MAX_CONCURRENCY, MAX_PER_SCORE, WAIT_TIMEOUT)
+
+
+async def app(scope, receive, send):
+    """ The ASGI application. """
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+        return
+    if scope['type'] != 'http':
+        return
+    method = scope['method']
+    path = scope['path']  # Already percent-decoded by the server
+    try:
+        if method == 'GET' and path == '/':
+            await send_response(send, 200, api.index().encode('utf-8'), 'text/html; charset=utf-8')
+        elif method == 'GET' and path == '/metrics':
+            await send_response(send, 200, api.metrics_text().encode('utf-8'), 'text/plain; version=0.0.4')
+        elif method == 'GET' and path.endswith('/pages'):
+            args = query_arguments(scope)
+            await serve(path[1:-len('/pages')], serve_page, send, request_headers(scope), args, path)
+        elif method == 'GET':
+            score, exp_str = split_address(path)
+            await serve(score, serve_address, send, request_headers(scope), exp_str)
+        elif method == 'POST':
+            exp_strs = parse_expressions(await read_body(receive))
+            outputs = await serve(path.lstrip('/'), run_slice, slice_many_to_bytes, exp_strs)
+            await send_response(send, 200, json.dumps({"results": batch_results(exp_strs, outputs)}).encode('utf-8'),
+                                'application/json')
+        else:
+            await send_response(send, 405, b"Method not allowed.", 'text/plain')
+    except MXMLException as ex:
+        await send_response(send, error_status(ex), ex.message.encode('utf-8'), 'text/plain',
+                            [(b'retry-after', b'1')] if isinstance(ex, WorkerPoolBusy) else [])
+
+
+async def serve(score, handler, *args):
+    """ Resolves a score and awaits handler(score_path, *args), within the concurrency limits. """
+    loop = asyncio.get_running_loop()
+    await limiter.acquire(score)
+    try:
+        if api.remote_url(score):
+            score_path = await loop.run_in_executor(io_executor, api.resolve_score, score)
+        else:
+            score_path = score
+        return await handler(score_path, *args)
+    finally:
+        limiter.release(score)
+
+
+async def run_slice(score_path, func, arg):
+    """ Runs func(score_path, arg) off the event loop: in the worker processes if there are any, else in a thread. """
+    pool = api.get_pool()
+    with metrics.stage('slice'):
+        if pool is None:
+            return await asyncio.get_running_loop().run_in_executor(slice_executor, func, score_path, arg)
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(pool.start(func, (score_path, arg))), pool.timeout)
+        except asyncio.TimeoutError:
+            raise WorkerTimeout(f"The request did not finish within {pool.timeout} seconds.")
+
+
+async def serve_address(score_path, send, headers, exp_str):
+    """ Sends the selection of exp_str from a score, as api.address does, but in one body rather than streamed. """
+    loop = asyncio.get_running_loop()
+    pool = api.get_pool()
+    # Without workers this loads the score, which is CPU-bound; with them it only reads the score's fingerprint.
+    score_index, ema_exp_full, key = await loop.run_in_executor(slice_executor if pool is None else io_executor,
+                                                                api.expand_address, score_path, exp_str)
+    gzipped = api.EMA_GZIP and 'gzip' in headers.get('accept-encoding', '')
+    response_headers = [(b'etag', api.etag_for(key, gzipped).encode('latin-1')), (b'vary', b'Accept-Encoding')]
+    if api.etag_matches(headers.get('if-none-match', ''), key):
+        await send_response(send, 304, b'', None, response_headers)
+        return
+
+    data = api.result_cache.get(key)
+    if data is None:
+        if pool is None:
+            data = await loop.run_in_executor(slice_executor, slice_address, score_index, ema_exp_full, exp_str)
+        elif api.EMA_SPLIT_PARTS:
+            # slice_parts waits on the workers (and applies the pool's timeout) itself, so it gets a thread.
+            with metrics.stage('slice'):
+                data = await loop.run_in_executor(io_executor, pool.slice_parts, score_path, exp_str)
+        else:
+            data = await run_slice(score_path, slice_to_bytes, exp_str)
+        api.result_cache.put(key, data)
+    if gzipped:
+        data = await loop.run_in_executor(io_executor, lambda: b''.join(gzip_chunks([data])))
+        response_headers.append((b'content-encoding', b'gzip'))
+    await send_response(send, 200, data, 'application/xml', response_headers)
+
+
+async def serve_page(score_path, send, headers, args, path):
+    """ Sends a window of measures of a score, as api.pages does. """
+    loop = asyncio.get_running_loop()
+    data, window, next_args = await loop.run_in_executor(slice_executor, api.slice_page, score_path, args)
+    response_headers = [(b'vary', b'Accept-Encoding'), (b'x-ema-measures', window.encode('latin-1'))]
+    if next_args is not None:
+        response_headers.append((b'link', f'<{path}?{urlencode(next_args)}>; rel="next"'.encode('latin-1')))
+    if api.EMA_GZIP and 'gzip' in headers.get('accept-encoding', ''):
+        data = await loop.run_in_executor(io_executor, lambda: b''.join(gzip_chunks([data])))
+        response_headers.append((b'content-encoding', b'gzip'))
+    await send_response(send, 200, data, 'application/xml', response_headers)
+
+
+def slice_address(score_index, ema_exp_full, exp_str):
+    return b''.join(iterslice_tree(score_index, ema_exp_full, api.prepare_address(score_index, ema_exp_full, exp_str)))
+
+
+def query_arguments(scope):
+    """ Returns the query arguments of an ASGI scope as a dict, keeping the first value of repeated arguments. """
+    args = {}
+    for name, value in parse_qsl(scope.get('query_string', b'').decode('latin-1'), keep_blank_values=True):
+        args.setdefault(name, value)
+    return args
+
+
+def request_headers(scope):
+    """ Returns the request headers of an ASGI scope as a dict of lowercase names to values, joining the values of
+    repeated headers with commas. """
+    headers = {}
+    for name, value in scope.get('headers', []):
+        name, value = name.decode('latin-1').lower(), value.decode('latin-1')
+        headers[name] = f"{headers[name]}, {value}" if name in headers else value
+    return headers
+
+
+def split_address(path):
+    """ Splits /<score>/<measures>/<staves>/<beats>[/<completeness>] into the score and the EMA expression.
+    The score may itself contain slashes; the beats are recognized as the last or second to last segment, whichever
+    starts with '@', as with api.BeatsConverter. """
+    segments = path.lstrip('/').split('/')
+    expression_length = 3 if segments[-1].startswith('@') else 4
+    if len(segments) < expression_length + 1 or not segments[2 - expression_length].startswith('@'):
+        raise BadApiRequest(f"'{path}' is not an EMA address (/<score>/<measures>/<staves>/<beats>[/<completeness>]).")
+    score = "/".join(segments[:-expression_length])
+    exp_str = "/".join(segments[-expression_length:] + ([""] if expression_length == 3 else []))
+    return score, exp_str
+
+
+def parse_expressions(body):
+    try:
+        exp_strs = json.loads(body.decode('utf-8')).get("expressions", [])
+    except (ValueError, AttributeError):
+        raise BadApiRequest("The request body must be a JSON object {\"expressions\": [...]}.")
+    return exp_strs
+
+
+def batch_results(exp_strs, outputs):
+    results = []
+    for exp_str, result in zip(exp_strs, outputs):
+        if isinstance(result, Exception):
+            results.append({"expression": exp_str, "error": result.message})
+        else:
+            results.append({"expression": exp_str, "xml": result.decode()})
+    return results
+
+
+def error_status(ex):
+    if isinstance(ex, WorkerPoolBusy):
+        return 503
+    if isinstance(ex, WorkerTimeout):
+        return 504
+    return 400
+
+
+async def read_body(receive):
+    body = bytearray()
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            break
+        body += message.get('body', b'')
+        if len(body) > MAX_BODY_BYTES:
+            raise BadApiRequest("The request body is too large.")
+        if not message.get('more_body'):
+            break
+    return bytes(body)
+
+
+async def send_response(send, status, body, content_type, headers=()):
+    response_headers = [(b'content-length', str(len(body)).encode('latin-1'))] + list(headers)
+    if content_type is not None:
+        response_headers.insert(0, (b'content-type', content_type.encode('latin-1')))
+    await send({'type': 'http.response.start', 'status': status, 'headers': response_headers})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            if api.pool is not None:
+                api.pool.close()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+if __name__ == "__main__":
+    # uvicorn is not a dependency of the library; any ASGI server can serve asgi:app.
+    import uvicorn
+    uvicorn.run(app, host=os.environ.get("EMA_HOST", "127.0.0.1"), port=int(os.environ.get("EMA_PORT", 8000)))
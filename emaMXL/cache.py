@@ -0,0 +1,121 @@
+import os
+import threading
+from collections import OrderedDict
+from emaMXL.sidecar import read_score_index
+from emaMXL.sources import score_size
+
+# A parsed ElementTree takes roughly ten times the size of the (uncompressed) MusicXML text it was parsed from.
+TREE_SIZE_FACTOR = 10
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+# Loads of different scores wait for each other only if their paths hash to the same one of these locks.
+PATH_LOCK_STRIPES = 64
+
+
+class ScoreCache(object):
+    """ A thread-safe LRU cache of parsed scores, shared by every request in the process.
+
+        Entries are keyed by (absolute path, mtime, size), so an edited score is parsed again on its next request.
+        The cache is bounded by an estimate of the memory held by the cached trees rather than by entry count,
+        since a single orchestral score can outweigh hundreds of small ones.
+        Each entry holds a score's ScoreIndex, which references the parsed tree.
+        Cached trees must never be modified; use slice_score(..., in_place=False) to select from them.
+    """
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES, loader=read_score_index):
+        self.max_bytes = max_bytes
+        self.loader = loader
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # key -> (value, estimated size)
+        self._keys_by_path = {}  # path -> key currently cached for that path
+        self._lock = threading.Lock()
+        self._path_locks = [threading.Lock() for _ in range(PATH_LOCK_STRIPES)]
+
+    def get(self, filepath):
+        """ Returns the cached value for filepath, loading it if it is missing or out of date.
+
+        :param filepath: A filepath to a MusicXML score.
+        :type filepath: str
+        :return: The value produced by the loader (a ScoreIndex by default).
+        """
+        key = score_cache_key(filepath)
+        with self._lock:
+            value = self._lookup(key)
+            if value is not None:
+                return value
+            path_lock = self._path_locks[hash(key[0]) % len(self._path_locks)]
+        # Parse outside of the cache lock so other scores can still be served;
+        # concurrent requests for the same score wait for a single parse.
+        with path_lock:
+            with self._lock:
+                value = self._lookup(key)
+                if value is not None:
+                    return value
+                self.misses += 1
+            value = self.loader(filepath)
+            size = score_size(filepath) * TREE_SIZE_FACTOR
+            with self._lock:
+                self._insert(key, value, size)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._keys_by_path.clear()
+            self.current_bytes = 0
+
+    def resize(self, max_bytes):
+        with self._lock:
+            self.max_bytes = max_bytes
+            self._evict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _lookup(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    def _insert(self, key, value, size):
+        stale_key = self._keys_by_path.get(key[0])
+        if stale_key is not None and stale_key in self._entries:
+            self._remove(stale_key)
+        self._entries[key] = (value, size)
+        self._keys_by_path[key[0]] = key
+        self.current_bytes += size
+        self._evict()
+
+    def _evict(self):
+        # The most recently inserted score is always kept, even if it alone exceeds the budget.
+        while self.current_bytes > self.max_bytes and len(self._entries) > 1:
+            self._remove(next(iter(self._entries)))
+
+    def _remove(self, key):
+        value, size = self._entries.pop(key)
+        self.current_bytes -= size
+        if self._keys_by_path.get(key[0]) == key:
+            del self._keys_by_path[key[0]]
+
+
+def score_cache_key(filepath):
+    """ Identifies a version of a score file by its absolute path, modification time and size. """
+    path = os.path.abspath(filepath)
+    stat = os.stat(path)
+    return path, stat.st_mtime_ns, stat.st_size
+
+
+score_cache = ScoreCache()
+
+
+def load_score_index(filepath):
+    """ Returns the ScoreIndex of the score at filepath from the process-wide cache. Its tree must not be modified. """
+    return score_cache.get(filepath)
+
+
+def load_score(filepath):
+    """ Returns the parsed score at filepath from the process-wide cache. The returned tree must not be modified. """
+    return load_score_index(filepath).tree
@@ -1,6 +1,8 @@
+from functools import lru_cache
 from emaMXL.exceptions import BadApiRequest
 
 COMPLETENESS_VALUES = ['raw', 'signature', 'nospace', 'cut']
+PARSE_CACHE_SIZE = 1024
 
 
 class EmaExp(object):
@@ -40,6 +42,30 @@ class EmaExp(object):
     def fromstring(cls, selection):
         return cls(*selection.split("/"))
 
+    @property
+    def normalized_selection(self):
+        """ The measures/staves/beats of this expression in a canonical form, e.g. '1-1,3/1+2/@1.0-2' -> '1,3/1+2/@1-2'.
+        Expressions with the same normalized selection expand to the same selection on any score. """
+        measures = ",".join(str(r) for r in self.mm_ranges)
+        staves = ",".join("+".join(str(r) for r in stave_ranges) for stave_ranges in self.st_ranges)
+        beats = ",".join("+".join("".join("@" + str(r) for r in beat_ranges) for beat_ranges in measure_beats)
+                         for measure_beats in self.bt_ranges)
+        return f"{measures}/{staves}/{beats}"
+
+    @property
+    def normalized(self):
+        """ The canonical form of the whole expression, including completeness. """
+        if self.completeness is None:
+            return self.normalized_selection
+        return f"{self.normalized_selection}/{self.completeness}"
+
+
+@lru_cache(maxsize=PARSE_CACHE_SIZE)
+def parse_ema_exp(exp_str):
+    """ Returns the EmaExp of an expression string, reusing the one parsed for an identical earlier request.
+    The returned EmaExp is shared between requests and must not be modified. """
+    return EmaExp(exp_str)
+
 
 class EmaRange(object):
     """ Represents a (start, end) pair given in an EMA expression. """
@@ -52,15 +78,18 @@ class EmaRange(object):
         x = range_str.split("-")
         start, end = ema_token(x[0], unit), ema_token(x[-1], unit)
         if start == 'end' and end != 'end':
-            raise BadApiRequest
+            raise BadApiRequest(f"Range '{range_str}' starts at 'end'.")
         if end == 'start' and start != 'start':
-            raise BadApiRequest
+            raise BadApiRequest(f"Range '{range_str}' ends at 'start'.")
         if start == 'all' and end == 'all':
             start, end = 'all', 'all'
         return cls(start, end)
 
     def __str__(self):
-        return f"[{self.start} {self.end}]"
+        """ Formats the range as it would appear in an EMA expression. """
+        if self.start == self.end:
+            return ema_token_str(self.start)
+        return f"{ema_token_str(self.start)}-{ema_token_str(self.end)}"
 
 
 def parse_range_str_list(range_str_list, unit, join=False):
@@ -80,6 +109,13 @@ def parse_range_str_list(range_str_list, unit, join=False):
     return ema_range_list
 
 
+def ema_token_str(token):
+    """ Inverse of ema_token; beats are written without a trailing '.0' and without losing precision. """
+    if isinstance(token, float):
+        return str(int(token)) if token.is_integer() else repr(token)
+    return str(token)
+
+
 def ema_token(token, unit):
     if token == 'all' or token == 'start' or token == 'end':
         return token
@@ -1,5 +1,13 @@
+import math
 import xml.etree.ElementTree as ET
-from emaMXL.emaexp import EmaExp, EmaRange
+from bisect import bisect_left, bisect_right
+from functools import lru_cache
+from emaMXL.emaexp import EmaExp, EmaRange, parse_ema_exp, ema_token_str
+from emaMXL.exceptions import BadApiRequest
+from emaMXL.metrics import metrics
+from emaMXL.scoreindex import ScoreIndex
+
+EXPANSION_CACHE_SIZE = 256
 
 
 class EmaExpFull(object):
@@ -9,11 +17,24 @@ class EmaExpFull(object):
         Our XML slicing will preserve the existing order since we will simply delete non-requested measures.
     """
 
-    def __init__(self, score_info: dict, ema_exp: EmaExp):
+    def __init__(self, score_info, ema_exp: EmaExp):
+        # score_info may be the dict returned by get_score_info_mxl, or a ScoreIndex which the slicer can reuse.
+        self.score_index = None
+        if isinstance(score_info, ScoreIndex):
+            self.score_index = score_info
+            score_info = score_info.score_info
         self.score_info = score_info
-        self.selection = expand_ema_exp(score_info, ema_exp)
+        # Shared with every other request for the same selection on a score of the same shape; read-only.
+        self.selection = expand_selection(ema_exp.normalized_selection,
+                                          score_info['measure']['end'], score_info['staff']['end'])
         self.completeness = ema_exp.completeness
 
+    def canonical(self):
+        """ A string that is equal for any two expressions selecting the same beats with the same completeness on
+        this score, e.g. 1-3/1/@1-2 and 1,2,3/1/@1-1.5@1.5-2, or all/all/@all and start-end/all/@start-end. With
+        'cut', notes are trimmed to the ranges as requested (see BeatIntervals), so the ranges are kept as they are. """
+        return f"{selection_key(self.selection, self.completeness != 'cut')}/{self.completeness or ''}"
+
 
 class EmaRangeFull(object):
     """ Represents a (start, end) pair given in an EMA expression, with 'start', 'end', and 'all' evaluated. """
@@ -43,7 +64,7 @@ class EmaRangeFull(object):
         if time_end != 'end':
             time_end = round((self.end - 1)*factor, 0)
         if isinstance(time_start, float) and isinstance(time_end, float) and time_end < time_start:
-            print(f"Warning: beat-to-time conversion produced end {time_end} before start {time_start}")
+            metrics.count('reversed_beat_ranges')
             time_end = time_start
         return EmaRangeFull(time_start, time_end)
 
@@ -67,44 +88,289 @@ class EmaRangeFull(object):
         return f"[{self.start} {self.end}]"
 
 
+class BeatIntervals(object):
+    """ The beat ranges selected on one staff of one measure, converted to divisions once. Overlapping or touching
+        ranges are merged into sorted, disjoint intervals so that most notes are matched with a single bisect.
+
+        A range [start, end] selects a note if some time t in it satisfies note start < t < note end, which is what
+        EmaRangeFull.contains_note tests. Under that rule merging ranges does not change which notes are selected.
+        For 'cut', a note is trimmed to the last range (in the order requested) that selects it, so the ranges are
+        also kept as given.
+    """
+    def __init__(self, ema_ranges, divisions):
+        """
+        :param ema_ranges: The beat ranges of the staff, as given in EmaExpFull.selection.
+        :type ema_ranges: List[EmaRangeFull]
+        :param divisions: The number of divisions per quarter note in effect for the measure.
+        :type divisions: int
+        """
+        self.ranges = [ema_range.scale_beat(divisions) for ema_range in ema_ranges]
+        bounds = sorted((r.start, math.inf if r.end == 'end' else r.end) for r in self.ranges)
+        self.starts = []
+        self.ends = []
+        self.merged = []  # Whether each interval was merged from more than one range
+        for start, end in bounds:
+            if self.ends and start <= self.ends[-1]:
+                self.ends[-1] = max(self.ends[-1], end)
+                self.merged[-1] = True
+            else:
+                self.starts.append(start)
+                self.ends.append(end)
+                self.merged.append(False)
+
+    def match(self, start_time, end_time):
+        """ Finds the range a note falls in. If the note overlaps several ranges, the last of them (in the order
+        requested) is returned.
+
+        :param start_time: Start time of the note, in divisions.
+        :type start_time: int
+        :param end_time: End time of the note, in divisions.
+        :type end_time: int
+        :return: The matching range (in divisions), or None if the note is not selected.
+        :rtype: EmaRangeFull
+        """
+        # Intervals starting before the note ends; the last of them overlaps the note if it ends after the note starts.
+        i = bisect_left(self.starts, end_time) - 1
+        if i < 0 or self.ends[i] <= start_time:
+            return None
+        for time_range in reversed(self.ranges):
+            if time_range.contains_note(start_time, end_time):
+                return time_range
+
+    def __bool__(self):
+        return bool(self.starts)
+
+
+class RangeMap(object):
+    """ A read-only mapping from integers (measure or staff numbers) to values, stored as sorted, disjoint runs of
+        consecutive keys that share a value. Lookups bisect the runs, so memory and lookup time depend on the number
+        of runs rather than the number of keys.
+
+        Supports the dict operations the slicer uses: `key in m`, `m[key]`, `m.get(key, default)` and iteration over
+        the keys (and items()) in ascending order.
+    """
+    __slots__ = ('starts', 'ends', 'values')
+
+    def __init__(self, runs=()):
+        """
+        :param runs: (start, end, value) triples covering start..end inclusive, sorted and not overlapping.
+        :type runs: Iterable[tuple]
+        """
+        self.starts = []
+        self.ends = []
+        self.values = []
+        for start, end, value in runs:
+            self.starts.append(start)
+            self.ends.append(end)
+            self.values.append(value)
+
+    def find(self, key):
+        """ Returns the index of the run containing key, or -1. """
+        i = bisect_right(self.starts, key) - 1
+        if i < 0 or self.ends[i] < key:
+            return -1
+        return i
+
+    def get(self, key, default=None):
+        i = self.find(key)
+        return default if i < 0 else self.values[i]
+
+    def __contains__(self, key):
+        return self.find(key) >= 0
+
+    def __getitem__(self, key):
+        i = self.find(key)
+        if i < 0:
+            raise KeyError(key)
+        return self.values[i]
+
+    def __iter__(self):
+        for start, end in zip(self.starts, self.ends):
+            yield from range(start, end + 1)
+
+    def __len__(self):
+        return sum(end - start + 1 for start, end in zip(self.starts, self.ends))
+
+    def __bool__(self):
+        return bool(self.starts)
+
+    def items(self):
+        for start, end, value in self.runs():
+            for key in range(start, end + 1):
+                yield key, value
+
+    def runs(self):
+        return zip(self.starts, self.ends, self.values)
+
+    def keys_between(self, low, high):
+        """ Yields the keys k with low <= k <= high in ascending order, skipping runs outside of that window. """
+        for i in range(max(bisect_right(self.starts, low) - 1, 0), len(self.starts)):
+            if self.starts[i] > high:
+                break
+            yield from range(max(self.starts[i], low), min(self.ends[i], high) + 1)
+
+    def intersects(self, low, high):
+        """ Checks if any key k satisfies low <= k <= high. """
+        i = bisect_right(self.starts, high) - 1
+        return i >= 0 and self.ends[i] >= low
+
+
 def expand_ema_exp(score_info, ema_exp):
-    """ Converts an EmaExpression to a List[EmaMeasure]. We use a measure-wise representation.
+    """ Converts an EmaExpression to a measure-wise representation of the selection:
         selection[measure #][staff #] = List[EmaRangeFull]
-    """
-    selection = {}
-    measure_nums = ema_to_list(ema_exp.mm_ranges, score_info['measure'])
-    for m in range(len(measure_nums)):
-        measure_num = measure_nums[m]
 
-        # Handle expression like 1-3/@all/... (staff expression mapping to multiple measures)
-        m2 = m
-        if len(ema_exp.st_ranges) == 1:
-            m2 = 0
+        Both levels are RangeMaps, so a range like 1-end/all/@all is stored as a single run per level and the
+        size of the selection depends on the expression, not on the score.
+    """
+    # Handle expressions like 1-3/1,2,1/... and 1-3/1/@1,@2,@3 (one staff or beat expression per measure)
+    per_measure = len(ema_exp.st_ranges) > 1 or len(ema_exp.bt_ranges) > 1
+    measure_segments = []
+    m = 0
+    for start, end in resolve_ranges(ema_exp.mm_ranges, score_info['measure']):
+        if per_measure:
+            for measure_num in range(start, end + 1):
+                measure_segments.append((measure_num, measure_num, expand_staves(score_info, ema_exp, m)))
+                m += 1
+        elif start <= end:
+            # Handle expression like 1-3/@all/... (staff expression mapping to multiple measures)
+            measure_segments.append((start, end, expand_staves(score_info, ema_exp, 0)))
+    return RangeMap(overlay(measure_segments, merge_staves))
 
-        stave_nums = ema_to_list(ema_exp.st_ranges[m2], score_info['staff'])
-        for s in range(len(stave_nums)):
-            stave_num = stave_nums[s]
 
+def expand_staves(score_info, ema_exp, m):
+    """ Expands the staves and beats selected in the m-th requested measure into (start, end, beats) segments. """
+    try:
+        stave_ranges = ema_exp.st_ranges[0 if len(ema_exp.st_ranges) == 1 else m]
+        measure_beats = ema_exp.bt_ranges[0 if len(ema_exp.bt_ranges) == 1 else m]
+    except IndexError:
+        raise BadApiRequest("The expression selects more measures than it gives staff or beat expressions for.")
+    staff_segments = []
+    s = 0
+    for start, end in resolve_ranges(stave_ranges, score_info['staff']):
+        if len(measure_beats) == 1:
             # Handle expressions like 1,2/1+2,2+3/@1-2 and 1,2/1+2,2+3/@1-2,@all
             # (single beat expression mapping to multiple staves/measures)
-            s2, m2 = s, m
-            if len(ema_exp.bt_ranges) == 1:
-                m2 = 0
-            if len(ema_exp.bt_ranges[m2]) == 1:
-                s2 = 0
-
-            # TODO: What happens if user gives a bad/weird request? e.g. overlapping measures, staves, beats, etc.
-            staff_beats = ema_exp.bt_ranges[m2][s2]  # List of EmaRanges, specifying beats
-
-            if measure_num not in selection:
-                selection[measure_num] = {}
-            sel_staves = selection[measure_num]
-            if stave_num not in sel_staves:
-                sel_staves[stave_num] = []
-            for ema_range in staff_beats:
-                ema_range_full = EmaRangeFull.from_ema_range(ema_range)
-                sel_staves[stave_num].append(ema_range_full)
-    return selection
+            if start <= end:
+                staff_segments.append((start, end, expand_beats(measure_beats[0])))
+            continue
+        for stave_num in range(start, end + 1):
+            if s >= len(measure_beats):
+                raise BadApiRequest("The expression selects more staves than it gives beat expressions for.")
+            staff_segments.append((stave_num, stave_num, expand_beats(measure_beats[s])))
+            s += 1
+    return staff_segments
+
+
+def expand_beats(staff_beats):
+    # TODO: What happens if user gives a bad/weird request? e.g. overlapping measures, staves, beats, etc.
+    return tuple(EmaRangeFull.from_ema_range(ema_range) for ema_range in staff_beats)
+
+
+def merge_staves(staff_segment_lists):
+    """ Combines the staff selections of every request for one measure. """
+    return RangeMap(overlay([segment for segments in staff_segment_lists for segment in segments], merge_beats))
+
+
+def merge_beats(beat_tuples):
+    """ Combines the beat ranges of every request for one staff. """
+    if len(beat_tuples) == 1:
+        return beat_tuples[0]
+    return tuple(ema_range for beats in beat_tuples for ema_range in beats)
+
+
+def overlay(segments, merge):
+    """ Splits possibly overlapping (start, end, value) segments into sorted, disjoint runs. Each run's value is
+    merge() of the values of the segments covering it, in the order the segments were given.
+
+    :param segments: (start, end, value) triples; empty segments (start > end) are ignored.
+    :type segments: List[tuple]
+    :param merge: Combines a list of values into one.
+    :type merge: Callable
+    :return: (start, end, value) triples, as accepted by RangeMap.
+    :rtype: List[tuple]
+    """
+    segments = [segment for segment in segments if segment[0] <= segment[1]]
+    bounds = sorted({segment[0] for segment in segments} | {segment[1] + 1 for segment in segments})
+    runs = []
+    for low, next_low in zip(bounds, bounds[1:]):
+        covering = [value for start, end, value in segments if start <= low <= end]
+        if covering:
+            runs.append((low, next_low - 1, merge(covering)))
+    return runs
+
+
+@lru_cache(maxsize=EXPANSION_CACHE_SIZE)
+def expand_selection(normalized_selection, measure_end, staff_end):
+    """ Cached expand_ema_exp. The selection only depends on the expression and the score's shape, so it is keyed
+    by the normalized expression and the number of measures and staves rather than by the score.
+
+    :param normalized_selection: EmaExp.normalized_selection of the expression.
+    :type normalized_selection: str
+    :param measure_end: The number of measures in the score.
+    :type measure_end: int
+    :param staff_end: The number of staves in the score.
+    :type staff_end: int
+    :return: The selection, which must not be modified.
+    :rtype: RangeMap
+    """
+    score_info = {'measure': {'start': 1, 'end': measure_end},
+                  'staff': {'start': 1, 'end': staff_end}}
+    return expand_ema_exp(score_info, parse_ema_exp(normalized_selection))
+
+
+def selection_key(selection, merge_beats=True):
+    """ Renders a selection canonically: adjacent runs with the same content are joined, and each staff's beat
+    ranges are sorted and merged unless merge_beats is False. Used to recognize equivalent expressions, e.g. as a
+    result cache key. """
+    measures = coalesce_runs((start, end, staves_key(staves, merge_beats)) for start, end, staves in selection.runs())
+    return ",".join(f"{start}-{end}:{staves}" for start, end, staves in measures)
+
+
+def staves_key(staves, merge_beats=True):
+    runs = coalesce_runs((start, end, beats_key(beats, merge_beats)) for start, end, beats in staves.runs())
+    return ";".join(f"{start}-{end}={beats}" for start, end, beats in runs)
+
+
+def beats_key(beats, merge=True):
+    """ Renders the beat ranges of a staff as sorted, merged intervals. Reversed ranges are clamped as scale_beat
+    does, and ranges that overlap or touch are merged as BeatIntervals does, so the key only merges ranges that are
+    merged anyway. If merge is False, the ranges are rendered as they are, in order. """
+    if not merge:
+        return "@".join(f"{ema_token_str(float(r.start))}-{'end' if r.end == 'end' else ema_token_str(float(r.end))}"
+                        for r in beats)
+    bounds = sorted((r.start, math.inf if r.end == 'end' else max(r.end, r.start)) for r in beats)
+    merged = []
+    for start, end in bounds:
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return "@".join(f"{ema_token_str(float(start))}-{'end' if end == math.inf else ema_token_str(float(end))}"
+                    for start, end in merged)
+
+
+def coalesce_runs(runs):
+    """ Joins adjacent (start, end, key) runs with equal keys. """
+    joined = []
+    for start, end, key in runs:
+        if joined and joined[-1][1] + 1 == start and joined[-1][2] == key:
+            joined[-1][1] = end
+        else:
+            joined.append([start, end, key])
+    return joined
+
+
+def resolve_ranges(ema_range_list, start_end):
+    """ Evaluates the 'start', 'end' and 'all' tokens of a list of EmaRanges.
+        :param ema_range_list : List[EmaRange] describing a set of measures or staves.
+        :param start_end      : Dict with keys 'start' and 'end' mapped to values for this evaluation.
+        :return               : Generator of (start, end) int pairs, inclusive; start > end for empty ranges.
+    """
+    for ema_range in ema_range_list:
+        # 'all' covers everything from start to end.
+        start = start_end['start'] if ema_range.start == 'all' else start_end.get(ema_range.start, ema_range.start)
+        end = start_end['end'] if ema_range.end == 'all' else start_end.get(ema_range.end, ema_range.end)
+        yield start, end
 
 
 def ema_to_list(ema_range_list, start_end):
@@ -113,34 +379,11 @@ def ema_to_list(ema_range_list, start_end):
         :param start_end      : Dict with keys 'start' and 'end' mapped to values for this evaluation.
         :return ema_list      : List[int] of all values specified in the EmaRanges
     """
-    ema_list = []
-    for ema_range in ema_range_list:
-        start = start_end.get(ema_range.start, ema_range.start)
-        end = start_end.get(ema_range.end, ema_range.end)
-        ema_list += [x for x in range(start, end + 1)]
-    return ema_list
+    return [x for start, end in resolve_ranges(ema_range_list, start_end) for x in range(start, end + 1)]
 
 
-# By-measure attributes are handled during slicing.
-# TODO: Maybe we can also store time signature information.
-#  we *could* get this info during the slicing but that would make it even more complicated
 def get_score_info_mxl(tree: ET.ElementTree):
-    score_info = {'measure': {'start': 1},
-                  'staff': {'start': 1}}
-    # One part may contain multiple staves.
-    parts = tree.getroot().findall('part')
-    total_staves = 0
-    for part in parts:
-        part_staves = 1
-        for measure in part:
-            attributes = measure.find("attributes")
-            if attributes is not None:
-                staves = attributes.find("staves")
-                if staves is not None:
-                    part_staves = int(staves.text)
-        total_staves += part_staves
-
-    measures = parts[0].findall('measure')
-    score_info['measure']['end'] = len(measures)
-    score_info['staff']['end'] = total_staves
-    return score_info
+    """ Returns the measure and staff 'start'/'end' values of a score. Prefer building a ScoreIndex once per score
+    and passing it to EmaExpFull directly, since this walks the whole tree. """
+    with metrics.stage('index'):
+        return ScoreIndex(tree).score_info
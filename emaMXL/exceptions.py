@@ -9,3 +9,15 @@ class BadApiRequest(MXMLException):
 
 class UnsupportedEncoding(MXMLException):
     pass
+
+
+class RemoteScoreError(MXMLException):
+    pass
+
+
+class WorkerPoolBusy(MXMLException):
+    pass
+
+
+class WorkerTimeout(MXMLException):
+    pass
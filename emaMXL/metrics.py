@@ -0,0 +1,119 @@
+import bisect
+import os
+import threading
+import time
+from collections import defaultdict
+
+# Upper bounds (in seconds) of the latency histogram buckets; a final +Inf bucket is implied.
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STAGES = ('fetch', 'parse', 'index', 'parse_expression', 'expand', 'slice', 'serialize')
+COUNTERS = {
+    'measures_visited': "Selected measures processed by the slicer.",
+    'notes_examined': "Notes compared against a beat selection.",
+    'notes_trimmed': "Notes shortened by completeness 'cut'.",
+    'rests_inserted': "Rests inserted to fill the space left by trimmed notes.",
+    'rests_coalesced': "Rests merged into longer rests by completeness 'nospace'.",
+    'reversed_beat_ranges': "Beat ranges whose end snapped to before their start.",
+}
+
+
+class Metrics(object):
+    """ Collects per-stage latencies and slicing counters, and renders them in the Prometheus text format.
+
+        Everything is a no-op while disabled: stage() returns a shared null context manager and count() returns
+        immediately, so instrumented code costs one attribute check when metrics are off. Hot loops should count
+        into a local variable and report the total once, guarded by `if metrics.enabled`.
+    """
+    def __init__(self, enabled=False, buckets=DEFAULT_BUCKETS):
+        self.enabled = enabled
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.counters = defaultdict(int)
+            # stage -> [count per bucket (the last one is +Inf), sum of observations]
+            self.histograms = {}
+
+    def count(self, name, n=1):
+        if not self.enabled:
+            return
+        with self._lock:
+            self.counters[name] += n
+
+    def observe(self, stage, seconds):
+        """ Records one observation of a stage's latency. """
+        if not self.enabled:
+            return
+        i = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            histogram = self.histograms.get(stage)
+            if histogram is None:
+                histogram = self.histograms[stage] = [[0] * (len(self.buckets) + 1), 0.0]
+            histogram[0][i] += 1
+            histogram[1] += seconds
+
+    def stage(self, name):
+        """ Returns a context manager that records how long its block takes as a latency of the given stage. """
+        if not self.enabled:
+            return NULL_TIMER
+        return StageTimer(self, name)
+
+    def render(self):
+        """ Renders every metric in the Prometheus text exposition format (version 0.0.4).
+
+        :rtype: str
+        """
+        with self._lock:
+            counters = dict(self.counters)
+            histograms = {stage: (list(counts), total) for stage, (counts, total) in self.histograms.items()}
+        lines = []
+        for name, help_text in COUNTERS.items():
+            lines.append(f"# HELP ema_{name}_total {help_text}")
+            lines.append(f"# TYPE ema_{name}_total counter")
+            lines.append(f"ema_{name}_total {counters.get(name, 0)}")
+        lines.append("# HELP ema_stage_seconds Time spent in each stage of handling a request.")
+        lines.append("# TYPE ema_stage_seconds histogram")
+        for stage in sorted(histograms, key=lambda s: (STAGES.index(s) if s in STAGES else len(STAGES), s)):
+            counts, total = histograms[stage]
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float('inf'),), counts):
+                cumulative += n
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f'ema_stage_seconds_bucket{{stage="{stage}",le="{le}"}} {cumulative}')
+            lines.append(f'ema_stage_seconds_sum{{stage="{stage}"}} {total!r}')
+            lines.append(f'ema_stage_seconds_count{{stage="{stage}"}} {cumulative}')
+        return "\n".join(lines) + "\n"
+
+
+class StageTimer(object):
+    __slots__ = ('metrics', 'name', 'start')
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.metrics.observe(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class NullTimer(object):
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+NULL_TIMER = NullTimer()
+
+# The process-wide collector. Off unless EMA_METRICS is set; the API server turns it on.
+metrics = Metrics(enabled=os.environ.get("EMA_METRICS", "0") not in ("", "0"))
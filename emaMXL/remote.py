@@ -0,0 +1,145 @@
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from concurrent.futures import Future
+import requests
+from requests.adapters import HTTPAdapter
+from emaMXL.exceptions import RemoteScoreError
+
+REMOTE_URL_PATTERN = re.compile(r'^(https?):/+(.*)$', re.IGNORECASE)
+CHUNK_SIZE = 64 * 1024
+
+
+class RemoteScoreFetcher(object):
+    """ Downloads remote scores into an on-disk cache and keeps them up to date with conditional GETs.
+
+        Every fetch of a cached URL is a single revalidation round trip (If-None-Match / If-Modified-Since); the score
+        is only downloaded again if the server does not answer 304 Not Modified. Concurrent fetches of the same URL
+        share one request. Downloads replace the cached file atomically, so its mtime and size change and the parsed
+        score cache (emaMXL.cache) picks up the new version.
+    """
+    def __init__(self, cache_dir, pool_size=16, timeout=30, max_age=0, session=None):
+        """
+        :param cache_dir: The directory downloaded scores are kept in.
+        :type cache_dir: str
+        :param pool_size: The number of connections kept open per host.
+        :type pool_size: int
+        :param timeout: Seconds to wait for the server before giving up.
+        :type timeout: float
+        :param max_age: Seconds after a download or revalidation during which a cached score is used without
+                        contacting the server. 0 revalidates on every fetch.
+        :type max_age: float
+        :param session: The session to send requests through; a pooled session is created if None.
+        :type session: requests.Session
+        """
+        self.cache_dir = cache_dir
+        self.timeout = timeout
+        self.max_age = max_age
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+        self.session = session
+        self._lock = threading.Lock()
+        self._in_flight = {}  # url -> Future of the local path
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def fetch(self, url):
+        """ Returns the path of an up-to-date local copy of the score at url.
+
+        :param url: An http(s) URL of a MusicXML (.xml or .mxl) score.
+        :type url: str
+        :return: A local filepath.
+        :rtype: str
+        """
+        with self._lock:
+            future = self._in_flight.get(url)
+            leader = future is None
+            if leader:
+                future = self._in_flight[url] = Future()
+        if not leader:
+            return future.result()
+        try:
+            future.set_result(self._fetch(url))
+        except Exception as ex:
+            future.set_exception(ex)
+        finally:
+            with self._lock:
+                del self._in_flight[url]
+        return future.result()
+
+    def cache_paths(self, url):
+        """ Returns the paths of the cached score and its metadata (validators) for url. """
+        name = hashlib.sha256(url.encode('utf-8')).hexdigest()
+        base = os.path.join(self.cache_dir, name)
+        return base + '.score', base + '.json'
+
+    def _fetch(self, url):
+        score_path, meta_path = self.cache_paths(url)
+        meta = read_meta(meta_path) if os.path.exists(score_path) else None
+        if meta and time.time() - meta.get('checked', 0) < self.max_age:
+            return score_path
+
+        headers = {}
+        if meta and meta.get('etag'):
+            headers['If-None-Match'] = meta['etag']
+        if meta and meta.get('last_modified'):
+            headers['If-Modified-Since'] = meta['last_modified']
+        try:
+            response = self.session.get(url, headers=headers, timeout=self.timeout, stream=True)
+        except requests.RequestException as ex:
+            if meta:
+                # Serve the copy we have rather than failing while the server is unreachable.
+                return score_path
+            raise RemoteScoreError(f"Could not fetch {url}: {ex}")
+
+        with response:
+            if response.status_code == 304 and meta:
+                meta['checked'] = time.time()
+                write_meta(meta_path, meta)
+                return score_path
+            if response.status_code != 200:
+                raise RemoteScoreError(f"Could not fetch {url}: HTTP {response.status_code}")
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.part')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    for chunk in response.iter_content(CHUNK_SIZE):
+                        f.write(chunk)
+                os.replace(tmp_path, score_path)
+            except BaseException:
+                os.remove(tmp_path)
+                raise
+        write_meta(meta_path, {'url': url,
+                               'etag': response.headers.get('ETag'),
+                               'last_modified': response.headers.get('Last-Modified'),
+                               'checked': time.time()})
+        return score_path
+
+
+def remote_url(path):
+    """ Returns the URL named by an EMA score identifier, or None if it is a local path.
+    Slashes collapsed by URL routing (http:/host/...) are restored. """
+    match = REMOTE_URL_PATTERN.match(path)
+    if match is None:
+        return None
+    return f"{match.group(1).lower()}://{match.group(2)}"
+
+
+def read_meta(meta_path):
+    try:
+        with open(meta_path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write_meta(meta_path, meta):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(meta_path), suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(meta, f)
+    os.replace(tmp_path, meta_path)
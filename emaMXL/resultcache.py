@@ -0,0 +1,203 @@
+import hashlib
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from emaMXL.cache import score_cache_key
+from emaMXL.scoreindex import scan_score
+from emaMXL.sidecar import load_sidecar, file_digest
+
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+RESULT_SUFFIX = '.xml'
+FINGERPRINT_CACHE_SIZE = 4096
+# Part of every result key; change it whenever the slicer's output changes, so results cached on disk are not reused.
+RESULT_VERSION = 3
+
+
+class ResultCache(object):
+    """ A thread-safe LRU cache of serialized selections, with an optional on-disk tier.
+
+        Keys are result_key()s, which identify the score by its content and the expression by the selection it
+        expands to, so a key always maps to the same bytes and can be used as a strong ETag. The memory tier is
+        bounded by the total size of the cached results; results larger than max_entry_bytes are not cached.
+        With disk_dir, every cached result is also written to disk, where it outlives eviction from memory and
+        restarts of the process. The disk tier is bounded by max_disk_bytes, dropping the least recently written
+        results first.
+    """
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES, max_entry_bytes=None, disk_dir=None, max_disk_bytes=None):
+        """
+        :param max_bytes: The total size of the results kept in memory.
+        :type max_bytes: int
+        :param max_entry_bytes: The size of the largest result that is cached; defaults to max_bytes / 8.
+        :type max_entry_bytes: int
+        :param disk_dir: A directory to keep results in as well, or None for a memory-only cache.
+        :type disk_dir: str
+        :param max_disk_bytes: The total size of the results kept on disk; defaults to 8 * max_bytes.
+        :type max_disk_bytes: int
+        """
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_bytes // 8 if max_entry_bytes is None else max_entry_bytes
+        self.disk_dir = disk_dir
+        self.max_disk_bytes = 8 * max_bytes if max_disk_bytes is None else max_disk_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # key -> bytes
+        self._lock = threading.Lock()
+        self._disk_bytes = 0
+        if disk_dir is not None:
+            os.makedirs(disk_dir, exist_ok=True)
+            self._disk_bytes = sum(size for _, size, _ in self._disk_entries())
+
+    def get(self, key):
+        """ Returns the cached result for key, or None. """
+        with self._lock:
+            data = self._entries.get(key)
+            if data is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return data
+        data = self._read_disk(key)
+        with self._lock:
+            if data is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._insert(key, data)
+        return data
+
+    def put(self, key, data):
+        """ Caches a result, unless it is larger than max_entry_bytes. """
+        if len(data) > self.max_entry_bytes:
+            return
+        with self._lock:
+            self._insert(key, data)
+        if self.disk_dir is not None:
+            self._write_disk(key, data)
+
+    def tee(self, key, chunks):
+        """ Passes chunks through, caching their concatenation once they have all been consumed. Results that turn
+        out to be larger than max_entry_bytes stop being collected, and unfinished streams are not cached. """
+        collected = []
+        size = 0
+        for chunk in chunks:
+            if collected is not None:
+                size += len(chunk)
+                if size > self.max_entry_bytes:
+                    collected = None
+                else:
+                    collected.append(chunk)
+            yield chunk
+        if collected is not None:
+            self.put(key, b''.join(collected))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _insert(self, key, data):
+        if key in self._entries:
+            self.current_bytes -= len(self._entries.pop(key))
+        self._entries[key] = data
+        self.current_bytes += len(data)
+        while self.current_bytes > self.max_bytes and self._entries:
+            _, evicted = self._entries.popitem(last=False)
+            self.current_bytes -= len(evicted)
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, key + RESULT_SUFFIX)
+
+    def _read_disk(self, key):
+        if self.disk_dir is None:
+            return None
+        try:
+            with open(self._disk_path(key), 'rb') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def _write_disk(self, key, data):
+        path = self._disk_path(key)
+        if os.path.exists(path):
+            return
+        fd, tmp_path = tempfile.mkstemp(dir=self.disk_dir, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        with self._lock:
+            self._disk_bytes += len(data)
+            prune = self._disk_bytes > self.max_disk_bytes
+        if prune:
+            self._prune_disk()
+
+    def _prune_disk(self):
+        """ Deletes the oldest results on disk until they take up at most 90% of max_disk_bytes. """
+        entries = sorted(self._disk_entries(), key=lambda entry: entry[2])
+        total = sum(size for _, size, _ in entries)
+        for path, size, _ in entries:
+            if total <= self.max_disk_bytes * 0.9:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+        with self._lock:
+            self._disk_bytes = total
+
+    def _disk_entries(self):
+        """ Yields (path, size, mtime) of the results on disk. """
+        with os.scandir(self.disk_dir) as it:
+            for entry in it:
+                if entry.name.endswith(RESULT_SUFFIX):
+                    try:
+                        stat = entry.stat()
+                    except OSError:
+                        continue
+                    yield entry.path, stat.st_size, stat.st_mtime
+
+
+fingerprints = OrderedDict()  # score_cache_key -> (digest, score_info)
+fingerprints_lock = threading.Lock()
+
+
+def score_fingerprint(filepath, score_index=None):
+    """ Returns the sha256 hex digest of a score file and its score_info, computed once per version of the file.
+
+    :param filepath: A filepath to a MusicXML (.xml or .mxl) score.
+    :type filepath: str
+    :param score_index: The score's index, if already loaded; otherwise its sidecar is used, or the score is scanned.
+    :type score_index: ScoreIndex
+    :rtype: (str, dict)
+    """
+    key = score_cache_key(filepath)
+    with fingerprints_lock:
+        fingerprint = fingerprints.get(key)
+        if fingerprint is not None:
+            fingerprints.move_to_end(key)
+            return fingerprint
+    if score_index is None:
+        score_index = load_sidecar(filepath) or scan_score(filepath)
+    fingerprint = (file_digest(filepath).hex(), score_index.score_info)
+    with fingerprints_lock:
+        fingerprints[key] = fingerprint
+        while len(fingerprints) > FINGERPRINT_CACHE_SIZE:
+            fingerprints.popitem(last=False)
+    return fingerprint
+
+
+def result_key(score_digest, ema_exp_full):
+    """ Identifies the output of an expression on a score by the score's content hash and the canonical form of the
+    expression's selection, so that equivalent expressions share a key.
+
+    :param score_digest: The score's hex digest, from score_fingerprint.
+    :type score_digest: str
+    :param ema_exp_full: The expression, expanded against the score.
+    :type ema_exp_full: EmaExpFull
+    :rtype: str
+    """
+    return hashlib.sha256(f"{RESULT_VERSION}\n{score_digest}\n{ema_exp_full.canonical()}".encode('utf-8')).hexdigest()[:40]
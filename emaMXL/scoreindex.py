@@ -0,0 +1,254 @@
+import io
+import re
+import xml.etree.ElementTree as ET
+from emaMXL.metrics import metrics
+from emaMXL.sources import open_score
+from emaMXL import xmlbackend
+
+# The start tag of a <part> (and not of <part-list>, <part-name>, ...), and the encoding in an XML declaration.
+PART_START_TAG = re.compile(rb'<part[\s/>]')
+ENCODING_DECLARATION = re.compile(rb'\s*<\?xml[^>]*encoding\s*=\s*["\']([^"\']+)')
+
+
+class MeasureInfo(object):
+    """ Structural facts about one measure of one part, gathered while building a ScoreIndex.
+
+        divisions, time and staves are the values in effect for the measure, i.e. carried forward from the last
+        <attributes> element that set them. attributes is the measure's own <attributes> element, if any.
+        element and attributes are None when the index was built without keeping the tree (see scan_score);
+        has_attributes still records whether the measure has an <attributes> element.
+    """
+    __slots__ = ('number', 'element', 'attributes', 'divisions', 'time', 'staves', 'has_attributes')
+
+    def __init__(self, number, element, attributes, divisions, time, staves, has_attributes=None):
+        self.number = number
+        self.element = element
+        self.attributes = attributes
+        self.divisions = divisions
+        self.time = time
+        self.staves = staves
+        self.has_attributes = attributes is not None if has_attributes is None else has_attributes
+
+
+class PartIndex(object):
+    """ The measures of a single <part>, and the range of staff numbers it occupies in an EMA expression. """
+    def __init__(self, part_id, element, measures, starting_staff=1):
+        self.part_id = part_id
+        self.element = element
+        self.measures = measures  # list of MeasureInfo, measures[i].number == i + 1
+        self.attribute_measures = [info.number for info in measures if info.has_attributes]
+        self.staves = measures[-1].staves if measures else 1
+        self.starting_staff = starting_staff
+        self.timeline = None  # emaMXL.timeline.PartTimeline, built on first use
+        self.attribute_timeline = None  # emaMXL.timeline.AttributeTimeline, built on first use
+
+    @property
+    def ending_staff(self):
+        return self.starting_staff + self.staves - 1
+
+
+class ScoreIndex(object):
+    """ Everything the slicer needs to know about a score's structure, built with a single walk of the tree.
+
+        The index holds references into the tree, so it stays valid only as long as the tree is not sliced in place.
+        Cached trees (see emaMXL.cache) are never changed, so their index can be shared by every request.
+    """
+    def __init__(self, tree: ET.ElementTree, parts=None):
+        self.tree = tree
+        if parts is None:
+            parts = [index_part(part) for part in tree.getroot().findall('part')]
+        self.parts = parts
+        current_staff = 1
+        for part_index in parts:
+            part_index.starting_staff = current_staff
+            current_staff += part_index.staves
+        self.measure_count = len(self.parts[0].measures) if self.parts else 0
+        self.staff_count = current_staff - 1
+
+    @classmethod
+    def from_path(cls, filepath):
+        with metrics.stage('parse'), open_score(filepath) as f:
+            tree = xmlbackend.parse(f)
+        with metrics.stage('index'):
+            return cls(tree)
+
+    def bind(self, tree):
+        """ Returns an index of tree built from the structural facts in this index, which must describe the same
+        score (e.g. an index loaded from a sidecar file). Only measures known to have attributes are searched.
+
+        :param tree: The parsed score.
+        :type tree: ET.ElementTree
+        :rtype: ScoreIndex
+        """
+        parts = []
+        for part_index, part in zip(self.parts, tree.getroot().findall('part')):
+            measures = [MeasureInfo(info.number, measure, measure.find('attributes') if info.has_attributes else None,
+                                    info.divisions, info.time, info.staves, info.has_attributes)
+                        for info, measure in zip(part_index.measures, part)]
+            parts.append(PartIndex(part_index.part_id, part, measures))
+        return ScoreIndex(tree, parts)
+
+    @property
+    def score_info(self):
+        """ The 'start' and 'end' values used to evaluate measure and staff tokens in an EMA expression. """
+        return {'measure': {'start': 1, 'end': self.measure_count},
+                'staff': {'start': 1, 'end': self.staff_count}}
+
+    def part_for_staff(self, staff_num):
+        """ Returns the PartIndex containing the given (score-wide) staff number, or None. """
+        for part_index in self.parts:
+            if part_index.starting_staff <= staff_num <= part_index.ending_staff:
+                return part_index
+        return None
+
+
+def index_part(part):
+    """ Walks the measures of a part once, recording attribute elements and the divisions and time in effect.
+
+    :param part: An ET.Element with tag "part".
+    :type part: ET.Element
+    :return: The index of the part. Its starting staff is filled in by ScoreIndex.
+    :rtype: PartIndex
+    """
+    measures = []
+    previous = None
+    for measure in part:
+        previous = index_measure(measure, len(measures) + 1, previous)
+        measures.append(previous)
+    return PartIndex(part.get('id'), part, measures)
+
+
+def index_measure(measure, number, previous=None, keep_elements=True):
+    """ Builds the MeasureInfo of a measure, carrying divisions, time and staves forward from the previous measure.
+
+    :param measure: An ET.Element with tag "measure".
+    :type measure: ET.Element
+    :param number: The position of the measure in its part, starting from 1.
+    :type number: int
+    :param previous: The MeasureInfo of the preceding measure in the same part, if any.
+    :type previous: MeasureInfo
+    :param keep_elements: If False, the MeasureInfo does not reference the measure or its attributes.
+    :type keep_elements: bool
+    :rtype: MeasureInfo
+    """
+    divisions, time, staves = (previous.divisions, previous.time, previous.staves) if previous else (None, None, 1)
+    attributes = measure.find('attributes')
+    if attributes is not None:
+        divisions_elem = attributes.find('divisions')
+        if divisions_elem is not None:
+            divisions = int(divisions_elem.text)
+        time_elem = attributes.find('time')
+        if time_elem is not None:
+            time = parse_time(time_elem)
+        staves_elem = attributes.find('staves')
+        if staves_elem is not None:
+            staves = int(staves_elem.text)
+    has_attributes = attributes is not None
+    if not keep_elements:
+        measure = attributes = None
+    return MeasureInfo(number, measure, attributes, divisions, time, staves, has_attributes)
+
+
+def scan_score(source):
+    """ Builds a ScoreIndex of a score with iterparse, keeping no part of the tree.
+    The index gives the measure and staff counts needed to expand an EMA expression before slicing.
+
+    :param source: A filepath to a MusicXML (.xml or .mxl) score.
+    :type source: str
+    :rtype: ScoreIndex
+    """
+    parts = []
+    measures = []
+    path = []  # Elements currently open, from the root down
+    with open_score(source) as f:
+        for event, elem in ET.iterparse(f, events=('start', 'end')):
+            if event == 'start':
+                path.append(elem)
+                if len(path) == 2 and elem.tag == 'part':
+                    measures = []
+                continue
+            path.pop()
+            if len(path) == 2 and path[1].tag == 'part':
+                previous = measures[-1] if measures else None
+                measures.append(index_measure(elem, len(measures) + 1, previous, keep_elements=False))
+                path[1].remove(elem)
+            elif len(path) == 1:
+                if elem.tag == 'part':
+                    parts.append(PartIndex(elem.get('id'), None, measures))
+                path[0].remove(elem)
+    return ScoreIndex(None, parts)
+
+
+def read_part(source, position):
+    """ Parses one <part> of a score, without building a tree of the rest of the score.
+
+    The part's text is found by scanning for the start tags of the parts, and parsed on its own. Scores the scan
+    cannot be trusted with (other encodings than UTF-8, entity or namespace declarations, comments, CDATA sections
+    or processing instructions after the first part) are parsed with iterparse instead, which keeps no other part of
+    the tree and stops at the end of the part.
+
+    :param source: A filepath to a MusicXML (.xml or .mxl) score.
+    :type source: str
+    :param position: The position of the part among the parts of the score, starting from 0.
+    :type position: int
+    :return: The part (without its tail), and the size of its text in bytes.
+    :rtype: (ET.Element, int)
+    """
+    with open_score(source) as f:
+        data = f.read()
+    part_bytes = find_part_bytes(data, position)
+    if part_bytes is not None:
+        try:
+            return xmlbackend.parse(io.BytesIO(part_bytes)).getroot(), len(part_bytes)
+        except SyntaxError:  # ET.ParseError and lxml's XMLSyntaxError, e.g. for an entity declared by a DTD
+            pass
+    path = []  # Elements currently open, from the root down
+    parts_seen = 0
+    in_part = False
+    for event, elem in xmlbackend.iterparse(io.BytesIO(data), events=('start', 'end')):
+        if event == 'start':
+            path.append(elem)
+            if len(path) == 2 and elem.tag == 'part':
+                in_part = parts_seen == position
+                parts_seen += 1
+            continue
+        path.pop()
+        if in_part:
+            if len(path) == 1:
+                elem.tail = None  # Set only if the parser has already read past the part
+                return elem, len(xmlbackend.tostring(elem))
+        elif len(path) == 2 and path[1].tag == 'part':
+            path[1].remove(elem)
+        elif len(path) == 1:
+            path[0].remove(elem)
+    raise ValueError(f"The score has no part at position {position}.")
+
+
+def find_part_bytes(data, position):
+    """ Returns the text of the part at position in a MusicXML document, from its start tag to its end tag, or None
+    if the document is not one whose parts can be found by scanning its text (see read_part). """
+    starts = [match.start() for match in PART_START_TAG.finditer(data)]
+    if position >= len(starts):
+        return None
+    prologue, body = data[:starts[0]], data[starts[0]:]
+    encoding = ENCODING_DECLARATION.match(prologue)
+    if encoding is not None and encoding.group(1).lower() not in (b'utf-8', b'utf8', b'us-ascii', b'ascii'):
+        return None
+    if b'<!ENTITY' in prologue or b'xmlns' in prologue or b'<!--' in body or b'<![CDATA[' in body or b'<?' in body:
+        return None
+    start = starts[position]
+    end = data.rfind(b'</part>', start, starts[position + 1] if position + 1 < len(starts) else len(data))
+    if end < 0:
+        return None
+    return data[start:end + len(b'</part>')]
+
+
+def parse_time(time_elem):
+    """ Converts a <time> element to a (beats, beat-type) tuple. Composite signatures like 3+2/8 are summed.
+    Returns None for <senza-misura/> or other signatures without beats.
+    """
+    beats = time_elem.find('beats')
+    beat_type = time_elem.find('beat-type')
+    if beats is None or beat_type is None:
+        return None
+    return sum(int(b) for b in beats.text.split('+')), int(beat_type.text)
@@ -0,0 +1,249 @@
+import argparse
+import hashlib
+import os
+import struct
+import sys
+import tempfile
+import threading
+import zlib
+import xml.etree.ElementTree as ET
+from concurrent.futures import ProcessPoolExecutor
+from emaMXL.metrics import metrics
+from emaMXL.scoreindex import ScoreIndex, PartIndex, MeasureInfo, scan_score
+from emaMXL.sources import open_score
+from emaMXL import xmlbackend
+
+SIDECAR_SUFFIX = '.emaidx'
+SIDECAR_MAGIC = b'EMAIDX'
+SIDECAR_VERSION = 1
+SCORE_EXTENSIONS = ('.xml', '.musicxml', '.mxl')
+# magic, version, score mtime (ns), score size, sha256 of the score file, number of parts
+HEADER = struct.Struct('<6sHqq32sI')
+PART_HEADER = struct.Struct('<HI')  # length of the part id, number of measures
+# flags (bit 0: has <attributes>), divisions (-1 if unknown), beats and beat-type (0 if unknown), staves
+MEASURE = struct.Struct('<BiHHH')
+
+# Sidecars are written next to their scores unless a directory is given or set in the environment.
+DEFAULT_SIDECAR_DIR = os.environ.get("EMA_SIDECAR_DIR")
+
+
+def sidecar_path(score_path, sidecar_dir=None):
+    """ Returns where the sidecar of a score is kept: next to the score, or in sidecar_dir under a name derived
+    from the score's absolute path. """
+    sidecar_dir = sidecar_dir or DEFAULT_SIDECAR_DIR
+    if sidecar_dir is None:
+        return score_path + SIDECAR_SUFFIX
+    name = hashlib.sha256(os.path.abspath(score_path).encode('utf-8')).hexdigest()
+    return os.path.join(sidecar_dir, name + SIDECAR_SUFFIX)
+
+
+def write_sidecar(score_path, score_index=None, sidecar_dir=None):
+    """ Serializes the structural facts of a score's index into its sidecar file.
+
+    :param score_path: A filepath to a MusicXML (.xml or .mxl) score.
+    :type score_path: str
+    :param score_index: The index to store. If None, the score is scanned with bounded memory.
+    :type score_index: ScoreIndex
+    :param sidecar_dir: A directory to keep the sidecar in, instead of next to the score.
+    :type sidecar_dir: str
+    :return: The path of the written sidecar.
+    :rtype: str
+    """
+    stat = os.stat(score_path)
+    digest = file_digest(score_path)
+    if score_index is None:
+        score_index = scan_score(score_path)
+    body = bytearray()
+    for part_index in score_index.parts:
+        part_id = (part_index.part_id or '').encode('utf-8')
+        body += PART_HEADER.pack(len(part_id), len(part_index.measures))
+        body += part_id
+        for info in part_index.measures:
+            beats, beat_type = info.time or (0, 0)
+            body += MEASURE.pack(1 if info.has_attributes else 0,
+                                 -1 if info.divisions is None else info.divisions,
+                                 beats, beat_type, info.staves)
+    data = HEADER.pack(SIDECAR_MAGIC, SIDECAR_VERSION, stat.st_mtime_ns, stat.st_size, digest,
+                       len(score_index.parts)) + zlib.compress(bytes(body))
+    path = sidecar_path(score_path, sidecar_dir)
+    replace_file(path, data)
+    return path
+
+
+def replace_file(path, data):
+    """ Writes data to path atomically, creating its directory if needed. """
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix='.tmp')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def load_sidecar(score_path, sidecar_dir=None):
+    """ Loads the index stored in a score's sidecar file, without reading the score.
+
+    The sidecar is trusted if the score's mtime and size are unchanged. If only the mtime differs (e.g. the corpus
+    was copied during a deploy), the score's content hash is compared instead, and if it matches, the sidecar is
+    rewritten with the new mtime so that the score is not hashed again on its next load.
+
+    :param score_path: A filepath to a MusicXML (.xml or .mxl) score.
+    :type score_path: str
+    :param sidecar_dir: The directory the sidecar is kept in, if not next to the score.
+    :type sidecar_dir: str
+    :return: An index without element references, or None if there is no valid sidecar.
+    :rtype: ScoreIndex
+    """
+    path = sidecar_path(score_path, sidecar_dir)
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+        stat = os.stat(score_path)
+    except OSError:
+        return None
+    if len(data) < HEADER.size:
+        return None
+    magic, version, mtime_ns, size, digest, num_parts = HEADER.unpack_from(data)
+    if magic != SIDECAR_MAGIC or version != SIDECAR_VERSION or size != stat.st_size:
+        return None
+    if mtime_ns != stat.st_mtime_ns:
+        if digest != file_digest(score_path):
+            return None
+        data = HEADER.pack(magic, version, stat.st_mtime_ns, size, digest, num_parts) + data[HEADER.size:]
+        try:
+            replace_file(path, data)
+        except OSError:
+            pass  # e.g. a read-only corpus; the score is hashed again next time
+
+    try:
+        body = zlib.decompress(data[HEADER.size:])
+    except zlib.error:
+        return None
+    parts = []
+    offset = 0
+    for _ in range(num_parts):
+        id_length, num_measures = PART_HEADER.unpack_from(body, offset)
+        offset += PART_HEADER.size
+        part_id = body[offset:offset + id_length].decode('utf-8') or None
+        offset += id_length
+        measures = []
+        for number, (flags, divisions, beats, beat_type, staves) in \
+                enumerate(MEASURE.iter_unpack(body[offset:offset + num_measures * MEASURE.size]), 1):
+            measures.append(MeasureInfo(number, None, None, None if divisions < 0 else divisions,
+                                        (beats, beat_type) if beats else None, staves, bool(flags & 1)))
+        offset += num_measures * MEASURE.size
+        parts.append(PartIndex(part_id, None, measures))
+    return ScoreIndex(None, parts)
+
+
+class SidecarScoreIndex(ScoreIndex):
+    """ The index of a score with a valid sidecar. The measure and staff counts (and so score_info, which is all
+        that expanding an expression needs) come from the sidecar alone; the score is parsed, and bound to the
+        sidecar's index, only when its tree or parts are first needed, e.g. to slice.
+    """
+    def __init__(self, score_path, stored_index):
+        self.score_path = score_path
+        self.stored_index = stored_index
+        self.measure_count = stored_index.measure_count
+        self.staff_count = stored_index.staff_count
+        self._bound = None
+        self._lock = threading.Lock()
+
+    @property
+    def tree(self):
+        return self.bound().tree
+
+    @property
+    def parts(self):
+        return self.bound().parts
+
+    def bound(self):
+        """ Returns the index bound to the parsed score, parsing it on first use.
+
+        :rtype: ScoreIndex
+        """
+        if self._bound is None:
+            with self._lock:
+                if self._bound is None:
+                    with metrics.stage('parse'), open_score(self.score_path) as f:
+                        tree = xmlbackend.parse(f)
+                    with metrics.stage('index'):
+                        self._bound = self.stored_index.bind(tree)
+        return self._bound
+
+
+def read_score_index(score_path, sidecar_dir=None):
+    """ Indexes a score, taking the structure from its sidecar when there is a valid one. Without a sidecar the score
+    is parsed and indexed at once; with one, it is parsed only when it is sliced (see SidecarScoreIndex).
+
+    :param score_path: A filepath to a MusicXML (.xml or .mxl) score.
+    :type score_path: str
+    :param sidecar_dir: The directory the sidecar is kept in, if not next to the score.
+    :type sidecar_dir: str
+    :rtype: ScoreIndex
+    """
+    with metrics.stage('index'):
+        stored_index = load_sidecar(score_path, sidecar_dir)
+    if stored_index is not None:
+        return SidecarScoreIndex(score_path, stored_index)
+    return ScoreIndex.from_path(score_path)
+
+
+def file_digest(path):
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            sha.update(chunk)
+    return sha.digest()
+
+
+def find_scores(paths):
+    """ Yields the score files named by paths, searching directories recursively. """
+    for path in paths:
+        if not os.path.isdir(path):
+            yield path
+            continue
+        for dirpath, dirnames, filenames in os.walk(path):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                if filename.lower().endswith(SCORE_EXTENSIONS):
+                    yield os.path.join(dirpath, filename)
+
+
+def build_sidecar(score_path, sidecar_dir=None, force=False):
+    """ Writes the sidecar of one score unless a valid one exists. Returns (score_path, status). """
+    if not force and load_sidecar(score_path, sidecar_dir) is not None:
+        return score_path, 'fresh'
+    try:
+        write_sidecar(score_path, sidecar_dir=sidecar_dir)
+    except (OSError, ET.ParseError, ValueError) as ex:
+        return score_path, f'failed: {ex}'
+    return score_path, 'built'
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build sidecar index files for a corpus of MusicXML scores.")
+    parser.add_argument('paths', nargs='+', help="Score files or directories to search for scores.")
+    parser.add_argument('--sidecar-dir', default=None, help="Keep sidecars here instead of next to the scores.")
+    parser.add_argument('--jobs', type=int, default=1, help="Number of worker processes.")
+    parser.add_argument('--force', action='store_true', help="Rebuild sidecars that are still valid.")
+    args = parser.parse_args(argv)
+
+    score_paths = list(find_scores(args.paths))
+    sidecar_dirs = [args.sidecar_dir] * len(score_paths)
+    forces = [args.force] * len(score_paths)
+    if args.jobs > 1:
+        with ProcessPoolExecutor(args.jobs) as pool:
+            results = list(pool.map(build_sidecar, score_paths, sidecar_dirs, forces, chunksize=8))
+    else:
+        results = list(map(build_sidecar, score_paths, sidecar_dirs, forces))
+
+    failures = 0
+    for score_path, status in results:
+        print(f"{status}: {score_path}")
+        failures += status.startswith('failed')
+    print(f"{len(results)} scores, {failures} failed.")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,9 +1,19 @@
 import copy
 import xml.etree.ElementTree as ET
-from emaMXL.emaexp import EmaExp
-from emaMXL.emaexpfull import EmaExpFull, get_score_info_mxl
+from bisect import bisect_right
+from emaMXL.cache import load_score_index
+from emaMXL.emaexp import parse_ema_exp
+from emaMXL.emaexpfull import EmaExpFull, BeatIntervals
+from emaMXL.exceptions import MXMLException, BadApiRequest
+from emaMXL.metrics import metrics
+from emaMXL.scoreindex import ScoreIndex
+from emaMXL.timeline import match_part, AttributeTimeline
+from emaMXL.xmlbackend import element_tree
 
 
+# Children of a note that a rest has no use for; strip_rest drops them from rests in completeness 'nospace'.
+REST_REMOVE = ['pitch', 'unpitched', 'tie', 'accidental', 'stem', 'notehead', 'beam', 'lyric', 'play']
+
 NOTE_TYPES = {1: 'whole',
               2: 'half',
               4: 'quarter',
@@ -20,163 +30,473 @@ SCALING_CONSTANT = 1
 # exp_str = "1/1/@1/cut"
 # tree = ET.parse(filepath)
 # emaexp = EmaExp(exp_str)
-# emaexp_full = EmaExpFull(get_score_info_mxl(tree), emaexp)
-def slice_score_path(filepath, exp_str):
+# emaexp_full = EmaExpFull(ScoreIndex(tree), emaexp)
+def slice_score_path(filepath, exp_str, use_cache=True):
     """ Highest-level selection function; creates a selection from a MusicXML filepath and EMA expression string.
 
     :param filepath: A filepath to a MusicXML score.
     :type filepath: str
     :param exp_str: A string describing an EMA selection.
     :type exp_str: str
+    :param use_cache: If True, the parsed score is taken from (or added to) the process-wide score cache
+                      and the selection is built as a new tree, leaving the cached score untouched.
+    :type use_cache: bool
     :return: An ElementTree representing the selection.
     :rtype: ET.ElementTree
     """
-    print(f"{exp_str}, {filepath}")
-    tree = ET.parse(filepath)
-    emaexp = EmaExp(exp_str)
-    emaexp_full = EmaExpFull(get_score_info_mxl(tree), emaexp)
-    return slice_score(tree, emaexp_full)
+    score_index = load_score_index(filepath) if use_cache else ScoreIndex.from_path(filepath)
+    with metrics.stage('parse_expression'):
+        emaexp = parse_ema_exp(exp_str)
+    with metrics.stage('expand'):
+        emaexp_full = EmaExpFull(score_index, emaexp)
+    with metrics.stage('slice'):
+        return slice_score(score_index.tree, emaexp_full, in_place=not use_cache)
+
 
+def slice_many(filepath, exp_strs, use_cache=True):
+    """ Creates a selection for each of several EMA expression strings against the same MusicXML score.
+    The score is parsed and indexed once and all selections are built during a single walk over its measures.
 
-def slice_score(tree, ema_exp_full):
+    :param filepath: A filepath to a MusicXML score.
+    :type filepath: str
+    :param exp_strs: Strings describing EMA selections.
+    :type exp_strs: List[str]
+    :param use_cache: If True, the parsed score is taken from (or added to) the process-wide score cache.
+    :type use_cache: bool
+    :return: For each expression, in order, either an ElementTree representing the selection or the
+             MXMLException explaining why that expression could not be evaluated.
+    :rtype: List[ET.ElementTree | MXMLException]
+    """
+    score_index = load_score_index(filepath) if use_cache else ScoreIndex.from_path(filepath)
+    results = [None] * len(exp_strs)
+    ema_exp_fulls = []
+    for i, exp_str in enumerate(exp_strs):
+        try:
+            with metrics.stage('parse_expression'):
+                ema_exp = parse_ema_exp(exp_str)
+            with metrics.stage('expand'):
+                ema_exp_fulls.append((i, EmaExpFull(score_index, ema_exp)))
+        except Exception as ex:
+            results[i] = as_api_error(exp_str, ex)
+    with metrics.stage('slice'):
+        trees = slice_score_many(score_index, [ema_exp_full for _, ema_exp_full in ema_exp_fulls])
+    for (i, _), tree in zip(ema_exp_fulls, trees):
+        results[i] = as_api_error(exp_strs[i], tree) if isinstance(tree, Exception) else tree
+    return results
+
+
+def as_api_error(exp_str, ex):
+    """ Wraps an exception raised while evaluating exp_str in an MXMLException, if it is not one already. """
+    if isinstance(ex, MXMLException):
+        return ex
+    return BadApiRequest(f"Could not evaluate '{exp_str}': {type(ex).__name__}: {ex}")
+
+
+class MeasureCursor(object):
+    """ Pages through a score a window of measures at a time (1-8, 9-16, ...), with the same staves and beats
+        selected in every window.
+
+        Each window is the selection slice_score_path would give for the expression "start-end/staves/beats", but the
+        parsed score is reused and the attributes in effect at the start of a window (divisions, key, time, clef,
+        staves) are looked up in each part's attribute timeline, so a window costs time in proportion to its own size
+        rather than to its position.
+    """
+    def __init__(self, score_index, staves='all', beats='@all', completeness=None, size=8, start=1):
+        """
+        :param score_index: The index of the score; its tree is not modified.
+        :type score_index: ScoreIndex
+        :param staves: The staff expression of every window, e.g. "1-2" or "all".
+        :type staves: str
+        :param beats: The beat expression of every window, e.g. "@1-2" or "@all".
+        :type beats: str
+        :param completeness: Additional selection argument described in EMA API.
+        :type completeness: str
+        :param size: The number of measures in a window.
+        :type size: int
+        :param start: The first measure of the first window.
+        :type start: int
+        """
+        if size < 1:
+            raise BadApiRequest("The window size must be at least 1.")
+        self.score_index = score_index
+        self.staves = staves
+        self.beats = beats
+        self.completeness = completeness
+        self.size = size
+        self.num_measures = score_index.measure_count
+        if not 1 <= start <= max(self.num_measures, 1):
+            raise BadApiRequest(f"The score has no measure {start}.")
+        self.start = start  # the first measure of the next window
+        # Fail on an invalid expression now rather than on the first window.
+        self.window_exp(self.start, self.window_end(self.start))
+
+    @property
+    def done(self):
+        return self.start > self.num_measures
+
+    def window_end(self, start):
+        return min(start + self.size - 1, self.num_measures)
+
+    def window_str(self, start, end):
+        """ Returns the expression string of the window start..end. """
+        parts = [f"{start}-{end}", self.staves, self.beats]
+        if self.completeness:
+            parts.append(self.completeness)
+        return "/".join(parts)
+
+    def window_exp(self, start, end):
+        """ Returns the EmaExpFull of the window start..end. """
+        exp_str = self.window_str(start, end)
+        try:
+            with metrics.stage('parse_expression'):
+                ema_exp = parse_ema_exp(exp_str)
+            with metrics.stage('expand'):
+                return EmaExpFull(self.score_index, ema_exp)
+        except Exception as ex:
+            raise as_api_error(exp_str, ex)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        """ Returns the selection of the next window.
+
+        :return: An ElementTree representing the selection.
+        :rtype: ET.ElementTree
+        """
+        if self.done:
+            raise StopIteration
+        start, end = self.start, self.window_end(self.start)
+        ema_exp_full = self.window_exp(start, end)
+        with metrics.stage('slice'):
+            result = slice_score_many(self.score_index, [ema_exp_full], start - 1)[0]
+        if isinstance(result, Exception):
+            raise as_api_error(self.window_str(start, end), result)
+        self.start = end + 1
+        return result
+
+
+def slice_score(tree, ema_exp_full, in_place=True):
     """ Executes a selection on an entire score.
 
     :param tree: MusicXML file loaded with ET
     :type tree: ET.ElementTree
-    :param ema_exp_full: EmaExpFull object created by parser.py
+    :param ema_exp_full: EmaExpFull object created by parser.py. If it was built from a ScoreIndex of tree,
+                         that index is reused instead of walking the tree again.
     :type ema_exp_full: EmaExpFull
+    :param in_place: If True, the selection is made by editing tree. Otherwise the selection is built as a new tree
+                     and tree is left unchanged; only the selected measures are copied.
+    :type in_place: bool
     :return: An ElementTree representing the selection.
     :rtype: ET.ElementTree
     """
-    parts = tree.findall("part")
-    current_staff = 1
+    score_index = ema_exp_full.score_index
+    if score_index is None or score_index.tree is not tree:
+        score_index = ScoreIndex(tree)
+    if not in_place:
+        result = slice_score_many(score_index, [ema_exp_full])[0]
+        if isinstance(result, Exception):
+            raise result
+        return result
     selected_parts = []
-    part_idx = 0
-    for part in parts:
-        staves_in_part, part_in_selection = process_part(ema_exp_full, current_staff, part)
-        current_staff += staves_in_part
-        if part_in_selection:
+    for part_idx, part_index in enumerate(score_index.parts):
+        if process_part(ema_exp_full, part_index):
             selected_parts.append(part_idx)
-        part_idx += 1
     remove_unselected_parts(tree, selected_parts)
     return tree
 
 
+def slice_score_many(score_index, ema_exp_fulls, previous=0):
+    """ Builds the selections for several EmaExpFulls against one score.
+    The score is not modified; each selection is a new tree holding copies of its selected measures.
+    The <attributes> elements inserted into selected measures come from the score's attribute timelines.
+
+    :param score_index: The index of the score to select from.
+    :type score_index: ScoreIndex
+    :param ema_exp_fulls: EmaExpFull objects created by parser.py
+    :type ema_exp_fulls: List[EmaExpFull]
+    :param previous: Measures up to this one are left out of the selections (see MeasureCursor).
+    :type previous: int
+    :return: For each EmaExpFull, in order, either an ElementTree representing the selection or the exception
+             raised while building it. A failing selection does not affect the others.
+    :rtype: List[ET.ElementTree | Exception]
+    """
+    root = score_index.tree.getroot()
+    results = [element_tree(copy_score_skeleton(root)) for _ in ema_exp_fulls]
+    out_parts = [result.findall("part") for result in results]
+    selected_parts = [[] for _ in ema_exp_fulls]
+    for part_idx, part_index in enumerate(score_index.parts):
+        for k, ema_exp_full in enumerate(ema_exp_fulls):
+            if isinstance(results[k], Exception):
+                continue
+            try:
+                matches = match_selected_beats(part_index, ema_exp_full)
+                for measure_info, insert_attrib in iter_selected_measures(part_index, ema_exp_full.selection,
+                                                                          previous):
+                    # Only selected measures are copied, so the source part is never changed.
+                    measure = copy.deepcopy(measure_info.element)
+                    out_parts[k][part_idx].append(measure)
+                    process_measure(measure, ema_exp_full.selection[measure_info.number],
+                                    part_index.starting_staff, measure_info.divisions,
+                                    ema_exp_full.completeness, insert_attrib,
+                                    matches.get(measure_info.number) if matches else None)
+            except Exception as ex:
+                results[k] = ex
+                continue
+            if len(out_parts[k][part_idx]):
+                selected_parts[k].append(part_idx)
+
+    for k, result in enumerate(results):
+        if not isinstance(result, Exception):
+            remove_unselected_parts(result, selected_parts[k])
+    return results
+
+
+def copy_score_skeleton(root):
+    """ Copies everything in a score except for its measures, which are left for slice_score_many to copy as selected.
+
+    :param root: The root element of the score.
+    :type root: ET.Element
+    :return: A new root element with empty <part> elements.
+    :rtype: ET.Element
+    """
+    new_root = shallow_copy(root)
+    for child in root:
+        if child.tag == 'part':
+            new_root.append(shallow_copy(child))
+        else:
+            new_root.append(copy.deepcopy(child))
+    return new_root
+
+
+def shallow_copy(elem):
+    """ Copies an element's tag, attributes, text and tail, but none of its children. """
+    new_elem = elem.makeelement(elem.tag, dict(elem.attrib))
+    new_elem.text = elem.text
+    new_elem.tail = elem.tail
+    return new_elem
+
+
 # TODO: keep track of selected element ids. If elem does not have id, get an xpath.
-def process_part(ema_exp_full, starting_staff, measures):
-    """ Traverses a single part. Measures are trimmed to those between the start and end measures of the selection.
-    Staves are trimmed to only requested staves.
+def process_part(ema_exp_full, part_index):
+    """ Traverses a single part in place. Measures are trimmed to those between the start and end measures of the
+    selection. Staves are trimmed to only requested staves.
 
     :param ema_exp_full: EmaExpFull object created by parser.py
     :type ema_exp_full: EmaExpFull
-    :param starting_staff: The lowest staff number this part contains
-    :type starting_staff: int
-    :param measures: An ET.Element with tag "part"; contains the measures to be processed
-    :type measures: ET.Element
-    :return: The number of staves contained in this part  (MusicXML supports multiple staves per part),
-             and a boolean indicating if any beats were selected in this part.
-    :rtype: int, bool
+    :param part_index: The index of the part to be processed; gives its measures and lowest staff number.
+    :type part_index: emaMXL.scoreindex.PartIndex
+    :return: A boolean indicating if any beats were selected in this part.
+    :rtype: bool
     """
-    attrib = {}
-    insert_attrib = {}
-    staves_in_part = 1
-    measure_idx = 0
-    measure_num = 1
     selection = ema_exp_full.selection
-    completeness = ema_exp_full.completeness
-    part_in_selection = False
-    while measure_idx < len(measures):
-        measure: ET.Element = measures[measure_idx]
-
-        # Keep track of attribute changes - e.g. if we don't select a measure with a time sig change,
-        # we would still want the new time sig to be reflected in the next selected measure.
-        m_attr_elem: ET.Element = measure.find('attributes')
-        if m_attr_elem is not None:
-            measure_attrib = elem_to_dict(m_attr_elem)
-            # Scaling all divisions by 2048
-            measure_attrib["divisions"][0]["text"] = str(int(measure_attrib["divisions"][0]["text"])*SCALING_CONSTANT)
-            for key in measure_attrib:
-                attrib[key] = measure_attrib[key]
-                insert_attrib[key] = measure_attrib[key]
-            # For handling parts that contain multiple staves
-            if "staves" in measure_attrib:
-                staves_in_part = int(measure_attrib["staves"][0]['text'])
-
-        # Scale all notes by 2048
-        for child in measure:
-            duration = child.find("duration")
-            if duration is not None:
-                duration.text = str(int(duration.text)*SCALING_CONSTANT)
-
-        if measure_num in selection:
-            part_in_selection = True
-            # print("In measure", measure_num, "starting staff", starting_staff)
-            select_beats(measure, selection[measure_num], starting_staff, attrib, completeness)
-            measure_idx += 1
-
-            # We have some attributes we want to insert into the next selected measure
-            if insert_attrib:
-                if m_attr_elem:
-                    measure.remove(m_attr_elem)
-                measure.insert(0, dict_to_elem('attributes', insert_attrib))
-                insert_attrib = {}
-        else:
-            measures.remove(measure)
-        measure_num += 1
-    return staves_in_part, part_in_selection
+    kept = []
+    for measure_info, insert_attrib in iter_selected_measures(part_index, selection):
+        process_measure(measure_info.element, selection[measure_info.number], part_index.starting_staff,
+                        measure_info.divisions, ema_exp_full.completeness, insert_attrib)
+        kept.append(measure_info.element)
+    # Dropping the unselected measures one remove() at a time would be quadratic in the length of the part.
+    part_index.element[:] = kept
+    return bool(kept)
+
+
+def iter_selected_measures(part_index, selection, previous=0):
+    """ Jumps through the selected measures of a part in score order, without visiting the measures in between.
+
+    Keep track of attribute changes - e.g. if we don't select a measure with a time sig change, we would still want
+    the new time sig to be reflected in the next selected measure. The first selected measure gets every attribute in
+    effect, and each later one the attributes changed since the selected measure before it, as prebuilt <attributes>
+    elements from the part's attribute timeline.
+
+    :param part_index: The index of the part.
+    :type part_index: emaMXL.scoreindex.PartIndex
+    :param selection: EmaExpFull.selection
+    :type selection: emaMXL.emaexpfull.RangeMap
+    :param previous: Measures up to this one are skipped.
+    :type previous: int
+    :return: Generator of (MeasureInfo, <attributes> element to insert or None).
+    """
+    timeline = attribute_timeline(part_index)
+    changed_after = 0
+    for number in selection.keys_between(previous + 1, len(part_index.measures)):
+        yield part_index.measures[number - 1], timeline.element(changed_after, number)
+        changed_after = number
+
+
+def attribute_timeline(part_index):
+    """ Returns the attribute timeline of a part, building it on first use.
+
+    :param part_index: The index of the part, with references to its measures.
+    :type part_index: emaMXL.scoreindex.PartIndex
+    :rtype: emaMXL.timeline.AttributeTimeline
+    """
+    if part_index.attribute_timeline is None:
+        make_element = part_index.element.makeelement
+        part_index.attribute_timeline = AttributeTimeline(
+            part_index, attributes_to_dict, lambda d: dict_to_elem('attributes', d, make_element=make_element))
+    return part_index.attribute_timeline
+
+
+def match_selected_beats(part_index, ema_exp_full):
+    """ Matches the notes of every selected measure of a part against the beat selection at once, using the part's
+    timeline (see emaMXL.timeline), for process_measure.
 
+    :param part_index: The index of the part.
+    :type part_index: emaMXL.scoreindex.PartIndex
+    :param ema_exp_full: EmaExpFull object created by parser.py
+    :type ema_exp_full: EmaExpFull
+    :return: The matches, or None if the part has no timeline; matches.get(measure number) gives the matches argument
+             of process_measure.
+    :rtype: emaMXL.timeline.PartMatches
+    """
+    return match_part(part_index, ema_exp_full.selection, ema_exp_full.completeness, SCALING_CONSTANT)
+
+
+def carry_attributes(m_attr_elem, insert_attrib):
+    """ Merges a measure's <attributes> into the attributes waiting to be inserted into the next selected measure.
+
+    :param m_attr_elem: An ET.Element with tag "attributes".
+    :type m_attr_elem: ET.Element
+    :param insert_attrib: Attributes changed since the last selected measure, as built by elem_to_dict.
+    :type insert_attrib: dict[str, list[dict]]
+    :return: None
+    """
+    insert_attrib.update(attributes_to_dict(m_attr_elem))
+
+
+def attributes_to_dict(m_attr_elem):
+    """ Converts a measure's <attributes> to a dict with elem_to_dict, scaling its divisions.
+
+    :param m_attr_elem: An ET.Element with tag "attributes".
+    :type m_attr_elem: ET.Element
+    :rtype: dict[str, list[dict]]
+    """
+    measure_attrib = elem_to_dict(m_attr_elem)
+    # Scaling all divisions by 2048
+    if "divisions" in measure_attrib:
+        measure_attrib["divisions"][0]["text"] = str(int(measure_attrib["divisions"][0]["text"])*SCALING_CONSTANT)
+    return measure_attrib
+
+
+def process_measure(measure, ema_measure, starting_staff, divisions, completeness, insert_attrib, matches=None):
+    """ Applies the beat selection to a selected measure and inserts any carried-forward attributes.
+
+    :param measure: An ET.Element with tag "measure"; it is edited in place.
+    :type measure: ET.Element
+    :param ema_measure: The selection for this measure, mapping staff numbers to lists of EmaRangeFull.
+    :param starting_staff: The lowest staff number of the measure's part.
+    :type starting_staff: int
+    :param divisions: The number of divisions per quarter note in effect for this measure (before scaling).
+    :type divisions: int
+    :param completeness: Additional selection argument described in EMA API.
+    :type completeness: str
+    :param insert_attrib: Attributes changed since the last selected measure: a prebuilt <attributes> element (see
+                          iter_selected_measures), or a dict built by carry_attributes, which is emptied once inserted.
+    :type insert_attrib: ET.Element | dict[str, list[dict]]
+    :param matches: The measure's matches from emaMXL.timeline.match_part, if it has any; the beat selection is then
+                    applied without walking the measure.
+    :type matches: (List[int], List[(int, int)], int)
+    :return: None
+    """
+    metrics.count('measures_visited')
+    m_attr_elem = measure.find('attributes')
+
+    # Scale all notes by 2048
+    for child in measure:
+        duration = child.find("duration")
+        if duration is not None:
+            duration.text = str(int(duration.text)*SCALING_CONSTANT)
 
-def select_beats(measure, ema_measure, starting_staff, attrib, completeness=None):
+    if matches is None:
+        select_beats(measure, ema_measure, starting_staff, divisions * SCALING_CONSTANT, completeness)
+    else:
+        apply_matches(measure, matches, divisions * SCALING_CONSTANT)
+    if completeness == 'nospace':
+        coalesce_rests(measure, divisions * SCALING_CONSTANT)
+
+    # We have some attributes we want to insert into the next selected measure
+    if isinstance(insert_attrib, dict):
+        attributes = dict_to_elem('attributes', insert_attrib, make_element=measure.makeelement) if insert_attrib \
+            else None
+        insert_attrib.clear()
+    else:
+        attributes = insert_attrib
+    if attributes is not None:
+        if m_attr_elem is not None and len(m_attr_elem):
+            measure.remove(m_attr_elem)
+        measure.insert(0, attributes)
+
+
+def select_beats(measure, ema_measure, starting_staff, divisions, completeness=None):
     """ Traverses the notes in the measure and converts non-selected notes into rests.
 
     :param measure: An ET.Element with tag "measure"; contains the notes to be processed
     :param ema_measure: ET.Element
     :param starting_staff: The starting staff number - multiple staves can be contained in a MusicXML measure.
-    :param attrib: A nested dict representation of the current measure attributes element.
-                    The key (tag) maps to a list of elements with that tag (each with its own dictionary).
-    :type attrib: dict[str, list[dict]]
+    :param divisions: The number of divisions per quarter note in effect for this measure.
+    :type divisions: int
     :param completeness: Additional selection argument described in EMA API.
     :type completeness: str
     :return: Does not return an object; edits the inputted measure.
     :rtype: None
     """
     staff_num = starting_staff
-    if staff_num in ema_measure:
-        ema_beats = ema_measure[staff_num]  # list of EmaRange
-    else:
-        ema_beats = []
-    divisions = int(attrib['divisions'][0]['text'])
+    beat_intervals = BeatIntervals(ema_measure.get(staff_num, []), divisions)
     curr_time = 0
     # For handling completeness insertion
     child_index = 0
-    for child in measure:
+    notes_examined = 0
+    # Children are visited by position, and trim_note's rests shift the children after them, as with ElementTree's
+    # own iterator; lxml's iterator would instead follow the siblings of the current element.
+    children = list(measure)
+    while child_index < len(children):
+        child = children[child_index]
         duration_elem = child.find("duration")
         duration = int(duration_elem.text) if duration_elem is not None else None
         if child.tag == 'note':
             if (child.find("rest")) is None:
                 # Check if note is inside any of the ema_ranges for this measure & staff.
-                matched_ema_range = None
-                for beat_range in ema_beats:
-                    time_range = beat_range.scale_beat(divisions)
-                    if time_range.contains_note(curr_time, curr_time + duration):
-                        matched_ema_range = time_range
-                        print(f"Selected note @ time {curr_time}, staff {staff_num}")
-                        print(f"Beat -> Division Range: {beat_range} -> {time_range}")
-
+                notes_examined += 1
+                matched_ema_range = beat_intervals.match(curr_time, curr_time + duration)
                 if matched_ema_range:
                     # If note falls inside the range, we want to keep it.
                     # If 'cut' is specified, then we trim the note as needed.
                     if completeness == 'cut':
                         trim_note(measure, child, child_index, curr_time, duration, matched_ema_range, divisions)
+                        children = list(measure)
                 else:
                     # 'raw' behavior here will remove instead of converting to rest
                     remove_from_selection(child)
             curr_time += duration
         elif child.tag == 'backup':
             staff_num += 1
-            ema_beats = ema_measure.get(staff_num, [])  # Defaults to [] if not selected
+            beat_intervals = BeatIntervals(ema_measure.get(staff_num, []), divisions)  # Empty if not selected
             curr_time -= duration
         child_index += 1
+    if metrics.enabled:
+        metrics.count('notes_examined', notes_examined)
+
+
+def apply_matches(measure, matches, divisions):
+    """ Makes the same changes to a measure as select_beats, from notes already matched by emaMXL.timeline.match_part.
+
+    :param measure: An ET.Element with tag "measure"; contains the notes to be processed
+    :type measure: ET.Element
+    :param matches: The notes to remove from the selection and the notes to set the duration of, by position among
+                    the measure's children, and the number of notes examined.
+    :type matches: (List[int], List[(int, int)], int)
+    :param divisions: The number of divisions per quarter note in effect for this measure.
+    :type divisions: int
+    :return: None
+    """
+    unmatched, kept, notes_examined = matches
+    children = list(measure)
+    for position in unmatched:
+        remove_from_selection(children[position])
+    for position, duration in kept:
+        set_note_duration(children[position], duration, divisions)
+    if metrics.enabled:
+        metrics.count('notes_examined', notes_examined)
 
 
 def trim_note(measure, note, note_index, start_time, duration, matched_ema_range, divisions):
@@ -203,7 +523,6 @@ def trim_note(measure, note, note_index, start_time, duration, matched_ema_range
     e = matched_ema_range.end == 'end' or matched_ema_range.end >= end_time
     # If the note overflows outside the matched_ema_range, we need to trim and replace the open spaces with rests.
     trimmed_start, trimmed_end = start_time, start_time + duration
-    print("Starting note length:", trimmed_end - trimmed_start)
     # TODO: Instead of directly setting rest length, split into unit lengths
     #  e.g. eighth + sixteenth rather than dotted eighth. when should this happen vs. combined?
     if not s:
@@ -216,6 +535,8 @@ def trim_note(measure, note, note_index, start_time, duration, matched_ema_range
         rest_length = end_time - matched_ema_range.end
         rest = create_rest_element(note, rest_length, divisions)
         measure.insert(note_index + 1, rest)
+    if not (s and e):
+        metrics.count('notes_trimmed')
     if s or e:
         new_duration = int(trimmed_end - trimmed_start)
         set_note_duration(note, new_duration, divisions)
@@ -246,7 +567,7 @@ def set_note_duration(note, duration, divisions):
 
         normal_type = time_mod.find('normal-type')
         if normal_type is None:
-            normal_type = ET.Element('normal-type')
+            normal_type = time_mod.makeelement('normal-type', {})
             time_mod.append(normal_type)
         normal_type.text = note.find('type').text
 
@@ -258,9 +579,7 @@ def set_note_duration(note, duration, divisions):
         note_denom = int(note_denom * 3 / 2)
         note.find('type').text = NOTE_TYPES[note_denom]
         type_index = list(note).index(note.find('type'))
-        note.insert(type_index + 1, ET.Element("dot"))
-
-    print(f"Set type: {NOTE_TYPES[note_denom]}, duration: {duration}")
+        note.insert(type_index + 1, note.makeelement("dot", {}))
 
 
 def create_rest_element(note, duration, divisions):
@@ -283,8 +602,9 @@ def create_rest_element(note, duration, divisions):
     if new_note.find("notations") is not None:
         new_note.remove(new_note.find("notations"))
 
-    new_note.insert(0, ET.Element("rest"))
+    new_note.insert(0, new_note.makeelement("rest", {}))
     set_note_duration(new_note, duration, divisions)
+    metrics.count('rests_inserted')
     return new_note
 
 
@@ -300,8 +620,8 @@ def elem_to_dict(elem):
                     The key (tag) maps to a list of elements with that tag (each with its own dictionary).
     :rtype: dict[str, list[dict]]
     """
-    d = {'text': elem.text, 'tail': elem.tail, 'attrib': elem.attrib}
-    if elem:
+    d = {'text': elem.text, 'tail': elem.tail, 'attrib': dict(elem.attrib)}
+    if len(elem):
         for child in elem:
             if child.tag not in d:
                 d[child.tag] = []
@@ -309,7 +629,7 @@ def elem_to_dict(elem):
     return d
 
 
-def dict_to_elem(name, d, indent=0):
+def dict_to_elem(name, d, indent=0, make_element=ET.Element):
     """ Inverse function for elem_to_dict. Allows a custom indentation for the XML test.
 
     :param name: The tag of the element to create.
@@ -318,18 +638,20 @@ def dict_to_elem(name, d, indent=0):
     :type d: dict[str, list[dict]]
     :param indent: The number of spaces to indent the text by per level.
     :type indent: int
+    :param make_element: Creates an element from a tag and attributes; pass the makeelement method of an element
+                         in the target tree, so that the new element belongs to the same XML backend.
     :return: An element with inner elements specified by d.
     :rtype: ET.Element
     """
-    elem = ET.Element(name)
+    # Attribute dicts may be shared between the selections built by slice_score_many, so each element gets its own.
+    elem = make_element(name, dict(d.get('attrib')))
     exclude_keys = ['text', 'tail', 'attrib']
     elem.text = d.get('text', '\n' + ' '*(indent+2))
     elem.tail = d.get('tail', "\n" + ' '*indent)
-    elem.attrib = d.get('attrib')
     for key in d:
         if key not in exclude_keys:
             for child_dict in d[key]:
-                elem.append(dict_to_elem(key, child_dict, indent + 2))
+                elem.append(dict_to_elem(key, child_dict, indent + 2, make_element))
     return elem
 
 
@@ -359,9 +681,176 @@ def remove_from_selection(note: ET.Element):
     note_remove = ["pitch", "stem", "lyric"]
     for r in note_remove:
         note_elem = note.find(r)
-        if note_elem:
+        if note_elem is not None and len(note_elem):
             note.remove(note_elem)
-    note.insert(0, ET.Element("rest"))
+    note.insert(0, note.makeelement("rest", {}))
+
+
+def coalesce_rests(measure, divisions):
+    """ Merges the rests left in a measure by the beat selection, for completeness 'nospace'.
+
+    Consecutive rests in the same voice and tuplet context become the fewest rests of plain note values that fill
+    the same time, and a staff (the notes between two <backup>s) with nothing but rests becomes a single
+    whole-measure rest. Rests lose their beams, ties, lyrics and other notations, apart from tuplet brackets, which
+    runs of merged rests do not cross. Rests with <chord/> are dropped, as they take no time.
+
+    :param measure: An ET.Element with tag "measure"; it is edited in place.
+    :type measure: ET.Element
+    :param divisions: The number of divisions per quarter note in effect for this measure.
+    :type divisions: int
+    :return: None
+    """
+    children = []
+    staff = []  # The children of the current staff, with its rests merged
+    rests = []  # The rests of the current staff, before merging
+    only_rests = True
+    run = []
+    for child in list(measure) + [None]:
+        if child is not None and child.tag == 'note' and child.find('rest') is not None:
+            if child.find('chord') is None:
+                # Runs do not cross tuplet brackets, so that each bracket keeps its start and stop.
+                tuplets = [tuplet.get('type') for tuplet in child.findall('notations/tuplet')]
+                if run and (rest_context(run[0]) != rest_context(child) or 'start' in tuplets):
+                    staff.extend(merge_rests(run, divisions))
+                    run = []
+                run.append(child)
+                rests.append(child)
+                if 'stop' in tuplets:
+                    staff.extend(merge_rests(run, divisions))
+                    run = []
+            continue
+        if run:
+            staff.extend(merge_rests(run, divisions))
+            run = []
+        if child is None or child.tag == 'backup':
+            if only_rests and rests:
+                rest = measure_rest(rests[0], sum(note_duration(note) for note in rests), divisions)
+                first = next(i for i, elem in enumerate(staff) if elem.tag == 'note')
+                staff = staff[:first] + [rest] + [elem for elem in staff[first:] if elem.tag != 'note']
+            children.extend(staff)
+            if child is not None:
+                children.append(child)
+            if metrics.enabled:
+                metrics.count('rests_coalesced', len(rests) - sum(elem.tag == 'note' and elem.find('rest') is not None
+                                                                  for elem in staff))
+            staff, rests, only_rests = [], [], True
+            continue
+        if child.tag in ('note', 'forward'):
+            only_rests = False
+        staff.append(child)
+    measure[:] = children
+
+
+def rest_context(note):
+    """ The voice and tuplet ratio of a note; only rests with the same context are merged. """
+    time_mod = note.find('time-modification')
+    ratio = (time_mod.findtext('actual-notes'), time_mod.findtext('normal-notes')) if time_mod is not None else None
+    return note.findtext('voice'), ratio
+
+
+def note_duration(note):
+    return int(note.find('duration').text)
+
+
+def strip_rest(note):
+    """ Removes what a rest does not need from a rest made by remove_from_selection: pitch, stem, beams, ties,
+    lyrics and every notation but tuplet brackets. """
+    for child in list(note):
+        if child.tag in REST_REMOVE:
+            note.remove(child)
+    notations = note.find('notations')
+    if notations is not None:
+        for child in list(notations):
+            if child.tag != 'tuplet':
+                notations.remove(child)
+        if not len(notations):
+            note.remove(notations)
+
+
+def merge_rests(run, divisions):
+    """ Returns the rests that replace a run of consecutive rests with the same voice and tuplet context. If the
+    run cannot be written with fewer rests, its rests are kept, stripped by strip_rest.
+
+    :param run: The <note> elements of the rests, in order.
+    :type run: List[ET.Element]
+    :param divisions: The number of divisions per quarter note in effect for the measure.
+    :type divisions: int
+    :rtype: List[ET.Element]
+    """
+    time_mod = run[0].find('time-modification')
+    ratio = (int(time_mod.find('actual-notes').text), int(time_mod.find('normal-notes').text)) \
+        if time_mod is not None else (1, 1)
+    durations = rest_durations(sum(note_duration(note) for note in run), divisions, ratio)
+    for note in run:
+        strip_rest(note)
+    if len(durations) >= len(run):
+        return run
+    # create_rest_element adds the <rest>, and set_note_duration the <type> of the new duration.
+    template = copy.deepcopy(run[0])
+    for child in list(template):
+        if child.tag in ('rest', 'dot', 'notations'):
+            template.remove(child)
+    if template.find('type') is None:
+        type_elem = template.makeelement('type', {})
+        type_elem.text = 'quarter'
+        template.insert(list(template).index(template.find('duration')) + 1, type_elem)
+    rests = [create_rest_element(template, duration, divisions) for duration in durations]
+    # A run can only start or stop a tuplet bracket at its ends; so do the new rests.
+    for tuplet in [tuplet for note in run for tuplet in note.findall('notations/tuplet')]:
+        rest = rests[0] if tuplet.get('type') == 'start' else rests[-1]
+        notations = rest.find('notations')
+        if notations is None:
+            notations = rest.makeelement('notations', {})
+            rest.append(notations)
+        notations.append(tuplet)
+    return rests
+
+
+def measure_rest(note, duration, divisions):
+    """ Creates a whole-measure rest lasting `duration`, with the voice and staff of the rest `note`.
+
+    :param note: A rest of the staff, stripped by strip_rest.
+    :type note: ET.Element
+    :param duration: The duration of the staff, in divisions.
+    :type duration: int
+    :param divisions: The number of divisions per quarter note in effect for the measure.
+    :type divisions: int
+    :rtype: ET.Element
+    """
+    rest = copy.deepcopy(note)
+    for child in list(rest):
+        if child.tag in ('dot', 'type', 'time-modification', 'notations'):
+            rest.remove(child)
+    rest.find('rest').attrib['measure'] = 'yes'
+    rest.find('duration').text = str(duration)
+    return rest
+
+
+def rest_durations(duration, divisions, ratio=(1, 1)):
+    """ Splits a duration into the fewest plain (undotted) note values, longest first. A remainder that no note value
+    in NOTE_TYPES can fill is kept as a last rest of its own.
+
+    :param duration: The duration, in divisions.
+    :type duration: int
+    :param divisions: The number of divisions per quarter note.
+    :type divisions: int
+    :param ratio: The actual-notes and normal-notes of the rests' time-modification, if they are in a tuplet.
+    :type ratio: (int, int)
+    :rtype: List[int]
+    """
+    actual, normal = ratio
+    durations = []
+    for denom in sorted(NOTE_TYPES):
+        # The duration of one note of this type: a quarter lasts `divisions`, scaled by the tuplet ratio.
+        if (4 * divisions * normal) % (denom * actual):
+            continue
+        value = 4 * divisions * normal // (denom * actual)
+        while value and duration >= value:
+            durations.append(value)
+            duration -= value
+    if duration:
+        durations.append(duration)
+    return durations
 
 
 def remove_unselected_parts(tree, selected_parts):
@@ -374,9 +863,24 @@ def remove_unselected_parts(tree, selected_parts):
     :return: None
     """
     parts = tree.findall("part")
-    partlist = tree.find("part-list")
-    scoreparts = partlist.findall("score-part")
     for s in range(len(parts) - 1, -1, -1):
         if s not in selected_parts:
             tree.getroot().remove(parts[s])
+    remove_unselected_score_parts(tree.find("part-list"), selected_parts, len(parts))
+
+
+def remove_unselected_score_parts(partlist, selected_parts, num_parts):
+    """ Removes the <score-part> elements of non-selected parts from the <part-list>.
+
+    :param partlist: An ET.Element with tag "part-list".
+    :type partlist: ET.Element
+    :param selected_parts: The selected part numbers.
+    :type selected_parts: List[int]
+    :param num_parts: The number of <part> elements in the score.
+    :type num_parts: int
+    :return: None
+    """
+    scoreparts = partlist.findall("score-part")
+    for s in range(num_parts - 1, -1, -1):
+        if s not in selected_parts:
             partlist.remove(scoreparts[s])
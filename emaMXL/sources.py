@@ -0,0 +1,64 @@
+import os
+import posixpath
+import zipfile
+import xml.etree.ElementTree as ET
+from emaMXL.exceptions import UnsupportedEncoding
+
+ZIP_MAGIC = b'PK\x03\x04'
+CONTAINER_PATH = 'META-INF/container.xml'
+MUSICXML_MEDIA_TYPES = ['application/vnd.recordare.musicxml+xml', 'application/vnd.recordare.musicxml']
+
+
+def open_score(filepath):
+    """ Opens a score for parsing, as a binary file-like object.
+
+    Compressed MusicXML (.mxl) is recognized by its zip signature rather than its extension. The root file named by
+    the container manifest is decompressed as it is read, so nothing is extracted to disk or inflated up front.
+
+    :param filepath: A filepath to a MusicXML (.xml or .mxl) score.
+    :type filepath: str
+    :return: A binary file-like object positioned at the start of the MusicXML document; the caller closes it.
+    """
+    f = open(filepath, 'rb')
+    if f.read(len(ZIP_MAGIC)) != ZIP_MAGIC:
+        f.seek(0)
+        return f
+    f.close()
+    # The opened member keeps the archive's file open after the ZipFile itself is closed.
+    with zipfile.ZipFile(filepath) as archive:
+        return archive.open(find_root_file(archive))
+
+
+def score_size(filepath):
+    """ Returns the size in bytes of the MusicXML document, which for .mxl is its size after decompression. """
+    with open(filepath, 'rb') as f:
+        if f.read(len(ZIP_MAGIC)) != ZIP_MAGIC:
+            return os.fstat(f.fileno()).st_size
+    with zipfile.ZipFile(filepath) as archive:
+        return archive.getinfo(find_root_file(archive)).file_size
+
+
+def find_root_file(archive):
+    """ Finds the MusicXML document inside a compressed .mxl container.
+
+    :param archive: An opened .mxl container.
+    :type archive: zipfile.ZipFile
+    :return: The name of the archive member holding the score.
+    :rtype: str
+    """
+    names = archive.namelist()
+    if CONTAINER_PATH in names:
+        container = ET.fromstring(archive.read(CONTAINER_PATH))
+        for rootfile in container.iter():
+            if rootfile.tag.rsplit('}', 1)[-1] != 'rootfile':
+                continue
+            media_type = rootfile.get('media-type')
+            full_path = rootfile.get('full-path')
+            if full_path in names and (media_type is None or media_type in MUSICXML_MEDIA_TYPES):
+                return full_path
+    # Some writers omit the manifest; fall back to the only MusicXML file at the top of the archive.
+    candidates = [name for name in names if posixpath.dirname(name) != 'META-INF' and
+                  name.lower().endswith(('.xml', '.musicxml'))]
+    if len(candidates) == 1:
+        return candidates[0]
+    raise UnsupportedEncoding(f"Could not find the MusicXML root file in {archive.filename}.")
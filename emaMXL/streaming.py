@@ -0,0 +1,307 @@
+import copy
+import zlib
+import xml.etree.ElementTree as ET
+from xml.sax.saxutils import escape
+from emaMXL.cache import load_score_index
+from emaMXL.emaexp import parse_ema_exp
+from emaMXL.emaexpfull import EmaExpFull
+from emaMXL.metrics import metrics
+from emaMXL.scoreindex import scan_score
+from emaMXL.sidecar import load_sidecar
+from emaMXL.sources import open_score
+from emaMXL.xmlbackend import tostring
+from emaMXL.slicer import carry_attributes, process_measure, remove_unselected_score_parts, iter_selected_measures, \
+    match_selected_beats
+
+CHUNK_SIZE = 64 * 1024
+
+
+def slice_score_stream(source, exp_str, out, score_index=None):
+    """ Slices a score without loading it into memory, writing the selection to out as it is produced.
+
+    Only one measure of the score is held in memory at a time; unselected measures are discarded as soon as their
+    attribute changes have been recorded. The output is identical to ET.tostring(slice_score_path(...).getroot()).
+
+    :param source: A filepath to a MusicXML (.xml or .mxl) score.
+    :type source: str
+    :param exp_str: A string describing an EMA selection.
+    :type exp_str: str
+    :param out: A binary file-like object the selection is written to.
+    :param score_index: The index of the score, if already known. Otherwise it is loaded from the score's sidecar
+                        file or, if there is no valid sidecar, the score is scanned first.
+    :type score_index: ScoreIndex
+    :return: None
+    """
+    if score_index is None:
+        with metrics.stage('index'):
+            score_index = load_sidecar(source) or scan_score(source)
+    with metrics.stage('parse_expression'):
+        ema_exp = parse_ema_exp(exp_str)
+    with metrics.stage('expand'):
+        ema_exp_full = EmaExpFull(score_index, ema_exp)
+    # Parsing, slicing and serializing are interleaved, so streaming is timed as a single stage.
+    with metrics.stage('slice'):
+        for chunk in iterslice(source, ema_exp_full):
+            out.write(chunk)
+
+
+def slice_score_chunks(filepath, exp_str, chunk_size=CHUNK_SIZE):
+    """ Slices a cached score and returns its serialization as an iterator of chunks, for streaming responses.
+
+    The expression is parsed and expanded before this returns, so invalid requests fail here rather than after the
+    response has started. The output is identical to ET.tostring(slice_score_path(filepath, exp_str).getroot()).
+
+    :param filepath: A filepath to a MusicXML (.xml or .mxl) score.
+    :type filepath: str
+    :param exp_str: A string describing an EMA selection.
+    :type exp_str: str
+    :param chunk_size: Chunks are at least this many bytes, except for the last one.
+    :type chunk_size: int
+    :return: Generator of bytes.
+    """
+    score_index = load_score_index(filepath)
+    with metrics.stage('parse_expression'):
+        ema_exp = parse_ema_exp(exp_str)
+    with metrics.stage('expand'):
+        ema_exp_full = EmaExpFull(score_index, ema_exp)
+    return buffered(iterslice_tree(score_index, ema_exp_full), chunk_size)
+
+
+def prepare_slice(score_index, ema_exp_full):
+    """ Does the part of slicing a parsed score that can fail on the score's content, so that a caller can report the
+    failure before it starts sending the selection: matches the notes of every selected part against the selection,
+    and evaluates the selected measures the matching could not (see emaMXL.timeline.PartTimeline.irregular).
+
+    :param score_index: The index of the score, including its parsed tree.
+    :type score_index: ScoreIndex
+    :param ema_exp_full: EmaExpFull object built from score_index.
+    :type ema_exp_full: EmaExpFull
+    :return: The matches of each selected part, by part index, for iterslice_tree.
+    :rtype: dict[int, emaMXL.timeline.PartMatches]
+    """
+    selection = ema_exp_full.selection
+    prepared = {}
+    for part_idx, part_index in enumerate(score_index.parts):
+        if not selection.intersects(1, len(part_index.measures)):
+            continue
+        prepared[part_idx] = match_selected_beats(part_index, ema_exp_full)
+        irregular = part_index.timeline.irregular if part_index.timeline is not None else []
+        for number in irregular:
+            if number in selection:
+                # Raises the same exception as slicing the measure would.
+                measure_info = part_index.measures[number - 1]
+                process_measure(copy.deepcopy(measure_info.element), selection[number], part_index.starting_staff,
+                                measure_info.divisions, ema_exp_full.completeness, None)
+    return prepared
+
+
+def iterslice_tree(score_index, ema_exp_full, prepared=None):
+    """ Serializes the selection of a parsed score as it is built, one measure at a time.
+
+    The score is not modified, and the selection is never assembled into a tree: each selected measure is copied,
+    processed, serialized and dropped, so memory does not grow with the size of the selection. The output is
+    identical to ET.tostring(slice_score(score_index.tree, ema_exp_full, in_place=False).getroot()).
+
+    :param score_index: The index of the score, including its parsed tree.
+    :type score_index: ScoreIndex
+    :param ema_exp_full: EmaExpFull object built from score_index.
+    :type ema_exp_full: EmaExpFull
+    :param prepared: The result of prepare_slice(score_index, ema_exp_full), if it was called.
+    :type prepared: dict[int, emaMXL.timeline.PartMatches]
+    :return: Generator of bytes.
+    """
+    for chunk in iterslice_frame(score_index, ema_exp_full):
+        if isinstance(chunk, int):
+            yield from iterslice_part(score_index.parts[chunk], ema_exp_full,
+                                      prepared[chunk] if prepared is not None else None)
+        else:
+            yield chunk
+
+
+def iterslice_frame(score_index, ema_exp_full):
+    """ Serializes everything in the selection of a parsed score except for its parts, which are left to
+    iterslice_part. Parts can then be sliced separately, e.g. in parallel by emaMXL.workers.SlicePool.slice_parts.
+
+    :param score_index: The index of the score, including its parsed tree.
+    :type score_index: ScoreIndex
+    :param ema_exp_full: EmaExpFull object built from score_index.
+    :type ema_exp_full: EmaExpFull
+    :return: Generator of bytes and, in place of each selected part, the part's index.
+    """
+    root = score_index.tree.getroot()
+    selection = ema_exp_full.selection
+    selected_parts = [p for p, part_index in enumerate(score_index.parts)
+                      if selection.intersects(1, len(part_index.measures))]
+    yield start_tag(root)
+    part_idx = -1
+    for child in root:
+        if child.tag != 'part':
+            if child.tag == 'part-list':
+                child = copy.deepcopy(child)
+                remove_unselected_score_parts(child, selected_parts, len(score_index.parts))
+            yield tostring(child)
+            continue
+        part_idx += 1
+        if part_idx in selected_parts:
+            yield part_idx
+    yield end_tag(root) + escape_text(root.tail)
+
+
+def iterslice_part(part_index, ema_exp_full, matches=None):
+    """ Serializes the selection of one part of a parsed score, one measure at a time (see iterslice_tree).
+
+    :param part_index: The index of the part, including its element.
+    :type part_index: emaMXL.scoreindex.PartIndex
+    :param ema_exp_full: EmaExpFull object built from the score's index.
+    :type ema_exp_full: EmaExpFull
+    :param matches: The part's matches from match_selected_beats, if they were already made (see prepare_slice).
+    :type matches: emaMXL.timeline.PartMatches
+    :return: Generator of bytes.
+    """
+    selection = ema_exp_full.selection
+    part = part_index.element
+    yield start_tag(part)
+    if matches is None:
+        matches = match_selected_beats(part_index, ema_exp_full)
+    for measure_info, insert_attrib in iter_selected_measures(part_index, selection):
+        measure = copy.deepcopy(measure_info.element)
+        process_measure(measure, selection[measure_info.number], part_index.starting_staff,
+                        measure_info.divisions, ema_exp_full.completeness, insert_attrib,
+                        matches.get(measure_info.number) if matches else None)
+        yield tostring(measure)
+    yield end_tag(part) + escape_text(part.tail)
+
+
+def buffered(chunks, chunk_size=CHUNK_SIZE):
+    """ Joins small chunks into chunks of at least chunk_size bytes, so that each write to the client is worthwhile. """
+    buffer = []
+    size = 0
+    for chunk in chunks:
+        buffer.append(chunk)
+        size += len(chunk)
+        if size >= chunk_size:
+            yield b''.join(buffer)
+            buffer = []
+            size = 0
+    if buffer:
+        yield b''.join(buffer)
+
+
+def gzip_chunks(chunks, level=6):
+    """ Compresses a stream of chunks into a gzip stream, flushing the compressor after each chunk so that the
+    client receives data as it is produced. """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)  # wbits 16 + 15: gzip container
+    for chunk in chunks:
+        data = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def iterslice(source, ema_exp_full):
+    """ Streams the selection described by ema_exp_full, yielding the serialized output in chunks.
+
+    Root-level elements other than parts (e.g. <part-list>) are yielded once complete, and each selected measure is
+    yielded as soon as it has been processed. Unselected parts are never written.
+
+    :param source: A filepath to a MusicXML (.xml or .mxl) score.
+    :type source: str
+    :param ema_exp_full: EmaExpFull object built from a ScoreIndex of the score.
+    :type ema_exp_full: EmaExpFull
+    :return: Generator of bytes.
+    """
+    score_index = ema_exp_full.score_index
+    selection = ema_exp_full.selection
+    completeness = ema_exp_full.completeness
+    selected_parts = [p for p, part_index in enumerate(score_index.parts)
+                      if selection.intersects(1, len(part_index.measures))]
+
+    path = []  # Elements currently open, from the root down
+    opened = set()  # Elements whose start tag has been written
+    pending = None
+    part_idx = -1
+    part_index = None
+    part_selected = False
+    measure_num = 0
+    insert_attrib = {}
+    with open_score(source) as f:
+        for event, elem in ET.iterparse(f, events=('start', 'end')):
+            # An element's tail is only known once the parser reaches the next event,
+            # so finished elements are held back by one event before they are written.
+            if pending is not None:
+                yield finish_pending(*pending)
+                pending = None
+
+            if event == 'start':
+                path.append(elem)
+                if len(path) == 2:
+                    yield from open_element(path[0], opened)
+                    if elem.tag == 'part':
+                        part_idx += 1
+                        part_index = score_index.parts[part_idx]
+                        part_selected = part_idx in selected_parts
+                        measure_num = 0
+                        insert_attrib = {}
+                elif len(path) == 3 and path[1].tag == 'part' and part_selected:
+                    yield from open_element(path[1], opened)
+                continue
+
+            path.pop()
+            if len(path) == 2 and path[1].tag == 'part':
+                measure_num += 1
+                m_attr_elem = elem.find('attributes')
+                if m_attr_elem is not None:
+                    carry_attributes(m_attr_elem, insert_attrib)
+                if part_selected and measure_num in selection:
+                    process_measure(elem, selection[measure_num], part_index.starting_staff,
+                                    part_index.measures[measure_num - 1].divisions, completeness, insert_attrib)
+                    pending = ('element', elem, path[1])
+                else:
+                    path[1].remove(elem)
+            elif len(path) == 1:
+                if elem.tag != 'part':
+                    if elem.tag == 'part-list':
+                        remove_unselected_score_parts(elem, selected_parts, len(score_index.parts))
+                    pending = ('element', elem, path[0])
+                elif part_selected:
+                    yield from open_element(elem, opened)
+                    pending = ('close', elem, path[0])
+                else:
+                    path[0].remove(elem)
+            elif not path:
+                yield from open_element(elem, opened)
+                yield end_tag(elem)
+
+
+def open_element(elem, opened):
+    """ Yields the start tag and text of elem, unless they have already been written. """
+    if elem not in opened:
+        opened.add(elem)
+        yield start_tag(elem)
+
+
+def finish_pending(kind, elem, parent):
+    """ Serializes a finished element (or the end tag of an opened one) and frees it from its parent. """
+    if kind == 'element':
+        data = ET.tostring(elem)
+    else:
+        data = end_tag(elem) + escape_text(elem.tail)
+    parent.remove(elem)
+    return data
+
+
+def start_tag(elem):
+    """ Serializes the start tag and text of elem exactly as ET.tostring would. """
+    shell = ET.Element(elem.tag, dict(elem.attrib))
+    shell.text = elem.text
+    return ET.tostring(shell, short_empty_elements=False)[:-len(end_tag(elem))]
+
+
+def end_tag(elem):
+    return f"</{elem.tag}>".encode('ascii')
+
+
+def escape_text(text):
+    if not text:
+        return b''
+    return escape(text).encode('ascii', 'xmlcharrefreplace')
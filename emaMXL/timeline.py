@@ -0,0 +1,318 @@
+import copy
+from array import array
+from bisect import bisect_left, bisect_right
+from types import MappingProxyType
+from emaMXL.emaexpfull import BeatIntervals
+
+try:
+    import numpy as np
+except ImportError:  # numpy is optional; without it, notes are matched one at a time against the same columns.
+    np = None
+
+
+class PartTimeline(object):
+    """ The notes of a part as columns, built once per parsed score, so that beat selection does not have to look up
+        <duration> and <rest> in every note of every selected measure on every request.
+
+        Column i describes the i-th note of the part, in score order: its onset and duration in divisions (as
+        select_beats counts them: durations add up, every <backup> goes back in time and starts the next staff),
+        its staff (the number of <backup>s before it in its measure), voice (-1 if not a number), measure number,
+        whether it is a rest, and its position among its measure's children, which refers back to the element both
+        in the score and in copies of its measure. The notes of measure n are those from measure_starts[n - 1] to
+        measure_starts[n].
+
+        Measures that select_beats could not evaluate (e.g. a note or <backup> without a <duration>) have no notes
+        and are listed in irregular; the slicer walks them as before, so they fail in the same way.
+    """
+    __slots__ = ('onsets', 'durations', 'staves', 'voices', 'measures', 'rests', 'positions', 'measure_starts',
+                 'measure_notes', 'division_changes', 'irregular')
+
+    def __init__(self):
+        self.onsets = array('q')
+        self.durations = array('q')
+        self.staves = array('i')
+        self.voices = array('i')
+        self.measures = array('i')
+        self.rests = array('b')
+        self.positions = array('i')
+        self.measure_starts = array('q', [0])
+        self.measure_notes = array('i')  # the number of notes (not rests) in each measure
+        self.division_changes = []  # the measures whose divisions differ from those of the previous measure
+        self.irregular = []
+
+    @classmethod
+    def from_part(cls, part_index):
+        """
+        :param part_index: The index of a part, with references to its measures.
+        :type part_index: emaMXL.scoreindex.PartIndex
+        :rtype: PartTimeline
+        """
+        timeline = cls()
+        divisions = None
+        for info in part_index.measures:
+            if info.divisions != divisions or info.number == 1:
+                timeline.division_changes.append(info.number)
+                divisions = info.divisions
+            timeline.add_measure(info.number, info.element, info.divisions is None)
+        return timeline
+
+    def add_measure(self, number, measure, irregular=False):
+        notes = []
+        staff = 0
+        curr_time = 0
+        try:
+            for position, child in enumerate(measure):
+                duration_elem = child.find("duration")
+                duration = int(duration_elem.text) if duration_elem is not None else None
+                if child.tag == 'note':
+                    voice_elem = child.find("voice")
+                    voice = voice_elem.text.strip() if voice_elem is not None and voice_elem.text else ''
+                    notes.append((curr_time, duration, staff, int(voice) if voice.isdigit() else -1,
+                                  child.find("rest") is not None, position))
+                    curr_time += duration
+                elif child.tag == 'backup':
+                    staff += 1
+                    curr_time -= duration
+        except (TypeError, ValueError):
+            irregular = True
+        if irregular:
+            notes = []
+            self.irregular.append(number)
+        for onset, duration, staff_num, voice, rest, position in notes:
+            self.onsets.append(onset)
+            self.durations.append(duration)
+            self.staves.append(staff_num)
+            self.voices.append(voice)
+            self.measures.append(number)
+            self.rests.append(rest)
+            self.positions.append(position)
+        self.measure_starts.append(len(self.onsets))
+        self.measure_notes.append(sum(1 for note in notes if not note[4]))
+
+    def __len__(self):
+        return len(self.onsets)
+
+
+class PartMatches(object):
+    """ The notes of a part matched against a beat selection by match_part. Notes are referred to by their index in
+        the part's timeline; each list is sorted. """
+    __slots__ = ('timeline', 'removed', 'kept', 'walked', 'scale')
+
+    def __init__(self, timeline, removed, kept, walked, scale):
+        self.timeline = timeline
+        self.removed = removed  # notes to remove from the selection
+        self.kept = kept  # selected notes, for completeness 'cut'
+        self.walked = walked  # measures to leave to select_beats
+        self.scale = scale
+
+    def get(self, number):
+        """ Returns the changes to make to a measure, or None if it has to be walked by select_beats.
+
+        :param number: The measure number.
+        :type number: int
+        :return: The positions of the notes to remove from the selection, the positions and (scaled) durations of the
+                 notes to pass to set_note_duration, and the number of notes examined.
+        :rtype: (List[int], List[(int, int)], int)
+        """
+        if number in self.walked:
+            return None
+        timeline = self.timeline
+        first, end = timeline.measure_starts[number - 1], timeline.measure_starts[number]
+        positions = timeline.positions
+        removed = [positions[i] for i in self.removed[bisect_left(self.removed, first):bisect_left(self.removed, end)]]
+        kept = [(positions[i], timeline.durations[i] * self.scale)
+                for i in self.kept[bisect_left(self.kept, first):bisect_left(self.kept, end)]]
+        return removed, kept, timeline.measure_notes[number - 1]
+
+
+class AttributeTimeline(object):
+    """ The attributes in effect throughout a part, built once per parsed score from the part's <attributes> elements.
+
+        changes[i] holds the attributes set by the i-th measure with an <attributes> element (measures[i]), and
+        snapshots[i] all attributes in effect from that measure on, i.e. changes[0..i] merged. Both are read-only
+        mappings in the form of elem_to_dict, and each snapshot shares every entry it does not change with the one
+        before it. The <attributes> elements the slicer inserts are built from them once and copied on each use.
+    """
+    __slots__ = ('measures', 'changes', 'snapshots', 'to_element', 'elements')
+
+    def __init__(self, part_index, to_dict, to_element):
+        """
+        :param part_index: The index of a part, with references to its measures.
+        :type part_index: emaMXL.scoreindex.PartIndex
+        :param to_dict: Converts an <attributes> element to a dict (slicer.attributes_to_dict).
+        :param to_element: Converts such a dict back to an <attributes> element, for the part's XML backend.
+        """
+        self.measures = part_index.attribute_measures
+        self.changes = []
+        self.snapshots = []
+        snapshot = {}
+        for number in self.measures:
+            change = MappingProxyType(to_dict(part_index.measures[number - 1].attributes))
+            snapshot = dict(snapshot)
+            snapshot.update(change)
+            self.changes.append(change)
+            self.snapshots.append(MappingProxyType(snapshot))
+        self.to_element = to_element
+        self.elements = {}  # (first change, end change) -> <attributes> element
+
+    def effective(self, number):
+        """ Returns the attributes in effect in a measure, e.g. effective(m)['divisions'][0]['text'].
+
+        :param number: The measure number.
+        :type number: int
+        :rtype: Mapping[str, list[dict]]
+        """
+        i = bisect_right(self.measures, number) - 1
+        return self.snapshots[i] if i >= 0 else MappingProxyType({})
+
+    def element(self, previous, number):
+        """ Returns a new <attributes> element holding the attributes set after measure `previous`, up to and including
+        measure `number`, or None if there are none. For previous == 0 these are all the attributes in effect.
+
+        :param previous: The last measure whose attributes are not included.
+        :type previous: int
+        :param number: The last measure whose attributes are included.
+        :type number: int
+        :rtype: ET.Element
+        """
+        first = bisect_right(self.measures, previous)
+        end = bisect_right(self.measures, number)
+        if first == end:
+            return None
+        key = (first, end)
+        element = self.elements.get(key)
+        if element is None:
+            if first == 0:
+                attributes = self.snapshots[end - 1]
+            else:
+                attributes = {}
+                for change in self.changes[first:end]:
+                    attributes.update(change)
+            element = self.to_element(attributes)
+            # Only the elements of contiguous and first selected measures are kept; other spans are rarely repeated.
+            if first == 0 or end - first == 1:
+                self.elements[key] = element
+        return copy.deepcopy(element)
+
+
+def part_timeline(part_index):
+    """ Returns the timeline of a part, building it on first use. Parts indexed without their elements (see
+    scan_score and emaMXL.sidecar) have none. """
+    if part_index.timeline is None and part_index.measures and part_index.measures[0].element is not None:
+        part_index.timeline = PartTimeline.from_part(part_index)
+    return part_index.timeline
+
+
+def match_part(part_index, selection, completeness=None, scale=1):
+    """ Matches the notes of every selected measure of a part against their beat selections.
+
+    A note is selected under the same rule as in select_beats (see BeatIntervals). Consecutive selected measures that
+    share their beat ranges and divisions form a segment, whose notes are matched all at once. Notes that are not
+    selected are removed from the selection, and with completeness 'cut' every selected note is passed to
+    set_note_duration. A measure with a note that 'cut' may trim (which inserts rests and shifts the children after
+    it) is left to select_beats, as are irregular measures.
+
+    :param part_index: The index of the part.
+    :type part_index: emaMXL.scoreindex.PartIndex
+    :param selection: EmaExpFull.selection
+    :type selection: emaMXL.emaexpfull.RangeMap
+    :param completeness: Additional selection argument described in EMA API.
+    :type completeness: str
+    :param scale: The factor divisions and durations are scaled by (slicer.SCALING_CONSTANT).
+    :type scale: int
+    :return: The matches, or None if the part has no timeline.
+    :rtype: PartMatches
+    """
+    timeline = part_timeline(part_index)
+    if timeline is None:
+        return None
+    cut = completeness == 'cut'
+    match = match_arrays if np is not None else match_notes
+    removed, kept, partial = [], [], []
+    walked = set()
+    measure_starts, irregular = timeline.measure_starts, timeline.irregular
+    for first, last, ema_measure in iter_segments(timeline, selection, len(part_index.measures)):
+        walked.update(irregular[bisect_left(irregular, first):bisect_right(irregular, last)])
+        divisions = part_index.measures[first - 1].divisions
+        if divisions is None:
+            continue
+        intervals = {}
+        for staff in set(timeline.staves[measure_starts[first - 1]:measure_starts[last]]):
+            ranges = ema_measure.get(part_index.starting_staff + staff)
+            intervals[staff] = BeatIntervals(ranges or [], divisions * scale)
+        match(timeline, measure_starts[first - 1], measure_starts[last], intervals, scale, cut, removed, kept, partial)
+    if np is not None:
+        # match_arrays extends the lists staff by staff.
+        removed.sort()
+        kept.sort()
+    walked.update(timeline.measures[i] for i in partial)
+    return PartMatches(timeline, removed, kept, walked, scale)
+
+
+def iter_segments(timeline, selection, num_measures):
+    """ Splits the selected measures of a part into runs of consecutive measures with the same beat selection and
+    divisions.
+
+    :return: Generator of (first measure number, last measure number, selection of the measures).
+    """
+    changes = timeline.division_changes
+    for start, end, ema_measure in selection.runs():
+        start, end = max(start, 1), min(end, num_measures)
+        if start > end:
+            continue
+        for i in range(bisect_right(changes, start), bisect_right(changes, end)):
+            yield start, changes[i] - 1, ema_measure
+            start = changes[i]
+        yield start, end, ema_measure
+
+
+def match_notes(timeline, first, end, intervals, scale, cut, removed, kept, partial):
+    """ Matches the notes of a segment (first..end - 1) one at a time. Appends the notes (rests excluded) that are not
+    selected to removed and, if cut is set, the selected notes to kept and those that cut may trim to partial: the
+    notes reaching outside their interval, and those in an interval merged from several ranges (see BeatIntervals).
+
+    :param intervals: The beat intervals of each staff of the segment.
+    :type intervals: dict[int, BeatIntervals]
+    """
+    onsets, durations, staves, rests = timeline.onsets, timeline.durations, timeline.staves, timeline.rests
+    for i in range(first, end):
+        if rests[i]:
+            continue
+        beat_intervals = intervals[staves[i]]
+        start = onsets[i] * scale
+        stop = start + durations[i] * scale
+        k = bisect_left(beat_intervals.starts, stop) - 1
+        if k < 0 or beat_intervals.ends[k] <= start:
+            removed.append(i)
+        elif cut:
+            kept.append(i)
+            if beat_intervals.starts[k] > start or beat_intervals.ends[k] < stop or beat_intervals.merged[k]:
+                partial.append(i)
+
+
+def match_arrays(timeline, first, end, intervals, scale, cut, removed, kept, partial):
+    """ match_notes with one searchsorted per staff of the segment. """
+    notes = np.arange(first, end)
+    staves = np.frombuffer(timeline.staves, dtype=np.int32)[first:end]
+    not_rest = np.frombuffer(timeline.rests, dtype=np.int8)[first:end] == 0
+    starts = np.frombuffer(timeline.onsets, dtype=np.int64)[first:end] * float(scale)
+    stops = starts + np.frombuffer(timeline.durations, dtype=np.int64)[first:end] * float(scale)
+    for staff, beat_intervals in intervals.items():
+        mask = not_rest & (staves == staff)
+        if not beat_intervals.starts:
+            removed.extend(notes[mask].tolist())
+            continue
+        staff_notes, staff_starts, staff_stops = notes[mask], starts[mask], stops[mask]
+        interval_starts = np.array(beat_intervals.starts, dtype=np.float64)
+        interval_ends = np.array(beat_intervals.ends, dtype=np.float64)
+        # The last interval starting before the note ends; it selects the note if it ends after the note starts.
+        k = np.searchsorted(interval_starts, staff_stops, side='left') - 1
+        selected = (k >= 0) & (interval_ends[np.maximum(k, 0)] > staff_starts)
+        removed.extend(staff_notes[~selected].tolist())
+        if cut:
+            k = np.maximum(k, 0)
+            # Within an interval merged from several ranges, the note may be trimmed to one of them.
+            whole = ((interval_starts[k] <= staff_starts) & (interval_ends[k] >= staff_stops) &
+                     ~np.array(beat_intervals.merged, dtype=bool)[k])
+            kept.extend(staff_notes[selected].tolist())
+            partial.extend(staff_notes[selected & ~whole].tolist())
@@ -0,0 +1,233 @@
+import multiprocessing
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, TimeoutError
+from emaMXL import slicer
+from emaMXL.cache import load_score_index, score_cache, score_cache_key, TREE_SIZE_FACTOR
+from emaMXL.emaexp import parse_ema_exp
+from emaMXL.emaexpfull import EmaExpFull
+from emaMXL.scoreindex import index_part, read_part
+from emaMXL.streaming import iterslice_frame, iterslice_part
+from emaMXL.xmlbackend import tostring
+from emaMXL.exceptions import WorkerPoolBusy, WorkerTimeout
+
+
+class SlicePool(object):
+    """ Runs slicing in a pool of worker processes, so that CPU-bound requests are not serialized by the GIL.
+
+        Each worker keeps its own score cache, and results are serialized in the worker so that only bytes cross the
+        process boundary. At most workers + max_queue requests are accepted at a time; further requests are refused
+        with WorkerPoolBusy instead of queueing without bound. Workers are replaced after max_tasks_per_child
+        requests, which returns the memory held by their caches and any fragmentation to the OS.
+
+        A request that times out is reported to its caller, but keeps its worker (and its place in the queue) until
+        it finishes; a worker cannot be interrupted without losing the other requests it may have queued. Nothing
+        bounds how long that is: while as many timed-out requests are still running as there are workers, the pool
+        answers new requests with WorkerPoolBusy, long after their callers got WorkerTimeout. Scores that can take
+        that long should be sliced with a longer timeout, or outside of the pool.
+    """
+    def __init__(self, workers=None, max_queue=64, timeout=30, max_tasks_per_child=200):
+        """
+        :param workers: The number of worker processes; defaults to the number of CPUs.
+        :type workers: int
+        :param max_queue: The number of requests that may wait for a free worker.
+        :type max_queue: int
+        :param timeout: Seconds a caller waits for its result.
+        :type timeout: float
+        :param max_tasks_per_child: Requests a worker handles before it is replaced; None never replaces workers.
+        :type max_tasks_per_child: int
+        """
+        self.workers = workers or os.cpu_count() or 1
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(self.workers + max_queue)
+        self._pool = multiprocessing.Pool(self.workers, maxtasksperchild=max_tasks_per_child)
+
+    def slice(self, filepath, exp_str):
+        """ Returns the serialized selection of exp_str from a score, as ET.tostring would. """
+        return self.submit(slice_to_bytes, (filepath, exp_str))
+
+    def slice_many(self, filepath, exp_strs):
+        """ Returns, for each expression, its serialized selection or the MXMLException explaining its failure. """
+        return self.submit(slice_many_to_bytes, (filepath, exp_strs))
+
+    def slice_parts(self, filepath, exp_str):
+        """ Returns the serialized selection of exp_str from a score, slicing its selected parts in parallel.
+
+        One worker serializes everything but the parts (see emaMXL.streaming.iterslice_frame). Every selected part is
+        then sent to a task of its own, which slices and serializes just that part; only the part's position in the
+        score and a few facts about it cross the process boundary, as the task reads the part from the score itself
+        if it has not cached it (see PartCache). The parts are put back in score order. The result is the same as
+        slice's, but a score with many parts is spread over all the workers, and only one of them parses the whole
+        score. Both steps share one deadline, the pool's timeout.
+        """
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        frame = self.submit(slice_frame, (filepath, exp_str), deadline)
+        tasks = [(exp_str, filepath) + chunk for chunk in frame if isinstance(chunk, tuple)]
+        parts = iter(self.submit_many(slice_part_to_bytes, tasks, deadline))
+        return b''.join(next(parts) if isinstance(chunk, tuple) else chunk for chunk in frame)
+
+    def submit_many(self, func, args_list, deadline=None):
+        """ Runs func(*args) for each args in a worker, as one request, and waits for all of the results.
+
+        :raises WorkerPoolBusy: If every worker is busy and the queue is full.
+        :raises WorkerTimeout: If the results are not ready within the pool's timeout, or by the deadline (a
+                               time.monotonic() value) if one is given.
+        :rtype: list
+        """
+        return self.wait(self.start(func, args_list, many=True), deadline)
+
+    def submit(self, func, args, deadline=None):
+        """ Runs func(*args) in a worker and waits for its result, re-raising any exception raised by func.
+
+        :raises WorkerPoolBusy: If every worker is busy and the queue is full.
+        :raises WorkerTimeout: If the result is not ready within the pool's timeout, or by the deadline (a
+                               time.monotonic() value) if one is given.
+        """
+        return self.wait(self.start(func, args), deadline)
+
+    def wait(self, future, deadline=None):
+        """ Waits for the result of a future returned by start, up to the deadline or for the pool's timeout. """
+        timeout = self.timeout if deadline is None else max(0, deadline - time.monotonic())
+        try:
+            return future.result(timeout)
+        except TimeoutError:
+            raise WorkerTimeout(f"The request did not finish within {self.timeout} seconds.")
+
+    def start(self, func, args, many=False):
+        """ Queues func(*args) without waiting for it. Callers that cannot block (e.g. an event loop) wait on the
+        returned future themselves, and are responsible for applying the pool's timeout.
+
+        If many is set, args is a list of argument tuples; func is called with each of them, spread over the workers,
+        and the future's result is the list of return values. The calls take up a single place in the queue.
+
+        :raises WorkerPoolBusy: If every worker is busy and the queue is full.
+        :rtype: concurrent.futures.Future
+        """
+        future = Future()
+        if many and not args:
+            # The pool never calls back for an empty list of calls, which would keep the place in the queue forever.
+            future.set_result([])
+            return future
+        if not self._slots.acquire(blocking=False):
+            raise WorkerPoolBusy("The server is busy; try again later.")
+
+        def done(result):
+            self._slots.release()
+            future.set_result(result)
+
+        def failed(ex):
+            self._slots.release()
+            future.set_exception(ex)
+
+        try:
+            if many:
+                self._pool.starmap_async(func, args, chunksize=1, callback=done, error_callback=failed)
+            else:
+                self._pool.apply_async(func, args, callback=done, error_callback=failed)
+        except BaseException:
+            self._slots.release()
+            raise
+        return future
+
+    def close(self):
+        """ Stops accepting requests and waits for the workers to finish the ones they have. """
+        self._pool.close()
+        self._pool.join()
+
+
+def slice_to_bytes(filepath, exp_str):
+    return tostring(slicer.slice_score_path(filepath, exp_str).getroot())
+
+
+def slice_many_to_bytes(filepath, exp_strs):
+    return [result if isinstance(result, Exception) else tostring(result.getroot())
+            for result in slicer.slice_many(filepath, exp_strs)]
+
+
+def slice_frame(filepath, exp_str):
+    """ Returns the serialized selection without its parts, as a list of bytes and, in place of each selected part,
+    the arguments slice_part_to_bytes needs besides the expression and the score: a key identifying the part (the
+    score_cache_key of the score, followed by the position of the part), its tail, its starting staff and the
+    score_info of the score. """
+    key = score_cache_key(filepath)
+    score_index = load_score_index(filepath)
+    frame = []
+    for chunk in iterslice_frame(score_index, EmaExpFull(score_index, parse_ema_exp(exp_str))):
+        if isinstance(chunk, int):
+            part_index = score_index.parts[chunk]
+            chunk = (key + (chunk,), part_index.element.tail, part_index.starting_staff, score_index.score_info)
+        if frame and isinstance(chunk, bytes) and isinstance(frame[-1], bytes):
+            frame[-1] += chunk
+        else:
+            frame.append(chunk)
+    return frame
+
+
+class PartCache(object):
+    """ The parts parsed by slice_part_to_bytes in one worker process, keyed by the version of their score and their
+        position in it, so that a part sliced again is not parsed again. Like the score cache, it is bounded by an
+        estimate of the memory held by the parsed parts; its budget is that of the process's score cache.
+    """
+    def __init__(self):
+        self.current_bytes = 0
+        self._entries = OrderedDict()  # key -> (PartIndex, estimated size)
+
+    def get(self, key, filepath, tail, starting_staff):
+        """ Returns the index of a part, reading it from its score if it is not cached (see read_part).
+
+        :param key: The score_cache_key of the part's score, followed by the position of the part.
+        :type key: tuple
+        :param filepath: A filepath to the part's score.
+        :type filepath: str
+        :param tail: The whitespace after the part in the score, which reading the part alone drops.
+        :type tail: str
+        :param starting_staff: The lowest staff number of the part in its score.
+        :type starting_staff: int
+        :rtype: emaMXL.scoreindex.PartIndex
+        """
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+            return entry[0]
+        part, size = read_part(filepath, key[-1])
+        part.tail = tail
+        part_index = index_part(part)
+        part_index.starting_staff = starting_staff
+        size *= TREE_SIZE_FACTOR
+        self._entries[key] = (part_index, size)
+        self.current_bytes += size
+        # The most recently parsed part is always kept, even if it alone exceeds the budget.
+        while self.current_bytes > score_cache.max_bytes and len(self._entries) > 1:
+            _, (_, size) = self._entries.popitem(last=False)
+            self.current_bytes -= size
+        return part_index
+
+
+part_cache = PartCache()
+
+
+def slice_part_to_bytes(exp_str, filepath, key, tail, starting_staff, score_info):
+    """ Returns the serialized selection of one part of a score, given the facts about the part from slice_frame. """
+    part_index = part_cache.get(key, filepath, tail, starting_staff)
+    return b''.join(iterslice_part(part_index, EmaExpFull(score_info, parse_ema_exp(exp_str))))
+
+
+def slice_score_parallel(filepath, exp_str, workers=None):
+    """ Slices the parts of a score in parallel in a temporary pool of worker processes (see SlicePool.slice_parts).
+
+    :param filepath: A filepath to a MusicXML (.xml or .mxl) score.
+    :type filepath: str
+    :param exp_str: A string describing an EMA selection.
+    :type exp_str: str
+    :param workers: The number of worker processes; defaults to the number of CPUs.
+    :type workers: int
+    :return: The serialized selection, as ET.tostring(slice_score_path(filepath, exp_str).getroot()) would give.
+    :rtype: bytes
+    """
+    pool = SlicePool(workers, timeout=None, max_tasks_per_child=None)
+    try:
+        return pool.slice_parts(filepath, exp_str)
+    finally:
+        pool.close()
@@ -0,0 +1,126 @@
+import os
+import xml.etree.ElementTree as ET
+
+try:
+    from lxml import etree as lxml_etree
+except ImportError:  # lxml is optional; the standard library backend is always available.
+    lxml_etree = None
+
+# The backend used to parse scores, unless set_backend() is called.
+DEFAULT_BACKEND = os.environ.get("EMA_XML_BACKEND", "stdlib")
+
+
+class StdlibBackend(object):
+    """ Parses and serializes with xml.etree.ElementTree. """
+    name = 'stdlib'
+
+    def parse(self, source):
+        return ET.parse(source)
+
+    def iterparse(self, source, events):
+        return ET.iterparse(source, events=events)
+
+    def tostring(self, elem):
+        return ET.tostring(elem)
+
+    def element_tree(self, root):
+        return ET.ElementTree(root)
+
+
+class LxmlBackend(object):
+    """ Parses and serializes with lxml, which is several times faster on large scores.
+
+        The parser accepts documents beyond libxml2's default size limits, and drops comments and processing
+        instructions as ElementTree does. tostring() writes empty elements as ElementTree does ("<a />" rather than
+        "<a/>"), so that both backends produce the same bytes for the same selection.
+    """
+    name = 'lxml'
+
+    def __init__(self):
+        if lxml_etree is None:
+            raise ImportError("The lxml XML backend requires lxml (pip install lxml).")
+        self.parser = lxml_etree.XMLParser(huge_tree=True, remove_comments=True, remove_pis=True,
+                                           resolve_entities=False, no_network=True)
+
+    def parse(self, source):
+        return lxml_etree.parse(source, self.parser)
+
+    def iterparse(self, source, events):
+        return lxml_etree.iterparse(source, events=events, huge_tree=True, remove_comments=True, remove_pis=True,
+                                    resolve_entities=False, no_network=True)
+
+    def tostring(self, elem):
+        # '/>' only occurs at the end of an empty element: '>' is escaped in text and attribute values.
+        return lxml_etree.tostring(elem).replace(b'/>', b' />')
+
+    def element_tree(self, root):
+        return lxml_etree.ElementTree(root)
+
+
+BACKENDS = {'stdlib': StdlibBackend, 'lxml': LxmlBackend}
+instances = {}  # name -> backend, created on first use
+backend = None
+
+
+def set_backend(name):
+    """ Selects the backend used to parse scores from now on: 'stdlib' or 'lxml'. Trees that were already parsed
+    (e.g. in the score cache) keep working, as every other operation follows the type of the tree it is given.
+
+    :param name: The name of the backend.
+    :type name: str
+    :rtype: StdlibBackend | LxmlBackend
+    """
+    global backend
+    backend = get_instance(name)
+    return backend
+
+
+def get_instance(name):
+    if name not in instances:
+        if name not in BACKENDS:
+            raise ValueError(f"Unknown XML backend '{name}'; expected one of {', '.join(BACKENDS)}.")
+        instances[name] = BACKENDS[name]()
+    return instances[name]
+
+
+def get_backend():
+    if backend is None:
+        return set_backend(DEFAULT_BACKEND)
+    return backend
+
+
+def backend_of(elem):
+    """ Returns the backend that elem (an element or tree) belongs to. """
+    if lxml_etree is not None and isinstance(elem, (lxml_etree._Element, lxml_etree._ElementTree)):
+        return get_instance('lxml')
+    return get_instance('stdlib')
+
+
+def parse(source):
+    """ Parses a score with the current backend.
+
+    :param source: A filepath or binary file-like object.
+    :return: The parsed document.
+    :rtype: ET.ElementTree
+    """
+    return get_backend().parse(source)
+
+
+def iterparse(source, events):
+    """ Parses a score incrementally with the current backend, as ET.iterparse does.
+
+    :param source: A filepath or binary file-like object.
+    :param events: The events to report, e.g. ('start', 'end').
+    :return: An iterator of (event, element) pairs.
+    """
+    return get_backend().iterparse(source, events)
+
+
+def tostring(elem):
+    """ Serializes an element (and its tail) to bytes as ET.tostring does, whichever backend it was parsed with. """
+    return backend_of(elem).tostring(elem)
+
+
+def element_tree(root):
+    """ Wraps a root element in a tree of the same backend. """
+    return backend_of(root).element_tree(root)
@@ -0,0 +1,194 @@
+""" Benchmarks the slicer on synthetic scores.
+
+Usage (from the repository root or tst/):
+    python tst/benchmark.py --out results.json
+    python tst/benchmark.py --quick --out new.json --compare results.json
+    python tst/benchmark.py --quick --backend lxml --compare results.json
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+# To access emaMXL module from inside tst folder
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from emaMXL import slicer, xmlbackend
+from emaMXL.cache import score_cache
+from emaMXL.emaexp import EmaExp
+from emaMXL.emaexpfull import expand_ema_exp
+from emaMXL.scoreindex import ScoreIndex
+from emaMXL.streaming import slice_score_stream
+from synthetic import write_score
+
+# name -> generate_score arguments
+SCORES = {
+    'small': dict(parts=2, staves=[1, 2], measures=32, density=2, tuplets=0.1, attribute_every=8),
+    'medium': dict(parts=4, staves=[1, 1, 2, 2], measures=400, density=2, tuplets=0.1, attribute_every=16),
+    'dense': dict(parts=2, staves=2, measures=400, density=4, tuplets=0.2, attribute_every=16),
+    'large': dict(parts=8, staves=[1, 1, 1, 1, 2, 2, 2, 2], measures=2000, density=2, tuplets=0.1,
+                  attribute_every=32),
+}
+QUICK_SCORES = ['small', 'medium']
+
+
+def expression_shapes(measures, staves):
+    """ The expressions benchmarked on a score with the given number of measures and staves, by shape name. """
+    quarter, half = max(measures // 4, 1), max(measures // 2, 1)
+    scattered = ",".join(str(m) for m in range(1, measures + 1, max(measures // 20, 1)))
+    return {
+        'all': "all/all/@all",
+        'window': f"{quarter}-{half}/1-{min(2, staves)}/@1-2",
+        'window_cut': f"{quarter}-{half}/all/@1.5-2.5/cut",
+        'scattered': f"{scattered}/all/@all",
+        'per_staff': f"2,{half}/1+{staves},1/@1+@2-end,@all",
+        'tail': "start-end/1/@3-end/cut",
+    }
+
+
+def measure(func, repeat, min_time=0.0):
+    """ Calls func repeat times (more if they take less than min_time in total) and returns the wall times. """
+    times = []
+    started = time.perf_counter()
+    while len(times) < repeat or time.perf_counter() - started < min_time:
+        t = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - t)
+    return times
+
+
+def peak_memory(func):
+    """ Returns the peak memory allocated by Python objects during one call of func, in bytes. """
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def result(benchmark, score, shape, exp_str, times, units=None, unit_name=None, memory=None):
+    entry = {
+        'benchmark': benchmark, 'score': score, 'shape': shape, 'expression': exp_str,
+        'runs': len(times), 'min_s': min(times), 'mean_s': sum(times) / len(times),
+        'ops_per_s': len(times) / sum(times) if sum(times) else None,
+    }
+    if units is not None:
+        entry[f'{unit_name}_per_s'] = units / min(times) if min(times) else None
+    if memory is not None:
+        entry['peak_bytes'] = memory
+    return entry
+
+
+def bench_score(name, path, repeat, with_memory):
+    """ Runs every benchmark on one score; yields a result dict per (benchmark, expression). """
+    score_index = ScoreIndex.from_path(path)
+    info = score_index.score_info
+    size = os.path.getsize(path)
+    for shape, exp_str in expression_shapes(info['measure']['end'], info['staff']['end']).items():
+        ema_exp = EmaExp(exp_str)
+        times = measure(lambda: EmaExp(exp_str), repeat * 10, min_time=0.05)
+        yield result('parse_expression', name, shape, exp_str, times)
+
+        times = measure(lambda: expand_ema_exp(info, ema_exp), repeat * 10, min_time=0.05)
+        memory = peak_memory(lambda: expand_ema_exp(info, ema_exp)) if with_memory else None
+        yield result('expand', name, shape, exp_str, times, memory=memory)
+
+        # Cold: parse, index and slice in place, as without the score cache.
+        cold = lambda: slicer.slice_score_path(path, exp_str, use_cache=False)
+        times = measure(cold, repeat)
+        yield result('slice_cold', name, shape, exp_str, times, size, 'bytes',
+                     peak_memory(cold) if with_memory else None)
+
+        # Warm: the parsed score comes from the cache and the selection is built as a new tree.
+        warm = lambda: slicer.slice_score_path(path, exp_str)
+        warm()
+        times = measure(warm, repeat)
+        yield result('slice_warm', name, shape, exp_str, times, size, 'bytes',
+                     peak_memory(warm) if with_memory else None)
+
+        root = warm().getroot()
+        times = measure(lambda: xmlbackend.tostring(root), repeat)
+        yield result('serialize', name, shape, exp_str, times, size, 'bytes')
+
+        stream = lambda: slice_score_stream(path, exp_str, io.BytesIO(), score_index=score_index)
+        times = measure(stream, repeat)
+        yield result('slice_stream', name, shape, exp_str, times, size, 'bytes',
+                     peak_memory(stream) if with_memory else None)
+    score_cache.clear()
+
+
+def run(score_names, repeat, with_memory, workdir):
+    results = []
+    for name in score_names:
+        path = os.path.join(workdir, f"{name}.xml")
+        if not os.path.exists(path):
+            write_score(path, **SCORES[name])
+        for entry in bench_score(name, path, repeat, with_memory):
+            print(f"{entry['benchmark']:>16} {name:>8} {entry['shape']:>10}  {entry['min_s'] * 1000:10.3f} ms",
+                  file=sys.stderr)
+            results.append(entry)
+    return results
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(old_results, new_results):
+    """ Prints the change in best time of every benchmark present in both runs. """
+    old = {(r['benchmark'], r['score'], r['shape']): r for r in old_results}
+    for r in new_results:
+        key = (r['benchmark'], r['score'], r['shape'])
+        if key in old and old[key]['min_s']:
+            ratio = r['min_s'] / old[key]['min_s']
+            print(f"{r['benchmark']:>16} {r['score']:>8} {r['shape']:>10}  "
+                  f"{old[key]['min_s'] * 1000:10.3f} -> {r['min_s'] * 1000:10.3f} ms  x{ratio:.2f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the EMA slicer on synthetic MusicXML scores.")
+    parser.add_argument('--scores', nargs='+', choices=sorted(SCORES), default=None,
+                        help="Scores to benchmark (default: all, or small and medium with --quick).")
+    parser.add_argument('--quick', action='store_true', help="Fewer runs on the smaller scores only.")
+    parser.add_argument('--repeat', type=int, default=None, help="Runs of each slicing benchmark.")
+    parser.add_argument('--no-memory', action='store_true', help="Skip the tracemalloc peak memory runs.")
+    parser.add_argument('--workdir', default=None, help="Where generated scores are kept (default: a temp dir).")
+    parser.add_argument('--out', default=None, help="Write the results to this JSON file.")
+    parser.add_argument('--compare', default=None, help="A JSON file from an earlier run to compare against.")
+    parser.add_argument('--backend', choices=sorted(xmlbackend.BACKENDS), default=None,
+                        help="The XML backend scores are parsed with (default: EMA_XML_BACKEND, or stdlib).")
+    args = parser.parse_args(argv)
+
+    score_names = args.scores or (QUICK_SCORES if args.quick else list(SCORES))
+    repeat = args.repeat or (3 if args.quick else 5)
+    workdir = args.workdir or tempfile.mkdtemp(prefix='ema-bench-')
+    os.makedirs(workdir, exist_ok=True)
+    backend = xmlbackend.set_backend(args.backend) if args.backend else xmlbackend.get_backend()
+
+    report = {
+        'meta': {'revision': git_revision(), 'python': platform.python_version(), 'platform': platform.platform(),
+                 'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'repeat': repeat, 'backend': backend.name,
+                 'scores': {name: SCORES[name] for name in score_names}},
+        'results': run(score_names, repeat, not args.no_memory, workdir),
+    }
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f)['results'], report['results'])
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
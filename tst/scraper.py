@@ -1,8 +1,14 @@
+import argparse
+import hashlib
+import json
 import os.path
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 import requests
+from requests.adapters import HTTPAdapter
 from tqdm import tqdm
 from bs4 import BeautifulSoup
-from pyld import jsonld
 from urllib.parse import unquote
 
 from io import StringIO
@@ -14,6 +20,9 @@ from music21 import converter, environment
 W3C_HAS_SRC = "http://www.w3.org/ns/oa#hasSource"
 NANOPUB_URL = "http://digitalduchemin.org:8080/nanopub-server"
 LAST_PAGE = 11
+DATA_DIR = "data"
+MANIFEST_NAME = "manifest.jsonl"
+CHUNK_SIZE = 64 * 1024
 
 # To access emaMXL module from inside tst folder
 sys.path.append(os.path.abspath(os.path.join('..', 'emaMXL')))
@@ -37,68 +46,239 @@ class Capturing(list):
 #
 # Scraping functions
 #
-def scrape_page_nanopubs(page_num, d={}, fails={}):
+class Manifest(object):
+    """ An append-only log of finished and failed items (nanopubs and scores), so that an interrupted scrape resumes
+        where it stopped. Each line is a JSON object with the item's key and status; the last line for a key wins,
+        and a line cut short by a crash is ignored.
     """
-    Scrapes all nanopubs from the page.
-    Saves score xml + selection xml to disk.
-    Returns dict[nanopub_num] = (score_name, ema_expression) for reference.
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        self._lock = threading.Lock()
+        if not os.path.exists(path):
+            return
+        with open(path) as f:
+            data = f.read()
+        for line in data.splitlines():
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            self.entries[entry['key']] = entry
+        if data and not data.endswith('\n'):
+            # Start the next record on a line of its own, after the partial one.
+            with open(path, 'a') as f:
+                f.write('\n')
+
+    def get(self, key):
+        return self.entries.get(key)
+
+    def is_done(self, key):
+        entry = self.entries.get(key)
+        return entry is not None and entry['status'] == 'done'
+
+    def record(self, key, status, **fields):
+        entry = dict(key=key, status=status, **fields)
+        with self._lock:
+            self.entries[key] = entry
+            with open(self.path, 'a') as f:
+                f.write(json.dumps(entry) + '\n')
+        return entry
+
+    def failures(self):
+        return {key: entry for key, entry in self.entries.items() if entry['status'] == 'failed'}
+
+
+class Scraper(object):
+    """ Downloads the nanopublications of the Digital Du Chemin library and converts their MEI scores and selections
+        to MusicXML, into data_dir/scores and data_dir/selections.
+
+        JSON-LD documents and MEI files are fetched by `jobs` threads sharing one pooled session, and the music21
+        conversions, which are CPU-bound, run in `convert_workers` processes. A score shared by several nanopubs is
+        downloaded and converted once. Every finished or failed nanopub and score is recorded in the manifest, so an
+        interrupted scrape can be resumed; failed nanopubs are only retried when asked.
     """
-    jsonlds = get_jsonlds(page_num)
-    for i in tqdm(range(len(jsonlds))):
-        nanopub_num = 1000*(page_num - 1) + i
+    def __init__(self, base_url=NANOPUB_URL, data_dir=DATA_DIR, jobs=16, convert_workers=None, timeout=60,
+                 convert=None):
+        """
+        :param base_url: The nanopub server.
+        :type base_url: str
+        :param data_dir: The directory scores, selections, downloaded MEI files and the manifest are kept in.
+        :type data_dir: str
+        :param jobs: The number of nanopubs processed at once, and of connections kept open.
+        :type jobs: int
+        :param convert_workers: The number of conversion processes; defaults to the number of CPUs.
+        :type convert_workers: int
+        :param timeout: Seconds to wait for the server before giving up on a request.
+        :type timeout: float
+        :param convert: A picklable function(mei_path, xml_path) converting MEI to MusicXML; defaults to convert_mei.
+        """
+        self.base_url = base_url
+        self.data_dir = data_dir
+        self.jobs = jobs
+        self.timeout = timeout
+        self.convert = convert or convert_mei
+        self.session = pooled_session(jobs)
+        for subdir in ('scores', 'selections', 'mei'):
+            os.makedirs(os.path.join(data_dir, subdir), exist_ok=True)
+        self.manifest = Manifest(os.path.join(data_dir, MANIFEST_NAME))
+        self._converter = ProcessPoolExecutor(convert_workers)
+        self._lock = threading.Lock()
+        self._scores = {}  # score name -> Future of its MusicXML path, for the scores handled during this run
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self._converter.shutdown()
+        self.session.close()
+
+    def scrape_pages(self, page_nums, retry_failed=False):
+        """ Scrapes every nanopub on the given pages. Returns dict[nanopub_num] = manifest entry. """
+        items = []
+        for page_num in page_nums:
+            jsonlds = get_jsonlds(page_num, self.session, self.base_url)
+            items.extend((nanopub_number(page_num, i), jsonld_filename) for i, jsonld_filename in enumerate(jsonlds))
+        return self.scrape(items, retry_failed)
+
+    def scrape(self, items, retry_failed=False):
+        """ Scrapes (nanopub_num, jsonld_filename) items concurrently, skipping those the manifest has as finished
+        (and as failed, unless retry_failed). Returns dict[nanopub_num] = manifest entry. """
+        todo = []
+        for nanopub_num, jsonld_filename in items:
+            entry = self.manifest.get(nanopub_key(nanopub_num))
+            if entry is None or (entry['status'] == 'failed' and retry_failed):
+                todo.append((nanopub_num, jsonld_filename))
+        with ThreadPoolExecutor(self.jobs) as executor:
+            futures = [executor.submit(self.scrape_nanopub, *item) for item in todo]
+            for _ in tqdm(as_completed(futures), total=len(futures)):
+                pass
+        return {nanopub_num: self.manifest.get(nanopub_key(nanopub_num)) for nanopub_num, _ in items}
+
+    def scrape_nanopub(self, nanopub_num, jsonld_filename):
+        """ Saves the score and selection of one nanopub as MusicXML and records the outcome in the manifest. """
+        try:
+            ema_url = ema_url_from_jsonld(jsonld_filename, self.session, self.base_url)
+            if ema_url is None:
+                raise ValueError(f"{jsonld_filename} has no EMA selection.")
+            mei_url, expr_str, score_name = parse_ema_url(ema_url)
+            self.ensure_score(score_name, mei_url)
+            # The EMA URL itself serves the selection as MEI.
+            mei_path = self.download(ema_url, os.path.join(self.data_dir, 'mei', f"nanopub_{nanopub_num}.mei"))
+            self._converter.submit(self.convert, mei_path, selection_path(nanopub_num, self.data_dir)).result()
+        except Exception as ex:
+            return self.manifest.record(nanopub_key(nanopub_num), 'failed', error=f"{type(ex).__name__}: {ex}")
+        return self.manifest.record(nanopub_key(nanopub_num), 'done', score=score_name, expression=expr_str)
+
+    def ensure_score(self, score_name, mei_url):
+        """ Downloads and converts a score unless that has already been done. Concurrent requests for the same score
+        wait for a single download, and a score that fails is not tried again during the same run. """
+        path = score_path(score_name, self.data_dir)
+        if self.manifest.is_done(score_key(score_name)):
+            return path
+        with self._lock:
+            future = self._scores.get(score_name)
+            leader = future is None
+            if leader:
+                future = self._scores[score_name] = Future()
+        if not leader:
+            return future.result()
         try:
-            with Capturing() as output:
-                score_name, expr_str = scrape_nanopub(nanopub_num, jsonlds[i])
-                d[nanopub_num] = (score_name, expr_str)
+            mei_path = self.download(mei_url, os.path.join(self.data_dir, 'mei', f"{score_name}.mei"))
+            self._converter.submit(self.convert, mei_path, path).result()
         except Exception as ex:
-            fails[nanopub_num] = ex
+            self.manifest.record(score_key(score_name), 'failed', url=mei_url, error=f"{type(ex).__name__}: {ex}")
+            future.set_exception(ex)
+            raise
+        self.manifest.record(score_key(score_name), 'done', url=mei_url)
+        future.set_result(path)
+        return path
+
+    def download(self, url, path):
+        """ Saves the response body of url to path, replacing any earlier download only once it is complete. """
+        with self.session.get(url, timeout=self.timeout, stream=True) as response:
+            response.raise_for_status()
+            tmp_path = path + '.part'
+            with open(tmp_path, 'wb') as f:
+                for chunk in response.iter_content(CHUNK_SIZE):
+                    f.write(chunk)
+        os.replace(tmp_path, path)
+        return path
+
+
+def convert_mei(mei_path, xml_path):
+    """ Converts an MEI file to MusicXML with music21. Runs in the conversion processes of a Scraper.
+    Will warn "mei.base: WARNING: Importing <slur> without @startid and @endid is not yet supported."
+    """
+    tmp_path = xml_path + '.part'
+    with Capturing():
+        score = converter.parse(mei_path, format='mei')
+        score.write("musicxml", fp=tmp_path)
+    os.replace(tmp_path, xml_path)
+    return xml_path
 
-    return d, fails
 
+def pooled_session(pool_size):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
 
-def scrape_nanopub(nanopub_num, jsonld_filename):
-    ema_url = ema_url_from_jsonld(jsonld_filename)
+
+def parse_ema_url(ema_url):
+    """ Splits an EMA request URL into the URL of the MEI score, the EMA expression and the score's name. """
     mei_url = unquote(ema_url.split("/")[-4])
     expr_str = "/".join(ema_url.split("/")[-3:])
     score_name = mei_url.split("/")[-1].split(".")[0]
-    #
-    # Will warn "mei.base: WARNING: Importing <slur> without @startid and @endid is not yet supported."
-    #
-    # Downloads the MEI score, converts to XML, saves as a file. Use etree to load from file.
-    score_path = f"data/scores/{score_name}.xml"
-    if not os.path.exists(score_path):
-        score = converter.parseURL(mei_url, format='mei')
-        score.write("musicxml", fp=score_path)
+    return mei_url, expr_str, score_name
 
-    # Downloads the MEI selection, converts to XML, saves as a file, and stores etree in the dict.
-    selection_path = f"data/selections/nanopub_{nanopub_num}.xml"
-    if not os.path.exists(selection_path):
-        selection_score = converter.parseURL(ema_url, format='mei')
-        selection_score.write("musicxml", fp=selection_path)
 
-    return score_name, expr_str
+def nanopub_number(page_num, i):
+    return 1000*(page_num - 1) + i
+
+
+def nanopub_key(nanopub_num):
+    return f"nanopub/{nanopub_num}"
+
+
+def score_key(score_name):
+    return f"score/{score_name}"
+
+
+def score_path(score_name, data_dir=DATA_DIR):
+    return os.path.join(data_dir, "scores", f"{score_name}.xml")
+
+
+def selection_path(nanopub_num, data_dir=DATA_DIR):
+    return os.path.join(data_dir, "selections", f"nanopub_{nanopub_num}.xml")
 
 
 #
 # Evaluation functions
 #
-def evaluate_ema2_page(page_num):
-    jsonlds = get_jsonlds(page_num)
-    for i in range(len(jsonlds)):
-        nanopub_num = 1000 * (page_num - 1) + i
-        ema_url = ema_url_from_jsonld(jsonlds[i])
-        mei_url = unquote(ema_url.split("/")[-4])
-        expr_str = "/".join(ema_url.split("/")[-3:])
-        score_name = mei_url.split("/")[-1].split(".")[0]
+# Nanopubs whose expected selection is wrong; their mismatches are reported as 'known-bad' rather than 'fail'.
+KNOWN_BAD = {num: "Selection on digital du chemin is incorrect (usually minor errors)."
+             for num in (22, 31, 35, 63, 67, 70, 74, 106)}
+KNOWN_BAD.update({num: "Bad music21 conversion / malformed score." for num in (40, 85)})
+STATUSES = ('pass', 'fail', 'known-bad', 'error')
 
-        try:
-            evaluate_ema2(score_name, expr_str, f"nanopub_{nanopub_num}")
-        except Exception as ex:
-            print(f"Exception for nanopub_{nanopub_num}: {ex}")
+
+def evaluate_ema2_page(page_num, workers=None):
+    """ Evaluates the scraped nanopubs of a page and prints those that do not pass. """
+    cases = [case for case in cases_from_manifest() if 1 + case['nanopub'] // 1000 == page_num]
+    results = evaluate_cases(cases, workers)
+    for result in results:
+        if result['status'] != 'pass':
+            print(f"nanopub_{result['nanopub']}: {result['status']} {result.get('first_difference') or ''} "
+                  f"{result.get('detail') or result.get('error') or ''}")
+    return results
 
 
 def evaluate_ema2(score_name, expr_str, truth_filename, print_fail_elem=False):
-    # TODO: Maybe try downloading if we can't find it
     score_path = f"data/scores/{score_name}.xml"
     selection_path = f"data/selections/{truth_filename}.xml"
     if not os.path.exists(score_path):
@@ -111,7 +291,13 @@ def evaluate_ema2(score_name, expr_str, truth_filename, print_fail_elem=False):
     print(f"Evaluating {truth_filename}")
     ema2_tree = slicer.slice_score_path(score_path, expr_str)
     omas_tree = ET.parse(selection_path)
-    diff_test(ema2_tree.getroot(), omas_tree.getroot(), print_fail_elem)
+    difference = compare_trees(ema2_tree.getroot(), omas_tree.getroot())
+    if difference is not None:
+        path, elem1, elem2 = difference
+        print(f"Mismatch at {path}: {describe_mismatch(elem1, elem2)}")
+        if print_fail_elem:
+            print_elems_recursive(elem1)
+            print_elems_recursive(elem2)
     # For debugging
     ema2_tree.write("data/selection_temp.xml")
     return ema2_tree, omas_tree
@@ -123,49 +309,158 @@ def evaluate_ema2_by_num(nanopub_num, print_fail_elem=False):
     """ Evaluates a single nanopub. """
     page_num = 1 + nanopub_num // 1000
     jsonlds = get_jsonlds(page_num)
-    score_name, expr_str = scrape_nanopub(nanopub_num, jsonlds[nanopub_num % 1000])
+    with Scraper(jobs=1, convert_workers=1) as scraper:
+        entry = scraper.scrape([(nanopub_num, jsonlds[nanopub_num % 1000])], retry_failed=True)[nanopub_num]
+    if entry['status'] != 'done':
+        print(f"Could not scrape nanopub_{nanopub_num}: {entry['error']}")
+        return
+    score_name, expr_str = entry['score'], entry['expression']
     return evaluate_ema2(score_name, expr_str, f"nanopub_{nanopub_num}", print_fail_elem)
-# List of failing nanopubs (but are okay to ignore)
-# Selection on digital du chemin is incorrect (usually minor errors):
-# 22, 31, 35, 63, 67, 70, 74, 106
-# bad music21 conversion / malformed score:
-# 40, 85
-
-
-def diff_test(elem1: ET.Element, elem2: ET.Element, print_fail_elem):
-    """ A simple recursive function that checks if the structure and tags of these two trees are generally the same. """
-    if len(elem1) == len(elem2) and elem1.tag == elem2.tag:
-        # print(f"Matched {root1.tag}: {len(root1)} children.")
-        # TODO: Is it wise to sort? The nanopubs might have elements out of order
-        #  (or maybe music21 conversion jumbled them up)
-        # Leaving staves unsorted (by id) seems okay
-        elem1 = sorted(list(elem1), key=lambda x: (x.tag, x.get('id', None) if x.tag != 'part' else None))
-        elem2 = sorted(list(elem2), key=lambda x: (x.tag, x.get('id', None) if x.tag != 'part' else None))
-        for i in range(len(elem1)):
-            diff_test(elem1[i], elem2[i], print_fail_elem)
+
+
+def cases_from_manifest(data_dir=DATA_DIR, nanopub_nums=None):
+    """ Returns an evaluation case for every nanopub the manifest has as scraped, ordered by score. """
+    manifest = Manifest(os.path.join(data_dir, MANIFEST_NAME))
+    cases = []
+    for key, entry in manifest.entries.items():
+        if not key.startswith("nanopub/") or entry['status'] != 'done':
+            continue
+        nanopub_num = int(key[len("nanopub/"):])
+        if nanopub_nums is not None and nanopub_num not in nanopub_nums:
+            continue
+        cases.append({'nanopub': nanopub_num, 'score': entry['score'], 'expression': entry['expression'],
+                      'score_path': score_path(entry['score'], data_dir),
+                      'selection_path': selection_path(nanopub_num, data_dir)})
+    return sorted(cases, key=lambda case: (case['score'], case['nanopub']))
+
+
+def evaluate_cases(cases, workers=None, chunksize=8):
+    """ Evaluates cases in a pool of processes. Returns their report entries in the order of cases.
+    Cases of the same score should be adjacent (see cases_from_manifest), so that each worker parses a score once. """
+    with ProcessPoolExecutor(workers) as executor:
+        return list(tqdm(executor.map(evaluate_case, cases, chunksize=chunksize), total=len(cases)))
+
+
+def evaluate_case(case):
+    """ Slices a case's score and compares the result with the expected selection.
+
+    :param case: A dict with the nanopub number, expression, score_path and selection_path (the expected selection).
+    :type case: dict
+    :return: The case's report entry: the case, its status (one of STATUSES), timings in seconds and, if the
+             trees differ, the path of the first differing element in the emaMXL selection.
+    :rtype: dict
+    """
+    result = dict(case, status='error', first_difference=None, seconds={})
+    start = time.perf_counter()
+    try:
+        ema2_root = slicer.slice_score_path(case['score_path'], case['expression']).getroot()
+        sliced = time.perf_counter()
+        expected_root = ET.parse(case['selection_path']).getroot()
+        parsed = time.perf_counter()
+        difference = compare_trees(ema2_root, expected_root)
+        compared = time.perf_counter()
+    except Exception as ex:
+        result['error'] = f"{type(ex).__name__}: {ex}"
+        result['seconds'] = {'total': time.perf_counter() - start}
+        return result
+    result['seconds'] = {'slice': sliced - start, 'parse_expected': parsed - sliced, 'compare': compared - parsed,
+                         'total': compared - start}
+    if difference is None:
+        result['status'] = 'pass'
+        return result
+    path, elem1, elem2 = difference
+    result['first_difference'] = path
+    result['detail'] = describe_mismatch(elem1, elem2)
+    if case['nanopub'] in KNOWN_BAD:
+        result['status'] = 'known-bad'
+        result['reason'] = KNOWN_BAD[case['nanopub']]
     else:
-        print(f"Mismatch at {elem1.tag}, {elem1.attrib}: {len(elem1)} children vs. {elem2.tag}, {elem2.attrib}: {len(elem2)} children.")
-        if print_fail_elem:
-            print_elems_recursive(elem1)
-            print_elems_recursive(elem2)
+        result['status'] = 'fail'
+    return result
+
+
+def evaluation_report(results, seconds=None):
+    """ Wraps report entries with a count of each status. """
+    counts = {status: 0 for status in STATUSES}
+    for result in results:
+        counts[result['status']] += 1
+    return {'meta': {'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'seconds': seconds},
+            'summary': counts, 'cases': results}
+
+
+def compare_trees(root1, root2):
+    """ Checks that the structure and tags of two trees are generally the same, as the old recursive diff did:
+    children are matched by tag and id (except for parts), and text and attributes are ignored.
+    Every subtree is hashed once, and only subtrees whose hashes differ are descended into.
+
+    :return: None if the trees match, otherwise (path, elem1, elem2) for the first elements that differ, where path
+             locates elem1 in root1, e.g. "/score-partwise/part[1]/measure[3]".
+    """
+    return first_difference(root1, root2, structure_hashes(root1), structure_hashes(root2), f"/{root1.tag}")
+
+
+def structure_hashes(root):
+    """ Returns dict[element] = digest of the element's tag and its children's digests, in match_order. """
+    hashes = {}
+
+    def visit(elem):
+        digest = hashlib.blake2b(elem.tag.encode('utf-8') + b'\0', digest_size=16)
+        for child in match_order(elem):
+            digest.update(visit(child))
+        hashes[elem] = digest.digest()
+        return hashes[elem]
+
+    visit(root)
+    return hashes
+
+
+def first_difference(elem1, elem2, hashes1, hashes2, path):
+    if hashes1[elem1] == hashes2[elem2]:
+        return None
+    if elem1.tag != elem2.tag or len(elem1) != len(elem2):
+        return path, elem1, elem2
+    positions = {}
+    counts = {}
+    for child in elem1:
+        counts[child.tag] = counts.get(child.tag, 0) + 1
+        positions[child] = counts[child.tag]
+    for child1, child2 in zip(match_order(elem1), match_order(elem2)):
+        difference = first_difference(child1, child2, hashes1, hashes2, f"{path}/{child1.tag}[{positions[child1]}]")
+        if difference is not None:
+            return difference
+    return path, elem1, elem2
+
+
+def match_order(elem):
+    """ The children of elem in the order they are matched: by tag and id, then document order.
+    Parts are not sorted by id; their ids may differ between the two trees. """
+    # TODO: Is it wise to sort? The nanopubs might have elements out of order
+    #  (or maybe music21 conversion jumbled them up)
+    return sorted(elem, key=lambda x: (x.tag, (x.get('id') or '') if x.tag != 'part' else ''))
+
+
+def describe_mismatch(elem1, elem2):
+    return f"{elem1.tag}, {elem1.attrib}: {len(elem1)} children vs. {elem2.tag}, {elem2.attrib}: {len(elem2)} children."
 
 
 #
 # Utility functions for tst and scraper
 #
-def get_jsonlds(page_num):
+def get_jsonlds(page_num, session=requests, base_url=NANOPUB_URL):
     """ Fetches a list of .jsonld file URLs on the specified page. """
-    r = requests.get(f"{NANOPUB_URL}/nanopubs.html?page={page_num}")
+    r = session.get(f"{base_url}/nanopubs.html?page={page_num}")
+    r.raise_for_status()
     soup = BeautifulSoup(r.text, 'html.parser')
     results = soup.findAll("a", text="jsonld", attrs={"type": "application/ld+json"})
     file_names = [x.attrs["href"] for x in results]
     return file_names
 
 
-def ema_url_from_jsonld(jsonld_filename):
+def ema_url_from_jsonld(jsonld_filename, session=requests, base_url=NANOPUB_URL):
     """ Takes a .jsonld filename and extracts the full EMA request URL. """
-    nanopub = jsonld.load_document(f"{NANOPUB_URL}/{jsonld_filename}")
-    for graph in nanopub["document"]:
+    r = session.get(f"{base_url}/{jsonld_filename}")
+    r.raise_for_status()
+    for graph in r.json():
         for item in graph["@graph"]:
             if W3C_HAS_SRC in item:
                 return item[W3C_HAS_SRC][0]['@id']
@@ -188,20 +483,54 @@ def print_elems_recursive(elem, i=0):
         print_elems_recursive(child, i+4)
 
 
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Download the Digital Du Chemin nanopublications and convert their "
+                                                 "scores and selections to MusicXML (scrape), or compare emaMXL's "
+                                                 "selections with the scraped ones (evaluate).")
+    parser.add_argument('command', choices=['scrape', 'evaluate'])
+    parser.add_argument('--pages', type=int, nargs='+', default=None, help=f"Pages to scrape (default: 1-{LAST_PAGE}).")
+    parser.add_argument('--jobs', type=int, default=16, help="Nanopubs downloaded at once.")
+    parser.add_argument('--convert-workers', type=int, default=None,
+                        help="Processes running the music21 conversions (default: the number of CPUs).")
+    parser.add_argument('--retry-failed', action='store_true', help="Try the nanopubs that failed before again.")
+    parser.add_argument('--base-url', default=NANOPUB_URL, help="The nanopub server.")
+    parser.add_argument('--data-dir', default=DATA_DIR, help="Where scores, selections and the manifest are kept.")
+    parser.add_argument('--nanopubs', type=int, nargs='+', default=None, help="Nanopubs to evaluate (default: all).")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="Processes evaluating nanopubs (default: the number of CPUs).")
+    parser.add_argument('--out', default=None, help="Where the evaluation report is written (JSON).")
+    args = parser.parse_args(argv)
+
+    if args.command == 'evaluate':
+        return evaluate(args)
+    pages = args.pages or range(1, LAST_PAGE + 1)
+    with Scraper(args.base_url, args.data_dir, args.jobs, args.convert_workers) as scraper:
+        results = scraper.scrape_pages(pages, args.retry_failed)
+    failed = {num: entry for num, entry in results.items() if entry['status'] != 'done'}
+    print(f"{len(results) - len(failed)} of {len(results)} nanopubs scraped.")
+    for num, entry in sorted(failed.items()):
+        print(f"nanopub_{num}: {entry['error']}")
+    return 0
+
+
+def evaluate(args):
+    cases = cases_from_manifest(args.data_dir, set(args.nanopubs) if args.nanopubs else None)
+    start = time.perf_counter()
+    results = evaluate_cases(cases, args.workers)
+    report = evaluation_report(sorted(results, key=lambda result: result['nanopub']), time.perf_counter() - start)
+    with open(args.out or os.path.join(args.data_dir, "evaluation.json"), 'w') as f:
+        json.dump(report, f, indent=2)
+    print(", ".join(f"{count} {status}" for status, count in report['summary'].items()))
+    for result in report['cases']:
+        if result['status'] in ('fail', 'error'):
+            print(f"nanopub_{result['nanopub']}: {result['status']} {result['first_difference'] or ''} "
+                  f"{result.get('detail') or result.get('error')}")
+    return 1 if report['summary']['fail'] or report['summary']['error'] else 0
+
+
 environment.set('autoDownload', 'allow')
 
-if __name__ == '__main__' and len(sys.argv) == 2 and sys.argv[1] == "scrape":
-    print(os.getcwd())
-    if os.path.basename(os.getcwd()) == 'emaMXL':
-        os.chdir('tst')
-
-    if os.path.basename(os.getcwd()) != 'tst':
-        print("\"scraper.py scrape\" should be run from within the emaMXL root folder or emaMXL/tst.")
-        exit()
-
-    if not os.path.exists("data"):
-        os.mkdir('data')
-        os.mkdir('data/selections')
-        os.mkdir('data/scores')
-    for p in range(1, LAST_PAGE+1):
-        scrape_page_nanopubs(p)
+if __name__ == '__main__':
+    # Relative paths (data/scores, data/selections) are relative to tst/.
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    sys.exit(main())
@@ -0,0 +1,146 @@
+import random
+import xml.etree.ElementTree as ET
+
+DOCTYPE = '<!DOCTYPE score-partwise PUBLIC "-//Recordare//DTD MusicXML 3.1 Partwise//EN" ' \
+          '"http://www.musicxml.org/dtds/partwise.dtd">\n'
+# Divisions per quarter note; divisible by 3 * 4 so that sixteenth-note triplets have whole durations.
+DIVISIONS = 12
+NOTE_TYPES = {8.0: 'breve', 4.0: 'whole', 2.0: 'half', 1.0: 'quarter', 0.5: 'eighth', 0.25: '16th', 0.125: '32nd'}
+TIME_SIGNATURES = [(4, 4), (3, 4), (6, 8), (2, 2), (5, 4)]
+STEPS = 'CDEFGAB'
+
+
+def generate_score(parts=2, staves=1, measures=16, density=2, tuplets=0.1, attribute_every=0, seed=0):
+    """ Generates a deterministic, well-formed MusicXML score for testing and benchmarking the slicer.
+
+    :param parts: The number of parts.
+    :type parts: int
+    :param staves: The number of staves per part, or a list with the number of staves of each part.
+    :type staves: int | List[int]
+    :param measures: The number of measures in every part.
+    :type measures: int
+    :param density: Notes per quarter note (1, 2 or 4); a few longer notes and rests are mixed in.
+    :type density: int
+    :param tuplets: The probability of a beat being filled with a triplet instead.
+    :type tuplets: float
+    :param attribute_every: Change the time signature (and every other time, the divisions and key) every this many
+                            measures. 0 keeps the attributes of the first measure throughout.
+    :type attribute_every: int
+    :param seed: Seed of the random choices; the same arguments always give the same score.
+    :type seed: int
+    :rtype: ET.ElementTree
+    """
+    rng = random.Random(seed)
+    if isinstance(staves, int):
+        staves = [staves] * parts
+    root = ET.Element('score-partwise', version='3.1')
+    ET.SubElement(ET.SubElement(root, 'work'), 'work-title').text = f"Synthetic score {seed}"
+    part_list = ET.SubElement(root, 'part-list')
+    for p in range(parts):
+        score_part = ET.SubElement(part_list, 'score-part', id=f"P{p + 1}")
+        ET.SubElement(score_part, 'part-name').text = f"Part {p + 1}"
+
+    for p in range(parts):
+        part = ET.SubElement(root, 'part', id=f"P{p + 1}")
+        divisions = DIVISIONS
+        for m in range(1, measures + 1):
+            measure = ET.SubElement(part, 'measure', number=str(m))
+            if m == 1:
+                append_attributes(measure, divisions, TIME_SIGNATURES[0], fifths=0, staves=staves[p])
+                time = TIME_SIGNATURES[0]
+            elif attribute_every and (m - 1) % attribute_every == 0:
+                # Every change sets a new time signature; every other change also sets the divisions and key.
+                change = (m - 1) // attribute_every
+                time = TIME_SIGNATURES[change % len(TIME_SIGNATURES)]
+                if change % 2 == 0:
+                    divisions = DIVISIONS * (1 + change // 2 % 2)
+                    append_attributes(measure, divisions, time, fifths=change // 2 % 5 - 2)
+                else:
+                    append_attributes(measure, None, time)
+            measure_duration = divisions * 4 * time[0] // time[1]
+            for staff in range(1, staves[p] + 1):
+                if staff > 1:
+                    backup = ET.SubElement(measure, 'backup')
+                    ET.SubElement(backup, 'duration').text = str(measure_duration)
+                append_notes(measure, rng, measure_duration, divisions, density, tuplets,
+                             staff if staves[p] > 1 else None)
+    indent(root)
+    return ET.ElementTree(root)
+
+
+def write_score(path, **kwargs):
+    """ Writes generate_score(**kwargs) to path, with an XML declaration and doctype like real MusicXML files. """
+    tree = generate_score(**kwargs)
+    with open(path, 'wb') as f:
+        f.write(b'<?xml version="1.0" encoding="UTF-8" standalone="no"?>\n')
+        f.write(DOCTYPE.encode('ascii'))
+        f.write(ET.tostring(tree.getroot()))
+    return path
+
+
+def append_attributes(measure, divisions, time, fifths=None, staves=None):
+    attributes = ET.SubElement(measure, 'attributes')
+    if divisions is not None:
+        ET.SubElement(attributes, 'divisions').text = str(divisions)
+    if fifths is not None:
+        ET.SubElement(ET.SubElement(attributes, 'key'), 'fifths').text = str(fifths)
+    time_elem = ET.SubElement(attributes, 'time')
+    ET.SubElement(time_elem, 'beats').text = str(time[0])
+    ET.SubElement(time_elem, 'beat-type').text = str(time[1])
+    if staves is not None:
+        if staves > 1:
+            ET.SubElement(attributes, 'staves').text = str(staves)
+        for staff in range(1, staves + 1):
+            clef = ET.SubElement(attributes, 'clef', number=str(staff)) if staves > 1 \
+                else ET.SubElement(attributes, 'clef')
+            ET.SubElement(clef, 'sign').text = 'G' if staff == 1 else 'F'
+            ET.SubElement(clef, 'line').text = '2' if staff == 1 else '4'
+
+
+def append_notes(measure, rng, measure_duration, divisions, density, tuplets, staff):
+    """ Fills one staff of a measure with notes, rests and triplets adding up to exactly measure_duration. """
+    unit = divisions // density
+    remaining = measure_duration
+    while remaining > 0:
+        if remaining >= 2 * unit and rng.random() < tuplets:
+            # Three notes in the time of two units
+            for i in range(3):
+                append_note(measure, rng, 2 * unit // 3, unit / divisions, staff, tuplet=(i == 0, i == 2))
+            remaining -= 2 * unit
+            continue
+        duration = 2 * unit if remaining >= 2 * unit and rng.random() < 0.2 else min(unit, remaining)
+        append_note(measure, rng, duration, duration / divisions, staff, rest=rng.random() < 0.1)
+        remaining -= duration
+
+
+def append_note(measure, rng, duration, quarters, staff, rest=False, tuplet=None):
+    note = ET.SubElement(measure, 'note')
+    if rest:
+        ET.SubElement(note, 'rest')
+    else:
+        pitch = ET.SubElement(note, 'pitch')
+        ET.SubElement(pitch, 'step').text = rng.choice(STEPS)
+        ET.SubElement(pitch, 'octave').text = str(rng.randint(4, 5) - (staff or 1) + 1)
+    ET.SubElement(note, 'duration').text = str(duration)
+    ET.SubElement(note, 'voice').text = str(staff or 1)
+    ET.SubElement(note, 'type').text = NOTE_TYPES.get(quarters, 'quarter')
+    if tuplet is not None:
+        time_mod = ET.SubElement(note, 'time-modification')
+        ET.SubElement(time_mod, 'actual-notes').text = '3'
+        ET.SubElement(time_mod, 'normal-notes').text = '2'
+    if staff is not None:
+        ET.SubElement(note, 'staff').text = str(staff)
+    if tuplet is not None and any(tuplet):
+        notations = ET.SubElement(note, 'notations')
+        ET.SubElement(notations, 'tuplet', type='start' if tuplet[0] else 'stop')
+
+
+def indent(elem, level=0):
+    """ Indents elem in place with two spaces per level, like the MusicXML written by notation software. """
+    pad = "\n" + "  " * level
+    if len(elem):
+        elem.text = pad + "  "
+        for child in elem:
+            indent(child, level + 1)
+            child.tail = pad + "  "
+        child.tail = pad
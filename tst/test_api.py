@@ -0,0 +1,97 @@
+import os
+import shutil
+import tempfile
+import unittest
+import xml.etree.ElementTree as ET
+from urllib.parse import urlsplit, parse_qs
+import api
+from emaMXL.slicer import slice_score_path
+from emaMXL.xmlbackend import tostring
+
+# Score identifiers in addresses are relative to the working directory.
+FIXTURE = os.path.relpath(os.path.join(os.path.dirname(__file__), "data", "fixture_score.xml"))
+
+
+class TestPages(unittest.TestCase):
+    def setUp(self):
+        self.client = api.app.test_client()
+        api.cursors.clear()
+
+    def get(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, response.data)
+        return response
+
+    def test_windows(self):
+        url = f"/{FIXTURE}/pages?staves=1-2&beats=@1-2&completeness=cut&size=3"
+        windows = []
+        while url:
+            response = self.get(url)
+            windows.append((response.headers['X-EMA-Measures'], response.data))
+            link = response.headers.get('Link')
+            url = link[1:link.index('>')] if link else None
+        self.assertEqual([measures for measures, _ in windows], ["1-3", "4-4"])
+        for measures, data in windows:
+            self.assertEqual(data, tostring(slice_score_path(FIXTURE, f"{measures}/1-2/@1-2/cut").getroot()))
+        self.assertEqual(len(api.cursors), 0)
+
+    def test_start_without_cursor(self):
+        response = self.get(f"/{FIXTURE}/pages?size=2&start=2")
+        self.assertEqual(response.headers['X-EMA-Measures'], "2-3")
+        self.assertEqual(response.data, tostring(slice_score_path(FIXTURE, "2-3/all/@all").getroot()))
+        # A cursor is only reused for the window it was made for.
+        query = parse_qs(urlsplit(response.headers['Link'][1:-len('>; rel="next"')]).query)
+        response = self.get(f"/{FIXTURE}/pages?size=2&start=1&cursor={query['cursor'][0]}")
+        self.assertEqual(response.headers['X-EMA-Measures'], "1-2")
+
+    def test_bad_requests(self):
+        self.assertEqual(self.client.get(f"/{FIXTURE}/pages?size=0").status_code, 400)
+        self.assertEqual(self.client.get(f"/{FIXTURE}/pages?start=9").status_code, 400)
+        self.assertEqual(self.client.get(f"/{FIXTURE}/pages?beats=@end-1").status_code, 400)
+
+
+class TestAddress(unittest.TestCase):
+    def setUp(self):
+        self.client = api.app.test_client()
+        self.tmp_dir = tempfile.mkdtemp(dir=os.path.dirname(FIXTURE))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_streamed(self):
+        response = self.client.get(f"/{FIXTURE}/1-2/1-3/@1-1.5/cut")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, tostring(slice_score_path(FIXTURE, "1-2/1-3/@1-1.5/cut").getroot()))
+
+    def test_pages_directory(self):
+        # A score in a directory named 'pages' is addressed as any other, and paged with the same suffix.
+        os.mkdir(os.path.join(self.tmp_dir, "pages"))
+        path = os.path.relpath(os.path.join(self.tmp_dir, "pages", "score.xml"))
+        shutil.copy(FIXTURE, path)
+        response = self.client.get(f"/{path}/1/1/@all")
+        self.assertEqual(response.data, tostring(slice_score_path(FIXTURE, "1/1/@all").getroot()))
+        response = self.client.get(f"/{path}/pages?size=1")
+        self.assertEqual(response.data, tostring(slice_score_path(FIXTURE, "1/all/@all").getroot()))
+
+    def test_routing(self):
+        urls = api.app.url_map.bind('localhost')
+        # The beats segment, which starts with '@', separates the expression from a score identifier with slashes.
+        self.assertEqual(urls.match("/http:/host/a.xml/1-2/1/@all"),
+                         ('address', {'path': "http:/host/a.xml", 'measures': "1-2", 'staves': "1", 'beats': "@all"}))
+        _, args = urls.match("/scores/a.xml/1/1/@all/x@y")
+        self.assertEqual((args['path'], args['beats'], args['completeness']), ("scores/a.xml", "@all", "x@y"))
+
+    def test_failure_before_streaming(self):
+        # The second measure cannot be sliced; this must be reported instead of ending the body after measure 1.
+        tree = ET.parse(FIXTURE)
+        tree.getroot().findall("part/measure")[1].find("note/duration").text = "x"
+        path = os.path.relpath(os.path.join(self.tmp_dir, "broken.xml"))
+        tree.write(path)
+        response = self.client.get(f"/{path}/1-2/1/@all")
+        self.assertEqual(response.status_code, 400, response.data)
+        self.assertIn(b"ValueError", response.data)
+        self.assertEqual(self.client.get(f"/{path}/1/1/@all").status_code, 200)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,140 @@
+import asyncio
+import gzip
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+import xml.etree.ElementTree as ET
+import asgi
+from emaMXL import slicer
+from emaMXL.exceptions import BadApiRequest, WorkerPoolBusy
+
+# Score identifiers in addresses are relative to the working directory, as with api.py.
+FIXTURE = os.path.relpath(os.path.join(os.path.dirname(__file__), "data", "fixture_score.xml"))
+
+
+def request(method, path, body=b'', headers=()):
+    """ Calls the ASGI app and returns (status, headers, body). The path may include a query string. """
+    messages = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': body, 'more_body': False}
+
+    async def send(message):
+        messages.append(message)
+
+    path, _, query_string = path.partition('?')
+    scope = {'type': 'http', 'method': method, 'path': path, 'query_string': query_string.encode('latin-1'),
+             'headers': [(name.encode('latin-1'), value.encode('latin-1')) for name, value in headers]}
+    asyncio.run(asgi.app(scope, receive, send))
+    return messages[0]['status'], dict(messages[0]['headers']), b''.join(m.get('body', b'') for m in messages[1:])
+
+
+class TestAsgi(unittest.TestCase):
+    def test_address(self):
+        status, headers, body = request('GET', f"/{FIXTURE}/1-2/1-3/@1-1.5/cut")
+        self.assertEqual(status, 200)
+        self.assertEqual(body, ET.tostring(slicer.slice_score_path(FIXTURE, "1-2/1-3/@1-1.5/cut").getroot()))
+        status, _, body = request('GET', f"/{FIXTURE}/1/1/@all")
+        self.assertEqual(body, ET.tostring(slicer.slice_score_path(FIXTURE, "1/1/@all").getroot()))
+
+    def test_etag_and_gzip(self):
+        expected = ET.tostring(slicer.slice_score_path(FIXTURE, "2-3/1/@all").getroot())
+        status, headers, body = request('GET', f"/{FIXTURE}/2-3/1/@all", headers=[('Accept-Encoding', 'gzip')])
+        self.assertEqual(headers[b'content-encoding'], b'gzip')
+        self.assertEqual(gzip.decompress(body), expected)
+        etag = headers[b'etag'].decode()
+        self.assertTrue(etag.endswith('-gzip"'))
+        # An equivalent expression has the same ETag, in either encoding.
+        status, headers, body = request('GET', f"/{FIXTURE}/2,3/1/@start-end", headers=[('If-None-Match', etag)])
+        self.assertEqual((status, body), (304, b''))
+        self.assertEqual(headers[b'etag'].decode(), etag[:-len('-gzip"')] + '"')
+
+    def test_result_cache(self):
+        request('GET', f"/{FIXTURE}/1-2/2/@all")
+        with mock.patch.object(asgi, 'slice_address', side_effect=AssertionError):
+            status, _, body = request('GET', f"/{FIXTURE}/1-2/2/@all")
+        self.assertEqual(status, 200)
+        self.assertEqual(body, ET.tostring(slicer.slice_score_path(FIXTURE, "1-2/2/@all").getroot()))
+
+    def test_path_decoded_once(self):
+        # The server has already decoded the path; a score whose name contains '%41' is not 'A'.
+        with tempfile.TemporaryDirectory(dir=os.path.dirname(FIXTURE)) as tmp:
+            score = os.path.join(os.path.relpath(tmp), "score%41.xml")
+            shutil.copy(FIXTURE, score)
+            status, _, body = request('GET', f"/{score}/1/1/@all")
+        self.assertEqual(status, 200, body)
+        self.assertEqual(body, ET.tostring(slicer.slice_score_path(FIXTURE, "1/1/@all").getroot()))
+
+    def test_bad_expression(self):
+        status, headers, body = request('GET', f"/{FIXTURE}/1/1/@end-1")
+        self.assertEqual(status, 400)
+
+    def test_address_many(self):
+        body = json.dumps({"expressions": ["1/1/@all", "1/1/@end-1"]}).encode()
+        status, _, body = request('POST', f"/{FIXTURE}", body)
+        results = json.loads(body)["results"]
+        self.assertEqual(status, 200)
+        self.assertEqual(results[0]["xml"], ET.tostring(slicer.slice_score_path(FIXTURE, "1/1/@all").getroot()).decode())
+        self.assertIn("error", results[1])
+
+    def test_pages(self):
+        url = f"/{FIXTURE}/pages?staves=1-2&beats=@1-2&completeness=cut&size=3"
+        windows = []
+        while url:
+            status, headers, body = request('GET', url)
+            self.assertEqual(status, 200, body)
+            windows.append((headers[b'x-ema-measures'].decode(), body))
+            link = headers.get(b'link', b'').decode()
+            url = link[1:link.index('>')] if link else None
+        self.assertEqual([measures for measures, _ in windows], ["1-3", "4-4"])
+        for measures, data in windows:
+            self.assertEqual(data, ET.tostring(slicer.slice_score_path(FIXTURE, f"{measures}/1-2/@1-2/cut").getroot()))
+        self.assertEqual(request('GET', f"/{FIXTURE}/pages?size=x")[0], 400)
+        with tempfile.TemporaryDirectory(dir=os.path.dirname(FIXTURE)) as tmp:
+            os.mkdir(os.path.join(tmp, "pages"))
+            score = os.path.join(os.path.relpath(tmp), "pages", "score.xml")
+            shutil.copy(FIXTURE, score)
+            status, _, body = request('GET', f"/{score}/1/1/@all")
+        self.assertEqual(body, ET.tostring(slicer.slice_score_path(FIXTURE, "1/1/@all").getroot()))
+
+    def test_split_address(self):
+        self.assertEqual(asgi.split_address("/http://host/a.xml/1-2/1/@all/cut"), ("http://host/a.xml", "1-2/1/@all/cut"))
+        self.assertEqual(asgi.split_address("/scores/a.xml/1-2/1/@all"), ("scores/a.xml", "1-2/1/@all/"))
+        self.assertEqual(asgi.split_address("/scores/a.xml/1-2/1/@all/x@y"), ("scores/a.xml", "1-2/1/@all/x@y"))
+        self.assertRaises(BadApiRequest, asgi.split_address, "/scores/a.xml/1-2/1/all/cut")
+
+
+class TestConcurrencyLimiter(unittest.TestCase):
+    def test_per_key_limit(self):
+        async def scenario():
+            limiter = asgi.ConcurrencyLimiter(total=3, per_key=1, wait_timeout=0.05)
+            await limiter.acquire('a')
+            with self.assertRaises(WorkerPoolBusy):
+                await limiter.acquire('a')
+            # Other scores are not held up by 'a'.
+            await limiter.acquire('b')
+            limiter.release('a')
+            await limiter.acquire('a')
+            limiter.release('a')
+            limiter.release('b')
+            self.assertEqual(limiter._keys, {})
+
+        asyncio.run(scenario())
+
+    def test_total_limit(self):
+        async def scenario():
+            limiter = asgi.ConcurrencyLimiter(total=1, per_key=1, wait_timeout=0.05)
+            await limiter.acquire('a')
+            with self.assertRaises(WorkerPoolBusy):
+                await limiter.acquire('b')
+            limiter.release('a')
+            await limiter.acquire('b')
+
+        asyncio.run(scenario())
+
+
+if __name__ == '__main__':
+    unittest.main()
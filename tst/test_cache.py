@@ -0,0 +1,60 @@
+import os
+import shutil
+import tempfile
+import unittest
+import xml.etree.ElementTree as ET
+from emaMXL.cache import ScoreCache, load_score
+from emaMXL.slicer import slice_score_path
+
+FIXTURE = os.path.join(os.path.dirname(__file__), "data", "fixture_score.xml")
+
+
+class TestScoreCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, "score.xml")
+        shutil.copy(FIXTURE, self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_hit_and_invalidation(self):
+        cache = ScoreCache()
+        tree = cache.get(self.path)
+        self.assertIs(cache.get(self.path), tree)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+        with open(self.path, "a") as f:
+            f.write("\n")
+        self.assertIsNot(cache.get(self.path), tree)
+        self.assertEqual(len(cache), 1)
+
+    def test_memory_budget(self):
+        other = os.path.join(self.tmp_dir, "other.xml")
+        shutil.copy(FIXTURE, other)
+        cache = ScoreCache(max_bytes=os.path.getsize(FIXTURE) * 15)
+        cache.get(self.path)
+        cache.get(other)
+        self.assertEqual(len(cache), 1)
+        self.assertLessEqual(cache.current_bytes, cache.max_bytes)
+
+    def test_path_locks_bounded(self):
+        cache = ScoreCache(max_bytes=os.path.getsize(FIXTURE) * 15)
+        locks = list(cache._path_locks)
+        for i in range(10):
+            path = os.path.join(self.tmp_dir, f"score{i}.xml")
+            shutil.copy(FIXTURE, path)
+            cache.get(path)
+        self.assertEqual(cache._path_locks, locks)
+
+    def test_cached_tree_unchanged(self):
+        original = ET.tostring(ET.parse(self.path).getroot())
+        for exp_str in ["2/1-3/@1-2/cut", "1,3/1,2/@1,@2-3"]:
+            cached = slice_score_path(self.path, exp_str)
+            uncached = slice_score_path(self.path, exp_str, use_cache=False)
+            self.assertEqual(ET.tostring(cached.getroot()), ET.tostring(uncached.getroot()))
+        self.assertEqual(ET.tostring(load_score(self.path).getroot()), original)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+import random
+import unittest
+from emaMXL.emaexp import EmaExp, parse_ema_exp
+from emaMXL.emaexpfull import BeatIntervals, EmaRangeFull, RangeMap, expand_ema_exp, expand_selection
+from emaMXL.exceptions import BadApiRequest
+
+SCORE_INFO = {'measure': {'start': 1, 'end': 8}, 'staff': {'start': 1, 'end': 3}}
+EXPRESSIONS = ["1-1,3/1+2/@1.0-2", "start-end/all/@all", "all/1-2/@1-1.5@3-end", "2,4/1+3,2/@1+@2-3,@start-2",
+               "1/2/@1.3333333333333333-2/cut", "3-end/start-2/@2"]
+
+
+def selection_repr(selection):
+    return {m: {s: [str(r) for r in ranges] for s, ranges in staves.items()} for m, staves in selection.items()}
+
+
+class TestBeatIntervals(unittest.TestCase):
+    def test_matches_contains_note(self):
+        rng = random.Random(0)
+        for _ in range(500):
+            divisions = rng.choice([1, 2, 3, 4, 6, 8])
+            ranges = []
+            for _ in range(rng.randint(0, 5)):
+                start = 1 + rng.randint(0, 8) / 2
+                end = 'end' if rng.random() < 0.1 else start + rng.randint(0, 4) / 2
+                ranges.append(EmaRangeFull(start, end))
+            intervals = BeatIntervals(ranges, divisions)
+            scaled = [r.scale_beat(divisions) for r in ranges]
+            for start_time in range(0, 6 * divisions):
+                for duration in [1, 2, divisions, 3 * divisions]:
+                    end_time = start_time + duration
+                    expected = any(r.contains_note(start_time, end_time) for r in scaled)
+                    self.assertEqual(intervals.match(start_time, end_time) is not None, expected)
+
+    def test_merged_interval(self):
+        intervals = BeatIntervals([EmaRangeFull(2, 3), EmaRangeFull(1, 2), EmaRangeFull(4, 'end')], 2)
+        self.assertEqual((intervals.starts, intervals.ends), ([0, 6], [4, float('inf')]))
+        self.assertEqual(intervals.merged, [True, False])
+        # The match is the last range selecting the note, in the order requested, as 'cut' trims notes to it.
+        self.assertEqual(str(intervals.match(1, 3)), "[0 2]")
+        self.assertEqual(str(intervals.match(3, 5)), "[2 4]")
+        self.assertEqual(str(intervals.match(7, 8)), "[6 end]")
+        self.assertIsNone(intervals.match(4, 6))
+
+
+class TestExpressionCache(unittest.TestCase):
+    def test_normalized_round_trip(self):
+        self.assertEqual(EmaExp("1-1,3/1+2/@1.0-2").normalized, "1,3/1+2/@1-2")
+        for exp_str in EXPRESSIONS:
+            ema_exp = EmaExp(exp_str)
+            reparsed = EmaExp(ema_exp.normalized)
+            self.assertEqual(reparsed.normalized, ema_exp.normalized)
+            self.assertEqual(reparsed.completeness, ema_exp.completeness)
+            self.assertEqual(selection_repr(expand_ema_exp(SCORE_INFO, reparsed)),
+                             selection_repr(expand_ema_exp(SCORE_INFO, ema_exp)))
+
+    def test_parse_is_cached(self):
+        self.assertIs(parse_ema_exp("1-2/1/@all"), parse_ema_exp("1-2/1/@all"))
+
+    def test_expansion_shared_by_equivalent_expressions(self):
+        first = expand_selection(EmaExp("1-2/1/@1.0-2/cut").normalized_selection, 8, 3)
+        second = expand_selection(EmaExp("1-2/1-1/@1-2").normalized_selection, 8, 3)
+        self.assertIs(first, second)
+        self.assertIsNot(first, expand_selection(EmaExp("1-2/1/@1-2").normalized_selection, 9, 3))
+
+    def test_all(self):
+        selection = expand_ema_exp(SCORE_INFO, EmaExp("all/all/@all"))
+        self.assertEqual(sorted(selection), list(range(1, 9)))
+        self.assertEqual(sorted(selection[8]), [1, 2, 3])
+        self.assertEqual(str(selection[8][3][0]), "[1 end]")
+
+
+class TestRangeMap(unittest.TestCase):
+    def test_lookup(self):
+        range_map = RangeMap([(2, 4, 'a'), (7, 7, 'b')])
+        self.assertEqual([k in range_map for k in range(1, 9)], [False, True, True, True, False, False, True, False])
+        self.assertEqual(range_map[3], 'a')
+        self.assertEqual(range_map.get(5, []), [])
+        self.assertRaises(KeyError, range_map.__getitem__, 8)
+        self.assertEqual(list(range_map), [2, 3, 4, 7])
+        self.assertEqual(len(range_map), 4)
+        self.assertEqual(list(range_map.keys_between(3, 7)), [3, 4, 7])
+        self.assertTrue(range_map.intersects(5, 7))
+        self.assertFalse(range_map.intersects(5, 6))
+
+    def test_selection_is_compact(self):
+        score_info = {'measure': {'start': 1, 'end': 10000}, 'staff': {'start': 1, 'end': 30}}
+        selection = expand_ema_exp(score_info, EmaExp("all/all/@all"))
+        self.assertEqual(len(selection.starts), 1)
+        self.assertEqual(len(selection[10000].starts), 1)
+        self.assertEqual(str(selection[10000][30][0]), "[1 end]")
+
+    def test_overlapping_requests_merge(self):
+        selection = expand_ema_exp(SCORE_INFO, EmaExp("1-2,2/1,2,1/@1,@2,@3"))
+        self.assertEqual(selection_repr(selection), {1: {1: ["[1.0 1.0]"]}, 2: {1: ["[3.0 3.0]"], 2: ["[2.0 2.0]"]}})
+        selection = expand_ema_exp(SCORE_INFO, EmaExp("1-3,2-4/1/@1"))
+        self.assertEqual(selection_repr(selection)[2], {1: ["[1.0 1.0]", "[1.0 1.0]"]})
+        self.assertEqual(sorted(selection), [1, 2, 3, 4])
+
+    def test_mismatched_groups(self):
+        self.assertRaises(BadApiRequest, expand_ema_exp, SCORE_INFO, EmaExp("1-100/1,2/@all"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+import os
+import unittest
+from emaMXL import slicer
+from emaMXL.metrics import Metrics, NULL_TIMER, metrics
+
+FIXTURE = os.path.join(os.path.dirname(__file__), "data", "fixture_score.xml")
+
+
+class TestMetrics(unittest.TestCase):
+    def test_disabled_is_noop(self):
+        collector = Metrics()
+        self.assertIs(collector.stage('parse'), NULL_TIMER)
+        collector.count('notes_examined')
+        collector.observe('parse', 0.1)
+        self.assertEqual(dict(collector.counters), {})
+        self.assertEqual(collector.histograms, {})
+
+    def test_render(self):
+        collector = Metrics(enabled=True, buckets=(0.01, 0.1))
+        collector.observe('slice', 0.005)
+        collector.observe('slice', 0.05)
+        collector.observe('slice', 3)
+        collector.count('notes_trimmed', 2)
+        lines = collector.render().splitlines()
+        self.assertIn("ema_notes_trimmed_total 2", lines)
+        self.assertIn('ema_stage_seconds_bucket{stage="slice",le="0.01"} 1', lines)
+        self.assertIn('ema_stage_seconds_bucket{stage="slice",le="0.1"} 2', lines)
+        self.assertIn('ema_stage_seconds_bucket{stage="slice",le="+Inf"} 3', lines)
+        self.assertIn('ema_stage_seconds_count{stage="slice"} 3', lines)
+
+
+class TestSlicerInstrumentation(unittest.TestCase):
+    def setUp(self):
+        self.was_enabled = metrics.enabled
+        metrics.enabled = True
+        metrics.reset()
+
+    def tearDown(self):
+        metrics.enabled = self.was_enabled
+        metrics.reset()
+
+    def test_counts(self):
+        slicer.slice_score_path(FIXTURE, "1-2/1-3/@1-1.5/cut", use_cache=False)
+        self.assertEqual(metrics.counters['measures_visited'], 4)
+        self.assertGreater(metrics.counters['notes_examined'], 0)
+        self.assertGreater(metrics.counters['notes_trimmed'], 0)
+        self.assertGreater(metrics.counters['rests_inserted'], 0)
+        for stage in ['parse', 'index', 'parse_expression', 'expand', 'slice']:
+            self.assertEqual(sum(metrics.histograms[stage][0]), 1, stage)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from emaMXL.remote import RemoteScoreFetcher, remote_url
+from emaMXL.slicer import slice_score_path
+
+FIXTURE = os.path.join(os.path.dirname(__file__), "data", "fixture_score.xml")
+
+
+class ScoreHandler(BaseHTTPRequestHandler):
+    """ Serves the fixture score with an ETag, answering 304 when the client already has it. """
+    etag = '"v1"'
+    delay = 0
+    requests_seen = []
+
+    def do_GET(self):
+        self.requests_seen.append((self.path, self.headers.get("If-None-Match")))
+        time.sleep(self.delay)
+        if self.headers.get("If-None-Match") == self.etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        with open(FIXTURE, "rb") as f:
+            body = f.read()
+        self.send_response(200)
+        self.send_header("ETag", self.etag)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestRemoteScoreFetcher(unittest.TestCase):
+    def setUp(self):
+        ScoreHandler.requests_seen = []
+        ScoreHandler.delay = 0
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), ScoreHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self.server.server_port}/scores/fixture.xml"
+        self.cache_dir = tempfile.mkdtemp()
+        self.fetcher = RemoteScoreFetcher(self.cache_dir)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.cache_dir)
+
+    def test_conditional_get(self):
+        path = self.fetcher.fetch(self.url)
+        mtime = os.stat(path).st_mtime_ns
+        self.assertEqual(self.fetcher.fetch(self.url), path)
+        self.assertEqual(ScoreHandler.requests_seen, [("/scores/fixture.xml", None), ("/scores/fixture.xml", '"v1"')])
+        self.assertEqual(os.stat(path).st_mtime_ns, mtime)
+        self.assertEqual(slice_score_path(path, "1/1/@1").getroot().tag, "score-partwise")
+
+    def test_concurrent_fetches_share_download(self):
+        ScoreHandler.delay = 0.2
+        paths = []
+        threads = [threading.Thread(target=lambda: paths.append(self.fetcher.fetch(self.url))) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(set(paths)), 1)
+        self.assertEqual(len(paths), 5)
+        self.assertEqual(len(ScoreHandler.requests_seen), 1)
+
+    def test_remote_url(self):
+        self.assertEqual(remote_url("http:/example.org/a.xml"), "http://example.org/a.xml")
+        self.assertIsNone(remote_url("data/scores/a.xml"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+import os
+import tempfile
+import unittest
+from emaMXL.emaexp import EmaExp
+from emaMXL.emaexpfull import EmaExpFull
+from emaMXL.resultcache import ResultCache, score_fingerprint, result_key
+
+FIXTURE = os.path.join(os.path.dirname(__file__), "data", "fixture_score.xml")
+
+
+class TestResultKey(unittest.TestCase):
+    def key(self, exp_str):
+        digest, score_info = score_fingerprint(FIXTURE)
+        return result_key(digest, EmaExpFull(score_info, EmaExp(exp_str)))
+
+    def test_equivalent_expressions(self):
+        self.assertEqual(self.key("1-3/1/@1-2"), self.key("1,2,3/1/@1-1.5@1.5-2"))
+        self.assertEqual(self.key("all/all/@all"), self.key("start-end/1-3/@start-end"))
+        self.assertEqual(self.key("2/1+2/@1-2+@1-2"), self.key("2/1-2/@2-2@1-2"))
+
+    def test_different_expressions(self):
+        self.assertNotEqual(self.key("1-3/1/@1-2"), self.key("1-3/1/@1-2/cut"))
+        self.assertNotEqual(self.key("1-3/1/@1-2"), self.key("1-3/2/@1-2"))
+        self.assertNotEqual(self.key("1-3/1/@1-2"), self.key("1-3/1/@1-2.5"))
+        # With 'cut', notes are trimmed to the ranges as requested, so touching ranges are not merged.
+        self.assertEqual(self.key("1/1/@1-2@2-3"), self.key("1/1/@1-3"))
+        self.assertNotEqual(self.key("1/1/@1-2@2-3/cut"), self.key("1/1/@1-3/cut"))
+        self.assertNotEqual(self.key("1/1/@1-2@2-3/cut"), self.key("1/1/@2-3@1-2/cut"))
+
+    def test_fingerprint(self):
+        digest, score_info = score_fingerprint(FIXTURE)
+        self.assertEqual(len(digest), 64)
+        self.assertEqual(score_info, {'measure': {'start': 1, 'end': 4}, 'staff': {'start': 1, 'end': 3}})
+
+
+class TestResultCache(unittest.TestCase):
+    def test_lru(self):
+        cache = ResultCache(max_bytes=10, max_entry_bytes=10)
+        cache.put('a', b'aaaa')
+        cache.put('b', b'bbbb')
+        self.assertEqual(cache.get('a'), b'aaaa')
+        cache.put('c', b'cccc')
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), b'aaaa')
+        self.assertEqual(cache.current_bytes, 8)
+        cache.put('d', b'd' * 11)
+        self.assertIsNone(cache.get('d'))
+
+    def test_tee(self):
+        cache = ResultCache(max_bytes=100, max_entry_bytes=6)
+        self.assertEqual(list(cache.tee('a', [b'ab', b'cd'])), [b'ab', b'cd'])
+        self.assertEqual(cache.get('a'), b'abcd')
+        self.assertEqual(list(cache.tee('b', [b'abcd', b'efgh'])), [b'abcd', b'efgh'])
+        self.assertIsNone(cache.get('b'))
+        chunks = cache.tee('c', [b'ab', b'cd'])
+        next(chunks)
+        chunks.close()
+        self.assertIsNone(cache.get('c'))
+
+    def test_disk_tier(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = ResultCache(max_bytes=4, max_entry_bytes=4, disk_dir=tmp, max_disk_bytes=10)
+            cache.put('a', b'aaaa')
+            cache.put('b', b'bbbb')
+            self.assertEqual(cache.get('a'), b'aaaa')
+            self.assertEqual(ResultCache(disk_dir=tmp).get('b'), b'bbbb')
+            os.utime(os.path.join(tmp, 'a.xml'), (0, 0))
+            cache.put('c', b'cccc')
+            self.assertEqual(sorted(os.listdir(tmp)), ['b.xml', 'c.xml'])
+
+
+if __name__ == '__main__':
+    unittest.main()
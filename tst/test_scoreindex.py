@@ -0,0 +1,52 @@
+import copy
+import os
+import tempfile
+import unittest
+from emaMXL.emaexpfull import get_score_info_mxl
+from emaMXL.scoreindex import ScoreIndex, find_part_bytes, read_part
+from emaMXL.xmlbackend import tostring
+
+FIXTURE = os.path.join(os.path.dirname(__file__), "data", "fixture_score.xml")
+
+
+class TestScoreIndex(unittest.TestCase):
+    def setUp(self):
+        self.index = ScoreIndex.from_path(FIXTURE)
+
+    def test_shape(self):
+        self.assertEqual(self.index.measure_count, 4)
+        self.assertEqual(self.index.staff_count, 3)
+        self.assertEqual([(p.part_id, p.starting_staff, p.staves) for p in self.index.parts],
+                         [("P1", 1, 1), ("P2", 2, 2)])
+        self.assertEqual(self.index.part_for_staff(3).part_id, "P2")
+        self.assertEqual(get_score_info_mxl(self.index.tree), self.index.score_info)
+
+    def test_carried_attributes(self):
+        piano = self.index.parts[1].measures
+        self.assertEqual([m.divisions for m in piano], [6, 6, 6, 6])
+        self.assertEqual([m.time for m in piano], [(4, 4), (4, 4), (3, 4), (3, 4)])
+        self.assertIsNone(piano[1].attributes)
+        self.assertIs(piano[2].element, self.index.parts[1].element[2])
+
+    def test_read_part(self):
+        with open(FIXTURE, 'rb') as f:
+            data = f.read()
+        self.assertIsNotNone(find_part_bytes(data, 1))
+        # A comment could hide a start tag from the scan, so the score is parsed with iterparse instead.
+        with tempfile.TemporaryDirectory() as tmp:
+            commented = os.path.join(tmp, "commented.xml")
+            with open(commented, 'wb') as f:
+                f.write(data.replace(b'</measure>', b'</measure><!-- <part id="X"> -->', 1))
+            self.assertIsNone(find_part_bytes(data.replace(b'</measure>', b'</measure><!-- -->', 1), 1))
+            for source in [FIXTURE, commented]:
+                for position, part_index in enumerate(self.index.parts):
+                    expected = copy.deepcopy(part_index.element)
+                    expected.tail = None
+                    part, size = read_part(source, position)
+                    self.assertEqual(tostring(part), tostring(expected))
+                    self.assertGreater(size, 0)
+                self.assertRaises(ValueError, read_part, source, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,172 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+import xml.etree.ElementTree as ET
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import quote, unquote
+from emaMXL.slicer import slice_score_path
+from scraper import Scraper, Manifest, W3C_HAS_SRC, MANIFEST_NAME, score_path, selection_path, cases_from_manifest, \
+    evaluate_cases, evaluation_report, compare_trees
+
+NANOPUB_DIR = os.path.join(os.path.dirname(__file__), "data", "nanopubs")
+FIXTURE = os.path.join(os.path.dirname(__file__), "data", "fixture_score.xml")
+
+
+def copy_convert(mei_path, xml_path):
+    """ Stands in for the music21 conversion. """
+    shutil.copy(mei_path, xml_path)
+    return xml_path
+
+
+class NanopubHandler(BaseHTTPRequestHandler):
+    """ Stands in for the nanopub and EMA servers: one page of nanopubs, whose JSON-LD documents point at EMA URLs
+        for the MEI files in tst/data/nanopubs. The EMA server answers with the whole score as the selection. """
+    nanopubs = []  # (MEI file name, EMA expression), in page order
+    requests_seen = []
+
+    def do_GET(self):
+        self.requests_seen.append(self.path)
+        base = f"http://127.0.0.1:{self.server.server_port}"
+        if self.path == "/nanopubs.html?page=1":
+            links = "".join(f'<a href="np{i}.jsonld" type="application/ld+json">jsonld</a>'
+                            for i in range(len(self.nanopubs)))
+            self.send_body(f"<html><body>{links}</body></html>".encode())
+        elif self.path.endswith(".jsonld"):
+            mei_name, expression = self.nanopubs[int(self.path[len("/np"):-len(".jsonld")])]
+            mei_url = quote(f"{base}/mei/{mei_name}", safe="")
+            document = [{"@graph": [{"@id": "assertion"}, {W3C_HAS_SRC: [{"@id": f"{base}/ema/{mei_url}/{expression}"}]}]}]
+            self.send_body(json.dumps(document).encode())
+        elif self.path.startswith(("/mei/", "/ema/")):
+            mei_name = unquote(self.path.split("/")[2]).split("/")[-1]
+            mei_path = os.path.join(NANOPUB_DIR, mei_name)
+            if not os.path.exists(mei_path):
+                self.send_error(404)
+                return
+            with open(mei_path, "rb") as f:
+                self.send_body(f.read())
+        else:
+            self.send_error(404)
+
+    def send_body(self, body):
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestScraper(unittest.TestCase):
+    def setUp(self):
+        NanopubHandler.nanopubs = [("fixture.mei", "1/1/@all"), ("fixture.mei", "1-2/1/@1"), ("missing.mei", "1/1/@1")]
+        NanopubHandler.requests_seen = []
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), NanopubHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.base_url = f"http://127.0.0.1:{self.server.server_port}"
+        self.data_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.data_dir)
+
+    def scrape(self, convert=copy_convert, retry_failed=False):
+        with Scraper(self.base_url, self.data_dir, jobs=4, convert_workers=2, convert=convert) as scraper:
+            return scraper.scrape_pages([1], retry_failed)
+
+    def test_scrape(self):
+        results = self.scrape()
+        self.assertEqual([results[i]['status'] for i in range(3)], ['done', 'done', 'failed'])
+        self.assertEqual((results[1]['score'], results[1]['expression']), ('fixture', '1-2/1/@1'))
+        self.assertIn("404", results[2]['error'])
+        self.assertTrue(os.path.exists(score_path('fixture', self.data_dir)))
+        self.assertTrue(os.path.exists(selection_path(1, self.data_dir)))
+        # The score shared by two nanopubs is downloaded once.
+        self.assertEqual(NanopubHandler.requests_seen.count("/mei/fixture.mei"), 1)
+
+    def test_resume(self):
+        self.scrape()
+        NanopubHandler.requests_seen = []
+        results = self.scrape()
+        self.assertEqual([results[i]['status'] for i in range(3)], ['done', 'done', 'failed'])
+        self.assertEqual(NanopubHandler.requests_seen, ["/nanopubs.html?page=1"])
+
+        NanopubHandler.nanopubs[2] = ("fixture.mei", "2/1/@1")
+        results = self.scrape(retry_failed=True)
+        self.assertEqual(results[2]['status'], 'done')
+        self.assertNotIn("/np0.jsonld", NanopubHandler.requests_seen)
+
+    def test_music21_conversion(self):
+        NanopubHandler.nanopubs = NanopubHandler.nanopubs[:1]
+        results = self.scrape(convert=None)
+        self.assertEqual(results[0]['status'], 'done', results[0].get('error'))
+        self.assertEqual(ET.parse(score_path('fixture', self.data_dir)).getroot().tag, 'score-partwise')
+
+
+class TestManifest(unittest.TestCase):
+    def test_last_entry_wins_and_partial_lines_are_ignored(self):
+        path = os.path.join(tempfile.mkdtemp(), "manifest.jsonl")
+        manifest = Manifest(path)
+        manifest.record("nanopub/1", "failed", error="timeout")
+        manifest.record("nanopub/1", "done")
+        with open(path, "a") as f:
+            f.write('{"key": "nanopub/2", "sta')
+        manifest = Manifest(path)
+        self.assertTrue(manifest.is_done("nanopub/1"))
+        self.assertIsNone(manifest.get("nanopub/2"))
+        manifest.record("nanopub/2", "done")
+        self.assertTrue(Manifest(path).is_done("nanopub/2"))
+        shutil.rmtree(os.path.dirname(path))
+
+
+class TestEvaluation(unittest.TestCase):
+    def setUp(self):
+        self.data_dir = tempfile.mkdtemp()
+        for subdir in ("scores", "selections"):
+            os.makedirs(os.path.join(self.data_dir, subdir))
+        shutil.copy(FIXTURE, score_path("fixture", self.data_dir))
+        manifest = Manifest(os.path.join(self.data_dir, MANIFEST_NAME))
+        # nanopub -> (expression, expression of the expected selection); 22 is a known-bad nanopub.
+        cases = {0: ("1-2/1-3/@1-2", "1-2/1-3/@1-2"), 1: ("1-2/1-3/@all", "1/1-3/@all"), 22: ("1/1/@1", "2/1/@1"),
+                 3: ("1/1/@1", None)}
+        for nanopub_num, (expression, expected) in cases.items():
+            manifest.record(f"nanopub/{nanopub_num}", "done", score="fixture", expression=expression)
+            if expected is not None:
+                slice_score_path(FIXTURE, expected).write(selection_path(nanopub_num, self.data_dir))
+
+    def tearDown(self):
+        shutil.rmtree(self.data_dir)
+
+    def test_evaluate_cases(self):
+        cases = cases_from_manifest(self.data_dir)
+        results = {result['nanopub']: result for result in evaluate_cases(cases, workers=2, chunksize=1)}
+        self.assertEqual({num: result['status'] for num, result in results.items()},
+                         {0: 'pass', 1: 'fail', 22: 'known-bad', 3: 'error'})
+        self.assertEqual(results[1]['first_difference'], "/score-partwise/part[1]")
+        self.assertIn('slice', results[0]['seconds'])
+        self.assertEqual(evaluation_report(list(results.values()))['summary'],
+                         {'pass': 1, 'fail': 1, 'known-bad': 1, 'error': 1})
+
+    def test_first_difference(self):
+        root = slice_score_path(FIXTURE, "all/all/@all").getroot()
+        expected = slice_score_path(FIXTURE, "all/all/@all").getroot()
+        self.assertIsNone(compare_trees(root, expected))
+        measure = expected.findall("part")[1].findall("measure")[2]
+        measure.remove(measure.findall("note")[1])
+        path, elem1, elem2 = compare_trees(root, expected)
+        self.assertEqual(path, "/score-partwise/part[2]/measure[3]")
+        self.assertIs(elem2, measure)
+        # Children are matched by tag, so reordering differently tagged siblings is not a difference.
+        expected = slice_score_path(FIXTURE, "all/all/@all").getroot()
+        first = expected.find("part/measure")
+        first.append(first[0])
+        first.remove(first[0])
+        self.assertIsNone(compare_trees(root, expected))
+
+
+if __name__ == '__main__':
+    unittest.main()
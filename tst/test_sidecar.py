@@ -0,0 +1,83 @@
+import io
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+import xml.etree.ElementTree as ET
+from emaMXL import sidecar
+from emaMXL.emaexp import parse_ema_exp
+from emaMXL.emaexpfull import EmaExpFull
+from emaMXL.scoreindex import ScoreIndex
+from emaMXL.slicer import slice_score_path
+from emaMXL.sidecar import load_sidecar, main, read_score_index, sidecar_path, write_sidecar
+from emaMXL.streaming import slice_score_stream
+
+FIXTURE = os.path.join(os.path.dirname(__file__), "data", "fixture_score.xml")
+
+
+def index_facts(score_index):
+    return [(p.part_id, p.starting_staff, p.staves,
+             [(m.number, m.divisions, m.time, m.staves, m.has_attributes) for m in p.measures])
+            for p in score_index.parts]
+
+
+class TestSidecar(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, "score.xml")
+        shutil.copy(FIXTURE, self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_round_trip(self):
+        self.assertIsNone(load_sidecar(self.path))
+        write_sidecar(self.path)
+        stored = load_sidecar(self.path)
+        tree_index = ScoreIndex.from_path(self.path)
+        self.assertEqual(index_facts(stored), index_facts(tree_index))
+        self.assertEqual(stored.score_info, tree_index.score_info)
+
+        bound = read_score_index(self.path).bound()
+        self.assertEqual([[m.attributes is not None for m in p.measures] for p in bound.parts],
+                         [[m.attributes is not None for m in p.measures] for p in tree_index.parts])
+
+    def test_validation(self):
+        write_sidecar(self.path)
+        os.utime(self.path, ns=(0, 0))
+        self.assertIsNotNone(load_sidecar(self.path))  # Same content, new mtime
+        # The sidecar now records the new mtime, so the score is not hashed again.
+        with mock.patch.object(sidecar, 'file_digest', side_effect=AssertionError):
+            self.assertIsNotNone(load_sidecar(self.path))
+        with open(self.path, "r+b") as f:
+            f.write(b"<!-- -->")
+        self.assertIsNone(load_sidecar(self.path))
+
+    def test_parsed_only_to_slice(self):
+        write_sidecar(self.path)
+        score_index = read_score_index(self.path)
+        tree_index = ScoreIndex.from_path(self.path)
+        with mock.patch.object(sidecar.xmlbackend, 'parse', side_effect=AssertionError):
+            ema_exp_full = EmaExpFull(score_index, parse_ema_exp("2/1-3/@1-2/cut"))
+            self.assertEqual(score_index.score_info, tree_index.score_info)
+        self.assertEqual(ema_exp_full.canonical(), EmaExpFull(tree_index, parse_ema_exp("2/1-3/@1-2/cut")).canonical())
+        self.assertEqual(ET.tostring(score_index.tree.getroot()), ET.tostring(tree_index.tree.getroot()))
+        self.assertEqual(index_facts(score_index), index_facts(tree_index))
+        self.assertEqual(ET.tostring(slice_score_path(self.path, "2/1-3/@1-2/cut").getroot()),
+                         ET.tostring(slice_score_path(self.path, "2/1-3/@1-2/cut", use_cache=False).getroot()))
+
+    def test_cli_and_stream(self):
+        sidecar_dir = os.path.join(self.tmp_dir, "sidecars")
+        self.assertEqual(main([self.tmp_dir, "--sidecar-dir", sidecar_dir]), 0)
+        self.assertTrue(os.path.exists(sidecar_path(self.path, sidecar_dir)))
+        stored = load_sidecar(self.path, sidecar_dir)
+        out = io.BytesIO()
+        slice_score_stream(self.path, "2/1-3/@1-2/cut", out, stored)
+        expected = io.BytesIO()
+        slice_score_stream(self.path, "2/1-3/@1-2/cut", expected)
+        self.assertEqual(out.getvalue(), expected.getvalue())
+
+
+if __name__ == '__main__':
+    unittest.main()
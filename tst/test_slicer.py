@@ -0,0 +1,133 @@
+import os
+import unittest
+import xml.etree.ElementTree as ET
+from emaMXL.exceptions import BadApiRequest
+from emaMXL.cache import load_score_index
+from emaMXL.emaexp import parse_ema_exp
+from emaMXL.emaexpfull import EmaExpFull
+from emaMXL.scoreindex import ScoreIndex
+from emaMXL.slicer import slice_many, slice_score, slice_score_many, slice_score_path, MeasureCursor, rest_durations
+from synthetic import generate_score
+
+FIXTURE = os.path.join(os.path.dirname(__file__), "data", "fixture_score.xml")
+
+
+class TestSliceMany(unittest.TestCase):
+    def test_matches_single_selections(self):
+        exp_strs = ["1/1/@1-2", "x/1/@1", "2/1-3/@1-2/cut", "end-3/1/@1", "1,3/1,2/@1,@2-3"]
+        results = slice_many(FIXTURE, exp_strs)
+        self.assertEqual(len(results), len(exp_strs))
+        self.assertIsInstance(results[1], BadApiRequest)
+        self.assertIsInstance(results[3], BadApiRequest)
+        for i in [0, 2, 4]:
+            expected = slice_score_path(FIXTURE, exp_strs[i], use_cache=False)
+            self.assertEqual(ET.tostring(results[i].getroot()), ET.tostring(expected.getroot()), exp_strs[i])
+
+
+class TestProcessPart(unittest.TestCase):
+    def test_attributes_carried_over_skipped_measures(self):
+        # Measure 3 changes the time signature; selecting only measure 4 must still carry it.
+        tree = slice_score_path(FIXTURE, "4/1-3/@all", use_cache=False)
+        for part in tree.findall("part"):
+            self.assertEqual([m.get("number") for m in part], ["4"])
+            attributes = part.find("measure/attributes")
+            self.assertEqual(attributes.findtext("time/beats"), "3")
+            self.assertIsNotNone(attributes.find("divisions"))
+
+
+def note(step, duration, type_, dot=False):
+    return (f"<note><pitch><step>{step}</step><octave>4</octave></pitch><duration>{duration}</duration>"
+            f"<type>{type_}</type>{'<dot/>' if dot else ''}</note>")
+
+
+class TestCut(unittest.TestCase):
+    SCORE = ('<score-partwise version="3.1"><part-list><score-part id="P1"><part-name>P</part-name></score-part>'
+             '</part-list><part id="P1"><measure number="1"><attributes><divisions>2</divisions><time><beats>4</beats>'
+             '<beat-type>4</beat-type></time></attributes>' + note("C", 3, "quarter", True) +
+             note("D", 3, "quarter", True) + note("E", 2, "quarter") + '</measure></part></score-partwise>')
+
+    def first_notes(self, exp_str):
+        tree = ET.ElementTree(ET.fromstring(self.SCORE))
+        measure = slice_score(tree, EmaExpFull(ScoreIndex(tree), parse_ema_exp(exp_str))).find("part/measure")
+        return [(n.findtext("pitch/step") or "rest", n.findtext("duration")) for n in measure.findall("note")][:2]
+
+    def test_touching_ranges(self):
+        # The dotted quarter C (beats 1-2.5) is trimmed to the last range that selects it, in the order requested.
+        self.assertEqual(self.first_notes("1/1/@1-2@2-3/cut"), [("rest", "2"), ("C", "1")])
+        self.assertEqual(self.first_notes("1/1/@2-3@1-2/cut"), [("C", "2"), ("rest", "1")])
+        self.assertEqual(self.first_notes("1/1/@1-3/cut"), [("C", "3"), ("D", "1")])
+
+
+class TestMeasureCursor(unittest.TestCase):
+    def test_windows_match_selections(self):
+        tree = generate_score(parts=2, staves=[1, 2], measures=30, tuplets=0.3, attribute_every=3)
+        score_index = ScoreIndex(tree)
+        cursor = MeasureCursor(score_index, "2-3", "@1-2.5", "cut", size=4, start=5)
+        windows = [ET.tostring(window.getroot()) for window in cursor]
+        self.assertEqual(len(windows), 7)
+        self.assertTrue(cursor.done)
+        for i, window in enumerate(windows):
+            start = 5 + 4 * i
+            exp_str = f"{start}-{min(start + 3, 30)}/2-3/@1-2.5/cut"
+            expected = slice_score(tree, EmaExpFull(score_index, parse_ema_exp(exp_str)), in_place=False)
+            self.assertEqual(window, ET.tostring(expected.getroot()), exp_str)
+
+    def test_invalid_expression(self):
+        score_index = load_score_index(FIXTURE)
+        self.assertRaises(BadApiRequest, MeasureCursor, score_index, "1", "@end-1")
+        self.assertRaises(BadApiRequest, MeasureCursor, score_index, size=0)
+        self.assertRaises(BadApiRequest, MeasureCursor, score_index, start=5)
+
+
+def staff_durations(tree):
+    """ The total duration of the notes of each staff (the notes between <backup>s) of each measure. """
+    durations = []
+    for measure in tree.getroot().iter('measure'):
+        durations.append([0])
+        for child in measure:
+            if child.tag == 'note':
+                durations[-1][-1] += int(child.findtext('duration'))
+            elif child.tag == 'backup':
+                durations[-1].append(0)
+    return durations
+
+
+class TestNospace(unittest.TestCase):
+    def test_rests_merged(self):
+        measure = slice_score_path(FIXTURE, "1/1/@1-2/nospace", use_cache=False).find("part/measure")
+        notes = [(note.find("rest") is not None, note.findtext("duration"), note.findtext("type"))
+                 for note in measure.findall("note")]
+        self.assertEqual(notes, [(False, "2", "quarter"), (True, "4", "half"), (True, "2", "quarter")])
+
+    def test_unselected_staff_is_measure_rest(self):
+        tree = slice_score_path(FIXTURE, "all/2/@all/nospace", use_cache=False)
+        for measure in tree.find("part"):
+            notes = measure.findall("note")
+            self.assertEqual(len(notes), 1)
+            self.assertEqual(notes[0].find("rest").get("measure"), "yes")
+            self.assertIsNone(notes[0].find("type"))
+
+    def test_same_time_as_raw(self):
+        tree = generate_score(parts=2, staves=[1, 3], measures=12, density=4, tuplets=0.5, attribute_every=3)
+        score_index = ScoreIndex(tree)
+        for exp_str in ["all/2-4/@1-1.5", "all/3/@all", "1-3/all/@1.25-2.5", "2-5/1-2/@2.5-end/cut"]:
+            nospace_str = exp_str.replace("/cut", "") + "/nospace"
+            raw = slice_score(tree, EmaExpFull(score_index, parse_ema_exp(exp_str.replace("/cut", ""))),
+                              in_place=False)
+            nospace = slice_score_many(score_index, [EmaExpFull(score_index, parse_ema_exp(nospace_str))])[0]
+            self.assertEqual(staff_durations(nospace), staff_durations(raw), exp_str)
+            self.assertLess(len(nospace.findall(".//note")), len(raw.findall(".//note")))
+            for note in nospace.iter("note"):
+                if note.find("rest") is not None:
+                    self.assertEqual([child.tag for child in note if child.tag in ("beam", "tie", "lyric")], [])
+
+    def test_rest_durations(self):
+        self.assertEqual(rest_durations(14, 2), [8, 4, 2])
+        self.assertEqual(rest_durations(6, 12, (3, 2)), [4, 2])
+        self.assertEqual(rest_durations(5, 4), [4, 1])
+        self.assertEqual(rest_durations(3, 6, (3, 2)), [2, 1])
+        self.assertEqual(rest_durations(3, 4, (3, 2)), [3])
+
+
+if __name__ == '__main__':
+    unittest.main()
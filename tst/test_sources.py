@@ -0,0 +1,57 @@
+import io
+import os
+import shutil
+import tempfile
+import unittest
+import zipfile
+import xml.etree.ElementTree as ET
+from emaMXL.exceptions import UnsupportedEncoding
+from emaMXL.slicer import slice_score_path
+from emaMXL.sources import open_score, score_size
+from emaMXL.streaming import slice_score_stream
+
+FIXTURE = os.path.join(os.path.dirname(__file__), "data", "fixture_score.xml")
+CONTAINER = """<?xml version="1.0" encoding="UTF-8"?>
+<container>
+  <rootfiles>
+    <rootfile full-path="score/fixture.xml" media-type="application/vnd.recordare.musicxml+xml"/>
+  </rootfiles>
+</container>"""
+
+
+class TestCompressedScores(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, "fixture.mxl")
+        with zipfile.ZipFile(self.path, "w", zipfile.ZIP_DEFLATED) as archive:
+            archive.writestr("mimetype", "application/vnd.recordare.musicxml")
+            archive.writestr("META-INF/container.xml", CONTAINER)
+            archive.write(FIXTURE, "score/fixture.xml")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_open_root_file(self):
+        with open_score(self.path) as f, open(FIXTURE, "rb") as expected:
+            self.assertEqual(f.read(), expected.read())
+        self.assertEqual(score_size(self.path), os.path.getsize(FIXTURE))
+
+    def test_slice_compressed(self):
+        exp_str = "2/1-3/@1-2/cut"
+        expected = ET.tostring(slice_score_path(FIXTURE, exp_str, use_cache=False).getroot())
+        self.assertEqual(ET.tostring(slice_score_path(self.path, exp_str).getroot()), expected)
+        out = io.BytesIO()
+        slice_score_stream(self.path, exp_str, out)
+        self.assertEqual(out.getvalue(), expected)
+
+    def test_missing_root_file(self):
+        bad_path = os.path.join(self.tmp_dir, "bad.mxl")
+        with zipfile.ZipFile(bad_path, "w") as archive:
+            archive.writestr("a.xml", "<a/>")
+            archive.writestr("b.xml", "<b/>")
+        with self.assertRaises(UnsupportedEncoding):
+            open_score(bad_path)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,41 @@
+import gzip
+import io
+import os
+import unittest
+import xml.etree.ElementTree as ET
+from emaMXL.slicer import slice_score_path
+from emaMXL.streaming import scan_score, slice_score_stream, slice_score_chunks, gzip_chunks
+
+FIXTURE = os.path.join(os.path.dirname(__file__), "data", "fixture_score.xml")
+
+
+class TestStreaming(unittest.TestCase):
+    def test_scan_matches_tree_index(self):
+        index = scan_score(FIXTURE)
+        self.assertEqual(index.score_info, {'measure': {'start': 1, 'end': 4}, 'staff': {'start': 1, 'end': 3}})
+        self.assertEqual([m.divisions for m in index.parts[1].measures], [6, 6, 6, 6])
+        self.assertIsNone(index.parts[0].measures[0].element)
+
+    def test_same_output_as_tree_slicer(self):
+        for exp_str in ["1/1/@1-2", "2/1-3/@1-2/cut", "1,3/1,2/@1,@2-3", "3/2/@2/cut", "2-3/2/@1.5-2.5,@2/cut"]:
+            out = io.BytesIO()
+            slice_score_stream(FIXTURE, exp_str, out)
+            tree = slice_score_path(FIXTURE, exp_str, use_cache=False)
+            self.assertEqual(out.getvalue(), ET.tostring(tree.getroot()), exp_str)
+
+
+class TestSerializedChunks(unittest.TestCase):
+    def test_same_output_as_tostring(self):
+        for exp_str in ["1/1/@1-2", "2/1-3/@1-2/cut", "1,3/1,2/@1,@2-3", "2-4/3/@all", "all/all/@all"]:
+            chunks = list(slice_score_chunks(FIXTURE, exp_str, chunk_size=256))
+            self.assertGreater(len(chunks), 1)
+            tree = slice_score_path(FIXTURE, exp_str)
+            self.assertEqual(b''.join(chunks), ET.tostring(tree.getroot()), exp_str)
+
+    def test_gzip(self):
+        chunks = list(slice_score_chunks(FIXTURE, "all/all/@all", chunk_size=256))
+        self.assertEqual(gzip.decompress(b''.join(gzip_chunks(chunks))), b''.join(chunks))
+
+
+if __name__ == '__main__':
+    unittest.main()
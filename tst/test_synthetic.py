@@ -0,0 +1,48 @@
+import os
+import tempfile
+import unittest
+import xml.etree.ElementTree as ET
+from emaMXL import slicer
+from emaMXL.scoreindex import ScoreIndex
+from synthetic import generate_score, write_score
+
+
+class TestSyntheticScore(unittest.TestCase):
+    def test_deterministic(self):
+        first = ET.tostring(generate_score(measures=8, tuplets=0.5, seed=4).getroot())
+        self.assertEqual(first, ET.tostring(generate_score(measures=8, tuplets=0.5, seed=4).getroot()))
+        self.assertNotEqual(first, ET.tostring(generate_score(measures=8, tuplets=0.5, seed=5).getroot()))
+
+    def test_shape(self):
+        score_index = ScoreIndex(generate_score(parts=3, staves=[1, 2, 3], measures=12, attribute_every=3))
+        self.assertEqual(score_index.score_info['measure']['end'], 12)
+        self.assertEqual(score_index.score_info['staff']['end'], 6)
+        piano = score_index.parts[1]
+        self.assertEqual(piano.attribute_measures, [1, 4, 7, 10])
+        self.assertEqual([m.divisions for m in piano.measures[::3]], [12, 12, 24, 24])
+        self.assertEqual([m.time for m in piano.measures[::3]], [(4, 4), (3, 4), (6, 8), (2, 2)])
+
+    def test_measures_are_full(self):
+        tree = generate_score(parts=1, staves=2, measures=10, density=4, tuplets=0.3, attribute_every=2)
+        score_index = ScoreIndex(tree)
+        for info in score_index.parts[0].measures:
+            beats, beat_type = info.time
+            expected = info.divisions * 4 * beats // beat_type
+            total = 0
+            for child in info.element:
+                if child.tag == 'backup':
+                    self.assertEqual(total, expected)
+                    total = 0
+                elif child.tag == 'note':
+                    total += int(child.find('duration').text)
+            self.assertEqual(total, expected)
+
+    def test_slice(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = write_score(os.path.join(tmp, "score.xml"), parts=2, staves=[1, 2], measures=6, attribute_every=2)
+            tree = slicer.slice_score_path(path, "2-5/all/@1.5-2.5/cut", use_cache=False)
+            self.assertEqual([len(part) for part in tree.findall('part')], [4, 4])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+import copy
+import os
+import unittest
+from unittest import mock
+import xml.etree.ElementTree as ET
+from emaMXL import timeline
+from emaMXL.emaexp import parse_ema_exp
+from emaMXL.emaexpfull import EmaExpFull
+from emaMXL.scoreindex import ScoreIndex
+from emaMXL.slicer import slice_score, slice_score_many, attribute_timeline
+from emaMXL.timeline import part_timeline
+from synthetic import generate_score
+
+FIXTURE = os.path.join(os.path.dirname(__file__), "data", "fixture_score.xml")
+EXPRESSIONS = ["1/1/@1-2", "2/1-3/@1-2/cut", "1,3/1,2/@1,@2-3", "all/all/@1-1.5/cut", "1-2/1-3/@1.5-2.5,@2/cut",
+               "all/all/@all/cut", "all/2/@2.5-end/cut", "all/1-2/@1@3/cut", "2,3/all/@2-3,@1/raw",
+               "start-end/start-end/@1.25-1.75/cut"]
+
+
+def sliced_in_place(tree, exp_str):
+    """ The selection made by walking every measure with select_beats. """
+    tree = copy.deepcopy(tree)
+    return ET.tostring(slice_score(tree, EmaExpFull(ScoreIndex(tree), parse_ema_exp(exp_str))).getroot())
+
+
+def sliced_with_timeline(tree, exp_strs):
+    score_index = ScoreIndex(tree)
+    ema_exp_fulls = [EmaExpFull(score_index, parse_ema_exp(exp_str)) for exp_str in exp_strs]
+    return [ET.tostring(result.getroot()) if not isinstance(result, Exception) else type(result)
+            for result in slice_score_many(score_index, ema_exp_fulls)]
+
+
+class TestPartTimeline(unittest.TestCase):
+    def test_columns(self):
+        part = ET.fromstring('<part id="P1"><measure number="1"><attributes><divisions>2</divisions></attributes>'
+                             '<note><pitch/><duration>2</duration><voice>1</voice><staff>1</staff></note>'
+                             '<note><rest/><duration>2</duration><voice>1</voice><staff>1</staff></note>'
+                             '<backup><duration>4</duration></backup>'
+                             '<note><pitch/><duration>4</duration><voice>5</voice><staff>2</staff></note>'
+                             '</measure><measure number="2"><note><pitch/><voice>1</voice></note></measure></part>')
+        root = ET.Element('score-partwise')
+        root.append(part)
+        part_index = ScoreIndex(ET.ElementTree(root)).parts[0]
+        columns = part_timeline(part_index)
+        self.assertIs(part_timeline(part_index), columns)
+        self.assertEqual(len(columns), 3)
+        self.assertEqual(list(columns.onsets), [0, 2, 0])
+        self.assertEqual(list(columns.durations), [2, 2, 4])
+        self.assertEqual(list(columns.staves), [0, 0, 1])
+        self.assertEqual(list(columns.voices), [1, 1, 5])
+        self.assertEqual(list(columns.rests), [0, 1, 0])
+        self.assertEqual(list(columns.positions), [1, 2, 4])
+        # The note without a duration makes measure 2 irregular; select_beats is left to fail on it.
+        self.assertEqual(columns.irregular, [2])
+        self.assertEqual(list(columns.measure_starts), [0, 3, 3])
+
+
+class TestAttributeTimeline(unittest.TestCase):
+    def setUp(self):
+        tree = generate_score(parts=1, staves=2, measures=10, density=2, attribute_every=4)
+        self.part_index = ScoreIndex(tree).parts[0]
+        self.attributes = attribute_timeline(self.part_index)
+
+    def test_effective(self):
+        self.assertIs(attribute_timeline(self.part_index), self.attributes)
+        self.assertEqual(self.attributes.measures, [1, 5, 9])
+        first, second = self.attributes.effective(4), self.attributes.effective(5)
+        self.assertIs(first, self.attributes.effective(1))
+        self.assertEqual(set(first), set(second))
+        self.assertEqual(int(second['divisions'][0]['text']), self.part_index.measures[4].divisions)
+        # Snapshots share the entries they do not change, and cannot be changed.
+        for key in first:
+            if key not in self.attributes.changes[1]:
+                self.assertIs(first[key], second[key])
+        with self.assertRaises(TypeError):
+            second['divisions'] = []
+        self.assertEqual(dict(attribute_timeline(ScoreIndex(ET.parse(FIXTURE)).parts[0]).effective(0)), {})
+
+    def test_element(self):
+        self.assertIsNone(self.attributes.element(1, 4))
+        self.assertIsNone(self.attributes.element(9, 10))
+        element = self.attributes.element(0, 6)
+        self.assertIsNot(self.attributes.element(0, 6), element)
+        self.assertEqual(ET.tostring(self.attributes.element(0, 5)), ET.tostring(element))
+        self.assertEqual(ET.tostring(self.attributes.element(4, 5)),
+                         ET.tostring(self.part_index.measures[4].attributes))
+
+
+class TestTimelineSelection(unittest.TestCase):
+    def check_scores(self):
+        scores = [ET.parse(FIXTURE),
+                  generate_score(parts=2, staves=[1, 3], measures=12, density=4, tuplets=0.3, attribute_every=3),
+                  generate_score(parts=1, staves=2, measures=9, density=2, tuplets=0.5, seed=7)]
+        for tree in scores:
+            expected = [sliced_in_place(tree, exp_str) for exp_str in EXPRESSIONS]
+            self.assertEqual(sliced_with_timeline(tree, EXPRESSIONS), expected)
+
+    def test_same_as_select_beats(self):
+        self.check_scores()
+
+    @unittest.skipIf(timeline.np is None, "numpy is not installed")
+    def test_without_numpy(self):
+        with mock.patch.object(timeline, 'np', None):
+            self.check_scores()
+
+    def test_irregular_measures_are_walked(self):
+        tree = ET.parse(FIXTURE)
+        tree.getroot().find("part/measure/note/duration").text = "x"
+        self.assertEqual(sliced_with_timeline(tree, ["1/1/@1"]), [ValueError])
+        self.assertIsInstance(sliced_with_timeline(tree, ["2/1/@1"])[0], bytes)
+
+
+if __name__ == '__main__':
+    unittest.main()
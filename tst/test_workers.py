@@ -0,0 +1,89 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+import xml.etree.ElementTree as ET
+from emaMXL import slicer
+from emaMXL.exceptions import BadApiRequest, WorkerPoolBusy, WorkerTimeout
+from emaMXL.workers import SlicePool, slice_score_parallel
+from synthetic import write_score
+
+FIXTURE = os.path.join(os.path.dirname(__file__), "data", "fixture_score.xml")
+
+
+class TestSlicePool(unittest.TestCase):
+    def setUp(self):
+        self.pool = SlicePool(1, max_queue=0, timeout=10, max_tasks_per_child=2)
+
+    def tearDown(self):
+        self.pool.close()
+
+    def test_same_as_in_process(self):
+        for exp_str in ["1-2/1-3/@1-1.5/cut", "all/all/@all", "3-4/2/@2-3"]:
+            expected = ET.tostring(slicer.slice_score_path(FIXTURE, exp_str).getroot())
+            self.assertEqual(self.pool.slice(FIXTURE, exp_str), expected)
+
+    def test_slice_many(self):
+        results = self.pool.slice_many(FIXTURE, ["1/1/@all", "1/1/@end-1"])
+        self.assertEqual(results[0], ET.tostring(slicer.slice_score_path(FIXTURE, "1/1/@all").getroot()))
+        self.assertIsInstance(results[1], BadApiRequest)
+
+    def test_errors_are_raised(self):
+        self.assertRaises(BadApiRequest, self.pool.slice, FIXTURE, "1/1/@end-1")
+
+    def test_deadline(self):
+        future = self.pool.start(time.sleep, (1,))
+        start = time.monotonic()
+        self.assertRaises(WorkerTimeout, self.pool.wait, future, start + 0.2)
+        self.assertLess(time.monotonic() - start, 1)
+
+    def test_timeout_and_full_queue(self):
+        self.pool.timeout = 0.2
+        self.assertRaises(WorkerTimeout, self.pool.submit, time.sleep, (1,))
+        # The timed-out request still occupies the only worker.
+        self.assertRaises(WorkerPoolBusy, self.pool.submit, time.sleep, (0,))
+        time.sleep(1.5)
+        self.assertIsNone(self.pool.submit(time.sleep, (0,)))
+
+
+class TestPartSlicing(unittest.TestCase):
+    def setUp(self):
+        self.pool = SlicePool(2, timeout=30)
+        self.tmp_dir = tempfile.mkdtemp()
+        self.score = os.path.join(self.tmp_dir, "parts.xml")
+        write_score(self.score, parts=5, staves=[1, 2, 1, 3, 1], measures=12, tuplets=0.3, attribute_every=4)
+
+    def tearDown(self):
+        self.pool.close()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_same_as_sequential(self):
+        for filepath, exp_str in [(FIXTURE, "1-2/1-3/@1-1.5/cut"), (FIXTURE, "3-4/2/@2-3"),
+                                  (self.score, "all/all/@all"), (self.score, "2-5/3-6/@1-2.5/cut"),
+                                  (self.score, "start-end/1+4+8/@2@3")]:
+            expected = ET.tostring(slicer.slice_score_path(filepath, exp_str).getroot())
+            self.assertEqual(self.pool.slice_parts(filepath, exp_str), expected)
+
+    def test_errors_are_raised(self):
+        self.assertRaises(BadApiRequest, self.pool.slice_parts, FIXTURE, "1/1/@end-1")
+
+    def test_no_selected_parts(self):
+        # The fixture has 4 measures, so no part is selected; the request must not keep its place in the queue.
+        pool = SlicePool(1, max_queue=0, timeout=5)
+        try:
+            for _ in range(3):
+                expected = ET.tostring(slicer.slice_score_path(FIXTURE, "7/1/@all").getroot())
+                self.assertEqual(pool.slice_parts(FIXTURE, "7/1/@all"), expected)
+            self.assertEqual(pool.slice(FIXTURE, "1/1/@all"),
+                             ET.tostring(slicer.slice_score_path(FIXTURE, "1/1/@all").getroot()))
+        finally:
+            pool.close()
+
+    def test_slice_score_parallel(self):
+        expected = ET.tostring(slicer.slice_score_path(self.score, "all/2-4/@1-2").getroot())
+        self.assertEqual(slice_score_parallel(self.score, "all/2-4/@1-2", workers=2), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
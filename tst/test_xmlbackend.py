@@ -0,0 +1,76 @@
+import os
+import unittest
+import xml.etree.ElementTree as ET
+from emaMXL import xmlbackend
+from emaMXL.cache import score_cache
+from emaMXL.scoreindex import read_part
+from emaMXL.slicer import slice_score_path, slice_many
+from emaMXL.streaming import slice_score_chunks
+
+FIXTURE = os.path.join(os.path.dirname(__file__), "data", "fixture_score.xml")
+EXPRESSIONS = ["1/1/@1-2", "2/1-3/@1-2/cut", "1,3/1,2/@1,@2-3", "all/all/@1-1.5/cut", "1-2/1-3/@1.5-2.5,@2/cut",
+               "all/1-2/@2-3/nospace"]
+
+
+def selections(backend):
+    """ Every way of producing a selection, serialized, with scores parsed by the given backend. """
+    xmlbackend.set_backend(backend)
+    score_cache.clear()
+    outputs = []
+    for exp_str in EXPRESSIONS:
+        outputs.append(xmlbackend.tostring(slice_score_path(FIXTURE, exp_str).getroot()))
+        outputs.append(xmlbackend.tostring(slice_score_path(FIXTURE, exp_str, use_cache=False).getroot()))
+        outputs.append(b''.join(slice_score_chunks(FIXTURE, exp_str)))
+    outputs += [xmlbackend.tostring(tree.getroot()) for tree in slice_many(FIXTURE, EXPRESSIONS)]
+    return outputs
+
+
+class TestStdlibBackend(unittest.TestCase):
+    def test_default(self):
+        self.assertEqual(xmlbackend.get_backend().name, xmlbackend.DEFAULT_BACKEND)
+
+    def test_unknown_backend(self):
+        with self.assertRaises(ValueError):
+            xmlbackend.set_backend('expat')
+
+    def test_tostring(self):
+        root = ET.fromstring('<a x="1"><b/></a>')
+        self.assertEqual(xmlbackend.tostring(root), ET.tostring(root))
+        self.assertIsInstance(xmlbackend.element_tree(root), ET.ElementTree)
+
+
+@unittest.skipIf(xmlbackend.lxml_etree is None, "lxml is not installed")
+class TestLxmlBackend(unittest.TestCase):
+    def setUp(self):
+        self.previous = xmlbackend.get_backend().name
+
+    def tearDown(self):
+        xmlbackend.set_backend(self.previous)
+        score_cache.clear()
+
+    def test_tostring_matches_stdlib(self):
+        xml = b'<a x="1&gt;2&quot;&lt;&amp;" y="\xc3\xa9">t&gt;&lt;&amp;"\'<b/><c></c><d z="1"/>\xe2\x82\xac<!--c--></a>'
+        lxml_root = xmlbackend.lxml_etree.fromstring(xml, xmlbackend.get_instance('lxml').parser)
+        self.assertEqual(xmlbackend.tostring(lxml_root), ET.tostring(ET.fromstring(xml)))
+
+    def test_same_selections(self):
+        self.assertEqual(selections('lxml'), selections('stdlib'))
+
+    def test_read_part(self):
+        xmlbackend.set_backend('lxml')
+        part, _ = read_part(FIXTURE, 1)
+        self.assertIsInstance(part, xmlbackend.lxml_etree._Element)
+        xmlbackend.set_backend('stdlib')
+        self.assertEqual(xmlbackend.tostring(part), xmlbackend.tostring(read_part(FIXTURE, 1)[0]))
+
+    def test_cached_trees_outlive_backend_change(self):
+        xmlbackend.set_backend('lxml')
+        score_cache.clear()
+        lxml_output = xmlbackend.tostring(slice_score_path(FIXTURE, "2/1-3/@1-2/cut").getroot())
+        xmlbackend.set_backend('stdlib')
+        # The score parsed with lxml is still cached, and new elements follow its backend.
+        self.assertEqual(xmlbackend.tostring(slice_score_path(FIXTURE, "2/1-3/@1-2/cut").getroot()), lxml_output)
+
+
+if __name__ == '__main__':
+    unittest.main()